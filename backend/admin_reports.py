@@ -0,0 +1,222 @@
+"""Cross-user reports for the admin dashboard.
+
+Each report is a single ``$facet`` aggregation, so one collection scan feeds
+every panel of that report, and it runs against the ``reports`` read
+preference (a secondary by default) rather than the primary. Results are
+cached for ``ADMIN_REPORT_TTL_SECONDS``, and concurrent requests for a report
+that isn't cached share one in-flight aggregation. A dashboard opened in
+several tabs, or by several admins, therefore costs one query per report per
+TTL. Failures are not cached.
+
+``$unionWith`` needs MongoDB 4.4+.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+RECORD_COLLECTIONS = {
+    "single": "single_calculator",
+    "pro": "pro_calculator",
+    "broker": "broker_accounts",
+}
+ACTIVE_WINDOWS_DAYS = (1, 7, 30)
+
+
+class AggregateCache:
+    """TTL cache with single-flight computation per key."""
+
+    def __init__(self, ttl_seconds: float = 60):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]]):
+        try:
+            value = await compute()
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+        self._entries[key] = (time.monotonic(), value)
+        return value
+
+    async def get(self, key: str, compute: Callable[[], Awaitable[Any]], refresh: bool = False):
+        """``(value, age_seconds, cached)`` for ``key``, computing it at most once at a time."""
+        entry = self._entries.get(key)
+        if entry is not None and not refresh:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl_seconds:
+                self.stats["hits"] += 1
+                return entry[1], round(age, 3), True
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = self._in_flight[key] = asyncio.ensure_future(self._compute(key, compute))
+        else:
+            self.stats["coalesced"] += 1
+        # Shield so an admin closing the tab doesn't cancel the query others wait on
+        value = await asyncio.shield(task)
+        return value, 0.0, False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.stats, entries=len(self._entries), in_flight=len(self._in_flight),
+                    ttl_seconds=self.ttl_seconds)
+
+
+def _union_records(fields: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Stages turning every record collection into ``{kind, **fields}`` rows (run on ``single``)."""
+    stages: List[Dict[str, Any]] = [{"$project": {"_id": 0, "kind": {"$literal": "single"}, **fields}}]
+    for kind, collection in RECORD_COLLECTIONS.items():
+        if kind == "single":
+            continue
+        stages.append({"$unionWith": {
+            "coll": collection,
+            "pipeline": [{"$project": {"_id": 0, "kind": {"$literal": kind}, **fields}}],
+        }})
+    return stages
+
+
+def users_pipeline(now: datetime) -> List[Dict[str, Any]]:
+    return [{"$facet": {
+        "totals": [{"$group": {
+            "_id": None,
+            "users": {"$sum": 1},
+            "enabled": {"$sum": {"$cond": [{"$ifNull": ["$is_active", True]}, 1, 0]}},
+        }}, {"$project": {"_id": 0}}],
+        "signups": [
+            {"$match": {"created_at": {"$gte": now - timedelta(days=30)}}},
+            {"$group": {"_id": {"$dateTrunc": {"date": "$created_at", "unit": "day"}}, "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}},
+            {"$project": {"_id": 0, "day": "$_id", "count": 1}},
+        ],
+    }}]
+
+
+def activity_pipeline(now: datetime, top: int) -> List[Dict[str, Any]]:
+    per_user = [
+        {"$group": {
+            "_id": "$user_id",
+            "records": {"$sum": 1},
+            "single": {"$sum": {"$cond": [{"$eq": ["$kind", "single"]}, 1, 0]}},
+            "pro": {"$sum": {"$cond": [{"$eq": ["$kind", "pro"]}, 1, 0]}},
+            "broker": {"$sum": {"$cond": [{"$eq": ["$kind", "broker"]}, 1, 0]}},
+            "last_activity": {"$max": "$updated_at"},
+        }},
+        {"$sort": {"records": -1}},
+    ]
+    active = {
+        f"active_{days}d": [
+            {"$match": {"updated_at": {"$gte": now - timedelta(days=days)}}},
+            {"$group": {"_id": "$user_id"}},
+            {"$count": "users"},
+        ]
+        for days in ACTIVE_WINDOWS_DAYS
+    }
+    return [
+        *_union_records({"user_id": 1, "updated_at": 1}),
+        {"$facet": {
+            "top_users": per_user + [
+                {"$limit": top},
+                {"$lookup": {"from": "users", "localField": "_id", "foreignField": "id",
+                             "pipeline": [{"$project": {"_id": 0, "username": 1}}], "as": "user"}},
+                {"$project": {"_id": 0, "user_id": "$_id", "username": {"$first": "$user.username"},
+                              "records": 1, "single": 1, "pro": 1, "broker": 1, "last_activity": 1}},
+            ],
+            "records_by_kind": [
+                {"$group": {"_id": "$kind", "count": {"$sum": 1}}},
+                {"$project": {"_id": 0, "kind": "$_id", "count": 1}},
+            ],
+            "users_with_records": [{"$group": {"_id": "$user_id"}}, {"$count": "users"}],
+            **active,
+        }},
+    ]
+
+
+def brokers_pipeline() -> List[Dict[str, Any]]:
+    totals = {
+        "accounts": {"$sum": 1},
+        "balance": {"$sum": {"$ifNull": ["$balance", 0]}},
+        "average_balance": {"$avg": {"$ifNull": ["$balance", 0]}},
+        "average_commission_rate": {"$avg": "$commission_rate"},
+    }
+    rounded = {
+        "_id": 0, "accounts": 1,
+        "balance": {"$round": ["$balance", 2]},
+        "average_balance": {"$round": ["$average_balance", 2]},
+        "average_commission_rate": {"$round": ["$average_commission_rate", 4]},
+    }
+    return [{"$facet": {
+        "by_account_type": [
+            {"$group": {"_id": "$account_type", **totals}},
+            {"$sort": {"balance": -1}},
+            {"$project": {"account_type": "$_id", **rounded}},
+        ],
+        "by_status": [
+            {"$group": {"_id": {"$ifNull": ["$is_active", True]}, **totals}},
+            {"$project": {"is_active": "$_id", **rounded}},
+        ],
+        "overall": [{"$group": {"_id": None, **totals}}, {"$project": rounded}],
+    }}]
+
+
+def _first(rows: List[Dict[str, Any]], field: Optional[str] = None):
+    """Unwrap a one-row facet (``$count`` or ``$group`` on ``None``)."""
+    row = rows[0] if rows else {}
+    return row.get(field, 0) if field else row
+
+
+class AdminReports:
+    REPORTS = ("users", "activity", "brokers")
+
+    def __init__(self, db, cache: AggregateCache, top_users: int = 20):
+        # Read-preference-routed database handle (reports tolerate replica lag)
+        self.db = db
+        self.cache = cache
+        self.top_users = top_users
+
+    @classmethod
+    def from_env(cls, db) -> "AdminReports":
+        return cls(
+            db,
+            AggregateCache(float(os.environ.get('ADMIN_REPORT_TTL_SECONDS', 60))),
+            top_users=int(os.environ.get('ADMIN_REPORT_TOP_USERS', 20)),
+        )
+
+    async def _aggregate(self, collection: str, pipeline: List[Dict[str, Any]]) -> Dict[str, Any]:
+        rows = await self.db[collection].aggregate(pipeline, allowDiskUse=True).to_list(1)
+        return rows[0] if rows else {}
+
+    async def _users(self) -> Dict[str, Any]:
+        facets = await self._aggregate("users", users_pipeline(datetime.utcnow()))
+        return {"totals": _first(facets.get("totals", [])), "signups": facets.get("signups", [])}
+
+    async def _activity(self) -> Dict[str, Any]:
+        facets = await self._aggregate(RECORD_COLLECTIONS["single"],
+                                       activity_pipeline(datetime.utcnow(), self.top_users))
+        result = {name: facets.get(name, []) for name in ("top_users", "records_by_kind")}
+        result["users_with_records"] = _first(facets.get("users_with_records", []), "users")
+        for days in ACTIVE_WINDOWS_DAYS:
+            result[f"active_{days}d"] = _first(facets.get(f"active_{days}d", []), "users")
+        return result
+
+    async def _brokers(self) -> Dict[str, Any]:
+        facets = await self._aggregate(RECORD_COLLECTIONS["broker"], brokers_pipeline())
+        return {
+            "by_account_type": facets.get("by_account_type", []),
+            "by_status": facets.get("by_status", []),
+            "overall": _first(facets.get("overall", [])),
+        }
+
+    async def report(self, name: str, refresh: bool = False) -> Dict[str, Any]:
+        compute = {"users": self._users, "activity": self._activity, "brokers": self._brokers}[name]
+        data, age, cached = await self.cache.get(name, compute, refresh=refresh)
+        return {"report": name, "data": data, "cached": cached, "age_seconds": age}
+
+    async def overview(self, refresh: bool = False) -> Dict[str, Any]:
+        reports = await asyncio.gather(*(self.report(name, refresh) for name in self.REPORTS))
+        return {report["report"]: report for report in reports}
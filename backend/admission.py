@@ -0,0 +1,198 @@
+"""Admission control for reconnect storms.
+
+Token buckets keyed per client IP and per username guard the auth routes, and a
+gate caps how many WebSocket accepts are in flight at once. Rejections carry a
+jittered ``Retry-After`` hint so clients that were refused together do not all
+come back in the same second.
+"""
+import math
+import os
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from pymongo import ReturnDocument
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+@dataclass
+class BucketPolicy:
+    capacity: float
+    refill_per_second: float
+
+    @classmethod
+    def per_minute(cls, burst: float, per_minute: float) -> "BucketPolicy":
+        return cls(capacity=burst, refill_per_second=per_minute / 60.0)
+
+    def seconds_until_token(self, tokens: float) -> float:
+        if self.refill_per_second <= 0:
+            return 60.0
+        return max(0.0, (1.0 - tokens) / self.refill_per_second)
+
+
+class InMemoryBucketStore:
+    """Per-process token buckets, bounded so a storm of new IPs can't grow it forever."""
+
+    def __init__(self, max_keys: int = 50000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, policy: BucketPolicy) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (policy.capacity, now))
+        tokens = min(policy.capacity, tokens + (now - last) * policy.refill_per_second)
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class MongoBucketStore:
+    """Token buckets shared by every worker through a single atomic pipeline update."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._index_ready = False
+
+    async def _ensure_index(self):
+        if not self._index_ready:
+            # Idle buckets are refilled anyway, so expire them after an hour
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self._index_ready = True
+
+    async def take(self, key: str, policy: BucketPolicy) -> Tuple[bool, float]:
+        await self._ensure_index()
+        now = time.time()
+        refilled = {
+            "$min": [
+                policy.capacity,
+                {
+                    "$add": [
+                        {"$ifNull": ["$tokens", policy.capacity]},
+                        {"$multiply": [
+                            {"$subtract": [now, {"$ifNull": ["$ts", now]}]},
+                            policy.refill_per_second,
+                        ]},
+                    ]
+                },
+            ]
+        }
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "ts": now,
+                    "expires_at": {"$add": ["$$NOW", 3600 * 1000]},
+                }},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return bool(doc["allowed"]), float(doc["tokens"])
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: int, scope: str):
+        super().__init__(f"Rate limited ({scope})")
+        self.retry_after = retry_after
+        self.scope = scope
+
+
+def retry_after_with_jitter(base_seconds: float, jitter: float) -> int:
+    """Whole seconds for a Retry-After header, spread by up to ``jitter`` of the base."""
+    spread = base_seconds * random.uniform(0, jitter) if jitter > 0 else 0.0
+    return max(1, math.ceil(base_seconds + spread))
+
+
+class AuthRateLimiter:
+    def __init__(self, store, ip_policy: BucketPolicy, user_policy: BucketPolicy, jitter: float = 0.5):
+        self.store = store
+        self.ip_policy = ip_policy
+        self.user_policy = user_policy
+        self.jitter = jitter
+        self.rejected = 0
+
+    async def check(self, route: str, client_ip: str, username: Optional[str] = None):
+        checks = [(f"{route}:ip:{client_ip}", self.ip_policy, "ip")]
+        if username:
+            checks.append((f"{route}:user:{username.lower()}", self.user_policy, "user"))
+        for key, policy, scope in checks:
+            allowed, tokens = await self.store.take(key, policy)
+            if not allowed:
+                self.rejected += 1
+                wait = policy.seconds_until_token(tokens)
+                raise RateLimited(retry_after_with_jitter(wait, self.jitter), scope)
+
+
+class ConnectionGate:
+    """Caps concurrent WebSocket accepts; callers that don't get a slot are told when to retry."""
+
+    def __init__(self, max_concurrent: int, retry_after: float = 2.0, jitter: float = 0.5):
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.jitter = jitter
+        self.in_flight = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.max_concurrent:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def retry_hint(self) -> int:
+        return retry_after_with_jitter(self.retry_after, self.jitter)
+
+
+def client_ip(request_or_websocket) -> str:
+    if os.environ.get('TRUST_FORWARDED_FOR', 'false').lower() == 'true':
+        forwarded = request_or_websocket.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    client = request_or_websocket.client
+    return client.host if client else "unknown"
+
+
+def build_auth_rate_limiter(db) -> AuthRateLimiter:
+    backend = os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower()
+    store = MongoBucketStore(db.rate_limits) if backend == 'mongo' else InMemoryBucketStore()
+    return AuthRateLimiter(
+        store,
+        ip_policy=BucketPolicy.per_minute(
+            _env_float('AUTH_RATE_LIMIT_IP_BURST', 20),
+            _env_float('AUTH_RATE_LIMIT_IP_PER_MINUTE', 30),
+        ),
+        user_policy=BucketPolicy.per_minute(
+            _env_float('AUTH_RATE_LIMIT_USER_BURST', 5),
+            _env_float('AUTH_RATE_LIMIT_USER_PER_MINUTE', 10),
+        ),
+        jitter=_env_float('RETRY_AFTER_JITTER', 0.5),
+    )
+
+
+def build_connection_gate() -> ConnectionGate:
+    return ConnectionGate(
+        max_concurrent=int(_env_float('WS_MAX_CONCURRENT_ACCEPTS', 64)),
+        retry_after=_env_float('WS_RETRY_AFTER_SECONDS', 2),
+        jitter=_env_float('RETRY_AFTER_JITTER', 0.5),
+    )
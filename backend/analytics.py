@@ -0,0 +1,244 @@
+"""Time-bucketed P&L series served from daily rollups.
+
+``analytics_daily`` holds one document per (user, calculator, UTC day) with the
+summed profit, stake and commission of that day's records. It is maintained
+incrementally: each refresh finds records whose ``updated_at`` is past the
+stored watermark, recomputes only the (user, day) buckets they touch and
+``$merge``s the results over the old buckets, all inside one aggregation on the
+server. Week and month series are grouped from the daily rollup at query time,
+which is at most a few hundred small documents per user-year. Days whose
+records were partly archived add the archive's per-day summary on recompute.
+
+Commission is stored on records as a percentage of gross winnings, so the
+amount is derived as ``stake * (odds - 1) * commission / 100`` (back side for
+the Pro calculator). Margin is profit over stake, in percent. Requires MongoDB
+5.0+ for ``$dateTrunc``/``$dateAdd``.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "analytics_daily"
+WATERMARK_COLLECTION = "analytics_watermarks"
+# Per-day totals of records moved to the archive (see archive.py)
+SUMMARY_COLLECTION = "calculator_archive_daily"
+
+
+def _commission(stake_field: str, odds_field: str) -> Dict[str, Any]:
+    gross = {"$multiply": [
+        {"$ifNull": [stake_field, 0]},
+        {"$subtract": [{"$ifNull": [odds_field, 1]}, 1]},
+    ]}
+    return {"$multiply": [{"$max": [gross, 0]}, {"$divide": [{"$ifNull": ["$commission", 0]}, 100]}]}
+
+
+# account_type -> (source collection, per-record metric expressions)
+SOURCES: Dict[str, Dict[str, Any]] = {
+    "single": {
+        "collection": "single_calculator",
+        "profit": {"$ifNull": ["$potential_profit", 0]},
+        "stake": {"$ifNull": ["$stake", 0]},
+        "commission": _commission("$stake", "$odds"),
+    },
+    "pro": {
+        "collection": "pro_calculator",
+        "profit": {"$ifNull": ["$profit_loss", 0]},
+        "stake": {"$add": [{"$ifNull": ["$back_stake", 0]}, {"$ifNull": ["$lay_stake", 0]}]},
+        "commission": _commission("$back_stake", "$back_odds"),
+    },
+}
+
+
+def refresh_pipeline(account_type: str, low: datetime, high: datetime) -> List[Dict[str, Any]]:
+    source = SOURCES[account_type]
+    return [
+        {"$match": {"updated_at": {"$gt": low, "$lte": high}}},
+        # Buckets touched by changed records since the last refresh
+        {"$group": {"_id": {
+            "user_id": "$user_id",
+            "day": {"$dateTrunc": {"date": "$created_at", "unit": "day"}},
+        }}},
+        # Recompute each touched bucket from all of its records
+        {"$lookup": {
+            "from": source["collection"],
+            "let": {"user_id": "$_id.user_id", "day": "$_id.day"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$user_id", "$$user_id"]},
+                    {"$gte": ["$created_at", "$$day"]},
+                    {"$lt": ["$created_at", {"$dateAdd": {"startDate": "$$day", "unit": "day", "amount": 1}}]},
+                ]}}},
+                {"$group": {
+                    "_id": None,
+                    "profit": {"$sum": source["profit"]},
+                    "stake": {"$sum": source["stake"]},
+                    "commission": {"$sum": source["commission"]},
+                    "count": {"$sum": 1},
+                }},
+            ],
+            "as": "totals",
+        }},
+        {"$unwind": "$totals"},
+        # Plus whatever of that day has already been archived
+        {"$set": {"summary_key": {"user_id": "$_id.user_id", "account_type": account_type, "day": "$_id.day"}}},
+        {"$lookup": {"from": SUMMARY_COLLECTION, "localField": "summary_key", "foreignField": "_id", "as": "archived"}},
+        {"$project": {
+            "_id": {"user_id": "$_id.user_id", "account_type": account_type, "day": "$_id.day"},
+            "user_id": "$_id.user_id",
+            "account_type": account_type,
+            "day": "$_id.day",
+            "profit": {"$add": ["$totals.profit", {"$sum": "$archived.profit"}]},
+            "stake": {"$add": ["$totals.stake", {"$sum": "$archived.stake"}]},
+            "commission": {"$add": ["$totals.commission", {"$sum": "$archived.commission"}]},
+            "count": {"$add": ["$totals.count", {"$sum": "$archived.count"}]},
+            "refreshed_at": "$$NOW",
+        }},
+        {"$merge": {"into": ROLLUP_COLLECTION, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+class AnalyticsRollups:
+    def __init__(self, db, refresh_seconds: float = 60, settle_seconds: float = 5, read_db=None):
+        self.db = db
+        # Series queries only read the rollup, so they can go to a secondary
+        self.read_db = read_db if read_db is not None else db
+        self.refresh_seconds = refresh_seconds
+        # Writes stamped just before "now" may not be visible yet; leave them for the next pass
+        self.settle = timedelta(seconds=settle_seconds)
+        self._task: Optional[asyncio.Task] = None
+        self.last_refresh: Optional[datetime] = None
+
+    @classmethod
+    def from_env(cls, db, read_db=None) -> "AnalyticsRollups":
+        return cls(
+            db,
+            read_db=read_db,
+            refresh_seconds=float(os.environ.get('ANALYTICS_REFRESH_SECONDS', 60)),
+            settle_seconds=float(os.environ.get('ANALYTICS_SETTLE_SECONDS', 5)),
+        )
+
+    async def ensure_indexes(self):
+        for source in SOURCES.values():
+            collection = self.db[source["collection"]]
+            await collection.create_index("updated_at")
+            await collection.create_index([("user_id", 1), ("created_at", 1)])
+        await self.db[ROLLUP_COLLECTION].create_index([("user_id", 1), ("account_type", 1), ("day", 1)])
+
+    async def _acquire_lease(self, account_type: str, now: datetime) -> Optional[datetime]:
+        """Watermark for this account type, or None if another worker holds the refresh lease."""
+        try:
+            doc = await self.db[WATERMARK_COLLECTION].find_one_and_update(
+                {"_id": account_type, "$or": [{"lease_until": {"$lt": now}}, {"lease_until": {"$exists": False}}]},
+                {"$set": {"lease_until": now + timedelta(seconds=max(self.refresh_seconds, 30))}},
+                upsert=True,
+                return_document=False,
+            )
+        except DuplicateKeyError:
+            return None
+        return (doc or {}).get("updated_at", datetime.min)
+
+    async def refresh(self, account_types=None) -> Dict[str, datetime]:
+        """Bring the daily rollup up to date; returns the new watermark per refreshed type."""
+        refreshed = {}
+        for account_type in account_types or SOURCES:
+            now = datetime.utcnow()
+            low = await self._acquire_lease(account_type, now)
+            if low is None:
+                continue
+            high = now - self.settle
+            try:
+                if high > low:
+                    await self.db[SOURCES[account_type]["collection"]].aggregate(
+                        refresh_pipeline(account_type, low, high)
+                    ).to_list(None)
+                    refreshed[account_type] = high
+                    await self.db[WATERMARK_COLLECTION].update_one(
+                        {"_id": account_type}, {"$set": {"updated_at": high}}
+                    )
+            finally:
+                await self.db[WATERMARK_COLLECTION].update_one(
+                    {"_id": account_type}, {"$set": {"lease_until": datetime.min}}
+                )
+        self.last_refresh = datetime.utcnow()
+        return refreshed
+
+    async def rebuild(self, account_type: str) -> Dict[str, datetime]:
+        """Recompute every bucket of one account type from scratch."""
+        await self.db[WATERMARK_COLLECTION].update_one(
+            {"_id": account_type}, {"$set": {"updated_at": datetime.min}}, upsert=True
+        )
+        return await self.refresh([account_type])
+
+    async def series(self, user_id: str, interval: str, account_type: str,
+                     start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        match: Dict[str, Any] = {"user_id": user_id}
+        if account_type != "all":
+            match["account_type"] = account_type
+        if start or end:
+            match["day"] = {}
+            if start:
+                match["day"]["$gte"] = start
+            if end:
+                match["day"]["$lte"] = end
+
+        period: Any = "$day"
+        if interval != "day":
+            period = {"$dateTrunc": {"date": "$day", "unit": interval}}
+            if interval == "week":
+                period["$dateTrunc"]["startOfWeek"] = "monday"
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": period,
+                "profit": {"$sum": "$profit"},
+                "stake": {"$sum": "$stake"},
+                "commission": {"$sum": "$commission"},
+                "count": {"$sum": "$count"},
+            }},
+            {"$sort": {"_id": 1}},
+            {"$project": {
+                "_id": 0,
+                "period": "$_id",
+                "profit": {"$round": ["$profit", 2]},
+                "stake": {"$round": ["$stake", 2]},
+                "commission": {"$round": ["$commission", 2]},
+                "margin": {"$cond": [
+                    {"$gt": ["$stake", 0]},
+                    {"$round": [{"$multiply": [{"$divide": ["$profit", "$stake"]}, 100]}, 2]},
+                    None,
+                ]},
+                "count": 1,
+            }},
+        ]
+        return await self.read_db[ROLLUP_COLLECTION].aggregate(pipeline).to_list(None)
+
+    async def _run(self):
+        try:
+            await self.ensure_indexes()
+        except Exception:
+            logger.exception("Could not create analytics indexes")
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Analytics rollup refresh failed")
+            await asyncio.sleep(self.refresh_seconds)
+
+    def start(self):
+        if self._task is None and self.refresh_seconds > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,313 @@
+"""Hot/cold tiering for calculator records.
+
+Records created more than ``ARCHIVE_AFTER_DAYS`` ago move out of
+``single_calculator``/``pro_calculator``, so those collections (and their
+indexes) hold only the recent working set. Each archive pass takes records
+in ``(user, created_at)`` order and handles one (user, month) batch at a time.
+The batch's ids and a batch id are first journaled on the type's watermark
+document, then:
+
+1. it writes the batch as zstd-compressed NDJSON (BSON extended JSON, so
+   datetimes round-trip). The batch goes either to a ``calculator_archive``
+   document (``ARCHIVE_BACKEND=mongo``) or to a file under
+   ``ARCHIVE_DIR/<type>/<user>/<YYYY-MM>/`` (``ARCHIVE_BACKEND=files``),
+   named by the batch id, so writing it again overwrites it;
+2. it ``$merge``s per-day totals for the batch into
+   ``calculator_archive_daily``. Each day remembers the batch ids it has
+   added, so merging a batch again changes nothing. The analytics refresh
+   adds these summaries when it recomputes a day, so series stay complete;
+3. it deletes the batch from the hot collection.
+
+The journal records the step reached. A pass that dies part-way leaves it
+behind, and the next pass finishes that batch from the same ids before
+taking new ones. The batch is still hot until step 3, so a repeated step 1
+writes the same records.
+
+Only records already covered by the analytics watermark are archived, so the
+rollups have seen them before they go. A pass holds the analytics refresh
+lease of the type it is archiving, so no refresh can recompute a day while
+that day's records are half moved. The lease also keeps two workers from
+archiving the same records.
+
+Exports read the archive first and then the hot collection. An archived
+record that was saved again and now lives hot is exported once, from the hot
+copy, and a record is never exported twice from the archive.
+
+Parquet output would need pyarrow, which is not a dependency; NDJSON.zst
+reads back with ``zstd -dc``.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import zstandard
+from bson import json_util
+from bson.binary import Binary
+from pymongo import ReturnDocument
+
+from analytics import SOURCES, SUMMARY_COLLECTION, WATERMARK_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLLECTION = "calculator_archive"
+LEASE = timedelta(minutes=5)
+_SAFE_PART = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def encode_records(records: List[Dict[str, Any]]) -> bytes:
+    lines = "".join(json_util.dumps(record, json_options=json_util.RELAXED_JSON_OPTIONS) + "\n"
+                    for record in records)
+    return zstandard.ZstdCompressor(level=10).compress(lines.encode())
+
+
+def new_batch_id() -> str:
+    # Sorts by time, so the file store reads batches in the order they were archived
+    return f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:12]}"
+
+
+def decode_records(payload: bytes) -> List[Dict[str, Any]]:
+    text = zstandard.ZstdDecompressor().decompress(payload).decode()
+    return [json_util.loads(line, json_options=json_util.RELAXED_JSON_OPTIONS) for line in text.splitlines() if line]
+
+
+class MongoArchiveStore:
+    """One document per archived (type, user, month) batch, payload compressed."""
+
+    def __init__(self, db):
+        self.collection = db[ARCHIVE_COLLECTION]
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("user_id", 1), ("account_type", 1), ("month", 1)])
+
+    async def write(self, account_type: str, user_id: str, month: str, batch_id: str,
+                    records: List[Dict[str, Any]]) -> int:
+        payload = encode_records(records)
+        await self.collection.replace_one({"_id": batch_id}, {
+            "account_type": account_type,
+            "user_id": user_id,
+            "month": month,
+            "count": len(records),
+            "payload": Binary(payload),
+            "archived_at": datetime.utcnow(),
+        }, upsert=True)
+        return len(payload)
+
+    async def read(self, account_type: str, user_id: str) -> AsyncIterator[List[Dict[str, Any]]]:
+        cursor = self.collection.find({"user_id": user_id, "account_type": account_type}).sort([("month", 1), ("_id", 1)])
+        async for batch in cursor:
+            yield decode_records(batch["payload"])
+
+
+class FileArchiveStore:
+    """``<root>/<type>/<user>/<YYYY-MM>/<batch>.ndjson.zst`` files."""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    async def ensure_indexes(self):
+        await asyncio.to_thread(self.root.mkdir, parents=True, exist_ok=True)
+
+    def _user_dir(self, account_type: str, user_id: str) -> Path:
+        if not _SAFE_PART.match(user_id):
+            raise ValueError(f"Unsafe user id for archive path: {user_id!r}")
+        return self.root / account_type / user_id
+
+    async def write(self, account_type: str, user_id: str, month: str, batch_id: str,
+                    records: List[Dict[str, Any]]) -> int:
+        payload = encode_records(records)
+        directory = self._user_dir(account_type, user_id) / month
+        name = f"{batch_id}.ndjson.zst"
+
+        def write_file():
+            directory.mkdir(parents=True, exist_ok=True)
+            partial = directory / (name + ".tmp")
+            partial.write_bytes(payload)
+            os.replace(partial, directory / name)
+
+        await asyncio.to_thread(write_file)
+        return len(payload)
+
+    async def read(self, account_type: str, user_id: str) -> AsyncIterator[List[Dict[str, Any]]]:
+        user_dir = self._user_dir(account_type, user_id)
+        paths = await asyncio.to_thread(lambda: sorted(user_dir.glob("*/*.ndjson.zst")))
+        for path in paths:
+            yield await asyncio.to_thread(lambda: decode_records(path.read_bytes()))
+
+
+def summary_pipeline(account_type: str, user_id: str, ids: List[str], batch_id: str) -> List[Dict[str, Any]]:
+    """Per-day totals of one batch, added onto earlier summaries of the same days unless already added."""
+    source = SOURCES[account_type]
+    metrics = ("profit", "stake", "commission", "count")
+    batches = {"$ifNull": ["$batches", []]}
+    added = {"$in": [batch_id, batches]}
+    return [
+        {"$match": {"user_id": user_id, "id": {"$in": ids}}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "account_type": account_type,
+                "day": {"$dateTrunc": {"date": "$created_at", "unit": "day"}},
+            },
+            "profit": {"$sum": source["profit"]},
+            "stake": {"$sum": source["stake"]},
+            "commission": {"$sum": source["commission"]},
+            "count": {"$sum": 1},
+        }},
+        {"$set": {"batches": {"$literal": [batch_id]}}},
+        {"$merge": {
+            "into": SUMMARY_COLLECTION,
+            "on": "_id",
+            "whenMatched": [{"$set": {
+                **{name: {"$cond": [added, f"${name}", {"$add": [f"${name}", f"$$new.{name}"]}]} for name in metrics},
+                "batches": {"$cond": [added, batches, {"$concatArrays": [batches, "$$new.batches"]}]},
+            }}],
+            "whenNotMatched": "insert",
+        }},
+    ]
+
+
+class CalculatorArchiver:
+    def __init__(self, db, store, after_days: float = 180, batch_size: int = 1000, interval_seconds: float = 0):
+        self.db = db
+        self.store = store
+        self.after = timedelta(days=after_days)
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_env(cls, db, root_dir: Path) -> "CalculatorArchiver":
+        if os.environ.get('ARCHIVE_BACKEND', 'mongo').lower() == 'files':
+            store = FileArchiveStore(Path(os.environ.get('ARCHIVE_DIR', root_dir / 'archive')))
+        else:
+            store = MongoArchiveStore(db)
+        return cls(
+            db, store,
+            after_days=float(os.environ.get('ARCHIVE_AFTER_DAYS', 180)),
+            batch_size=int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000)),
+            interval_seconds=float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', 0)),
+        )
+
+    async def ensure_indexes(self):
+        await self.store.ensure_indexes()
+
+    async def _lease(self, account_type: str) -> Optional[Dict[str, Any]]:
+        """Take (or renew) the type's refresh lease; None if held elsewhere or never refreshed."""
+        now = datetime.utcnow()
+        return await self.db[WATERMARK_COLLECTION].find_one_and_update(
+            {"_id": account_type, "$or": [{"lease_until": {"$lt": now}}, {"lease_until": {"$exists": False}}]},
+            {"$set": {"lease_until": now + LEASE}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _journal(self, account_type: str, journal: Optional[Dict[str, Any]]):
+        """Record the batch in progress (None when done), renewing the lease."""
+        await self.db[WATERMARK_COLLECTION].update_one(
+            {"_id": account_type}, {"$set": {"lease_until": datetime.utcnow() + LEASE, "archiving": journal}}
+        )
+
+    async def _flush(self, account_type: str, user_id: str, month: str, batch: List[Dict[str, Any]], totals):
+        # Record ids, not _id: in the compact schema (storage_schema.py) the id is the _id
+        journal = {"batch_id": new_batch_id(), "user_id": user_id, "month": month,
+                   "ids": [record["id"] for record in batch], "step": "write"}
+        await self._journal(account_type, journal)
+        await self._finish(account_type, journal, totals, batch)
+
+    async def _finish(self, account_type: str, journal: Dict[str, Any], totals, batch=None):
+        """Run a journaled batch's steps from the one it reached; each is safe to repeat."""
+        collection = self.db[SOURCES[account_type]["collection"]]
+        user_id, ids, batch_id = journal["user_id"], journal["ids"], journal["batch_id"]
+        if journal["step"] == "write":
+            if batch is None:
+                # Resuming: nothing is deleted before step 3, so these are the same records
+                batch = await collection.find({"user_id": user_id, "id": {"$in": ids}}).sort("created_at", 1).to_list(None)
+            totals["bytes"] += await self.store.write(account_type, user_id, journal["month"], batch_id, batch)
+            journal = dict(journal, step="summary")
+            await self._journal(account_type, journal)
+        if journal["step"] == "summary":
+            await collection.aggregate(summary_pipeline(account_type, user_id, ids, batch_id)).to_list(None)
+            journal = dict(journal, step="delete")
+            await self._journal(account_type, journal)
+        result = await collection.delete_many({"user_id": user_id, "id": {"$in": ids}})
+        await self._journal(account_type, None)
+        totals["records"] += result.deleted_count
+        totals["batches"] += 1
+
+    async def archive(self, account_types=None, progress=None) -> Dict[str, Any]:
+        """Move cold records out of the hot collections; returns per-type counts."""
+        started = time.perf_counter()
+        cutoff = datetime.utcnow() - self.after
+        report: Dict[str, Any] = {"cutoff": cutoff.isoformat()}
+        for account_type in account_types or SOURCES:
+            totals = {"records": 0, "batches": 0, "bytes": 0}
+            report[account_type] = totals
+            watermark = await self._lease(account_type)
+            if not watermark or not watermark.get("updated_at"):
+                totals["skipped"] = "analytics refresh running or never run"
+                continue
+            try:
+                if watermark.get("archiving"):
+                    # A pass died part-way through this batch
+                    await self._finish(account_type, watermark["archiving"], totals)
+                await self._archive_type(account_type, cutoff, watermark["updated_at"], totals, progress)
+            finally:
+                await self.db[WATERMARK_COLLECTION].update_one(
+                    {"_id": account_type}, {"$set": {"lease_until": datetime.min}}
+                )
+        report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        self.last_run = report
+        return report
+
+    async def _archive_type(self, account_type: str, cutoff: datetime, watermark: datetime, totals, progress):
+        query = {"created_at": {"$lt": cutoff}, "updated_at": {"$lte": watermark}}
+        cursor = self.db[SOURCES[account_type]["collection"]].find(query).sort([("user_id", 1), ("created_at", 1)])
+        key, batch = None, []
+        async for record in cursor:
+            record_key = (record["user_id"], f"{record['created_at']:%Y-%m}")
+            if batch and (record_key != key or len(batch) >= self.batch_size):
+                await self._flush(account_type, key[0], key[1], batch, totals)
+                batch = []
+                if progress is not None:
+                    await progress(account_type, totals)
+            key = record_key
+            batch.append(record)
+        if batch:
+            await self._flush(account_type, key[0], key[1], batch, totals)
+
+    async def records(self, account_type: str, user_id: str, hot_collection) -> AsyncIterator[Dict[str, Any]]:
+        """Archived records of one user, each once, minus any that also exist hot (saved again since)."""
+        # Also skips a record archived twice, as a batch written before journaling could be
+        seen = set(await hot_collection.distinct("id", {"user_id": user_id}))
+        async for batch in self.store.read(account_type, user_id):
+            for record in batch:
+                if record.get("id") not in seen:
+                    seen.add(record.get("id"))
+                    yield record
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.archive()
+            except Exception:
+                logger.exception("Archive pass failed")
+
+    def start(self):
+        if self._task is None and self.interval_seconds > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,150 @@
+"""Per-request latency of the API on the in-memory and Mongo storage backends.
+
+Run from the backend directory:
+
+    python benchmarks/bench_api.py [--requests 2000] [--records 100] [--backends memory,mongo]
+
+Each backend runs in a fresh interpreter with ``STORAGE_BACKEND`` set. The
+app is driven in-process through httpx's ASGI transport, so there is no
+socket or HTTP parsing in the numbers. Every request still goes through
+the full middleware stack, auth (JWT decode and user lookup), validation,
+the read path and the broadcast path. On ``memory`` the numbers are the
+framework's own cost. The difference on ``mongo`` is the database's share.
+The Mongo run needs ``MONGO_URL`` to reach a server; if none answers, only
+that backend is skipped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+SCENARIOS = ("health/live", "auth/me", "save single", "list single", "save broker", "list broker")
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_backend(requests: int, records: int):
+    """Child side: boot the app, seed one user's records, time each scenario."""
+    sys.path.insert(0, str(BACKEND_DIR))
+    import httpx
+    import server
+
+    await server.startup_event()
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            credentials = {"username": f"bench_{uuid.uuid4().hex[:8]}", "password": "bench-password"}
+            response = await client.post("/api/auth/register", json=dict(credentials, email=f"{credentials['username']}@example.com"))
+            response.raise_for_status()
+            response = await client.post("/api/auth/login", json=credentials)
+            response.raise_for_status()
+            headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+            single_ids = [str(uuid.uuid4()) for _ in range(records)]
+            broker_ids = [str(uuid.uuid4()) for _ in range(records)]
+
+            def single(i):
+                return {"id": single_ids[i % records], "user_id": "set-by-server", "match_name": f"Team {i} vs Team {i + 1}",
+                        "stake": 10.0 + i % 50, "odds": 2.2, "commission": 2.0, "potential_profit": 12.0}
+
+            def broker(i):
+                return {"id": broker_ids[i % records], "user_id": "set-by-server", "account_name": f"Account {i % records}",
+                        "balance": 1000.0 + i, "commission_rate": 2.0}
+
+            for i in range(records):
+                (await client.post("/api/single/data", json=single(i), headers=headers)).raise_for_status()
+                (await client.post("/api/broker/accounts", json=broker(i), headers=headers)).raise_for_status()
+
+            calls = {
+                "health/live": lambda i: client.get("/api/health/live"),
+                "auth/me": lambda i: client.get("/api/auth/me", headers=headers),
+                "save single": lambda i: client.post("/api/single/data", json=single(i), headers=headers),
+                "list single": lambda i: client.get("/api/single/data", params={"view": "list"}, headers=headers),
+                "save broker": lambda i: client.post("/api/broker/accounts", json=broker(i), headers=headers),
+                "list broker": lambda i: client.get("/api/broker/accounts", params={"view": "list"}, headers=headers),
+            }
+            results = {}
+            for name in SCENARIOS:
+                for i in range(min(100, requests)):  # warm-up
+                    await calls[name](i)
+                samples = []
+                for i in range(requests):
+                    started = time.perf_counter()
+                    response = await calls[name](i)
+                    samples.append((time.perf_counter() - started) * 1000)
+                    response.raise_for_status()
+                results[name] = {
+                    "p50_ms": round(statistics.median(samples), 3),
+                    "p99_ms": round(_percentile(samples, 0.99), 3),
+                    "per_second": round(len(samples) / (sum(samples) / 1000)),
+                }
+            return results
+    finally:
+        await server.shutdown_db_client()
+
+
+def run_child(backend: str, requests: int, records: int):
+    env = dict(os.environ, STORAGE_BACKEND=backend)
+    # Fail fast rather than wait out the driver's default 30s when no Mongo is running
+    env.setdefault("MONGO_SERVER_SELECTION_TIMEOUT_MS", "2000")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    result = subprocess.run(
+        [sys.executable, __file__, "--child", backend, "--requests", str(requests), "--records", str(records)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        errors = [line for line in lines if "Error" in line.split(":")[0]]
+        return {"error": (errors or lines or [f"exited with {result.returncode}"])[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000, help="timed requests per scenario")
+    parser.add_argument("--records", type=int, default=100, help="records per list (saves cycle over them)")
+    parser.add_argument("--backends", default="memory,mongo")
+    parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_backend(args.requests, args.records))))
+        return
+
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    report = {backend: run_child(backend, args.requests, args.records) for backend in backends}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.requests} requests per scenario, {args.records} records per list; p50 (p99) in ms\n")
+    print(f"{'scenario':14}" + "".join(f"{backend:>22}" for backend in backends)
+          + (f"{'db share p50':>14}" if {"memory", "mongo"} <= set(backends) else ""))
+    for name in SCENARIOS:
+        row = f"{name:14}"
+        for backend in backends:
+            result = report[backend].get(name)
+            row += f"{result['p50_ms']:>12.3f} ({result['p99_ms']:.3f})".rjust(22) if result else f"{'-':>22}"
+        memory, mongo = report.get("memory", {}).get(name), report.get("mongo", {}).get(name)
+        if memory and mongo:
+            row += f"{mongo['p50_ms'] - memory['p50_ms']:>14.3f}"
+        print(row)
+    for backend in backends:
+        if "error" in report[backend]:
+            print(f"\n{backend}: skipped ({report[backend]['error']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""CPU time per 1000 records for the list endpoints' read path.
+
+Run from the backend directory:
+
+    python benchmarks/bench_read_path.py [--records 1000] [--repeat 50]
+
+"before" is the old path: full documents (with ``_id``) validated into Pydantic
+models, then run through FastAPI's ``jsonable_encoder`` and ``json.dumps``.
+"after" is the trusted path: projected documents encoded straight to JSON.
+Only the Python side is measured; the documents stand in for what the driver
+would hand back, with and without a projection.
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+import read_path
+from server import BrokerAccount, ProCalculatorData, SingleCalculatorData
+
+MODELS = {
+    "single_calculator": SingleCalculatorData,
+    "pro_calculator": ProCalculatorData,
+    "broker_accounts": BrokerAccount,
+}
+
+
+def make_documents(collection_name: str, count: int):
+    model = MODELS[collection_name]
+    now = datetime.utcnow()
+    documents = []
+    for i in range(count):
+        fields = {"user_id": str(uuid.uuid4())}
+        if collection_name == "broker_accounts":
+            fields.update(account_name=f"Account {i}", balance=1000.0 + i, commission_rate=0.02)
+        else:
+            fields.update(match_name=f"Team {i} vs Team {i + 1}")
+        document = model(**fields).dict()
+        document["created_at"] = now - timedelta(minutes=i)
+        document["_id"] = ObjectId()
+        documents.append(document)
+    return documents
+
+
+def project(documents, collection_name: str, view: str):
+    fields = read_path.VIEW_FIELDS[collection_name][view]
+    if fields is None:
+        return [{k: v for k, v in d.items() if k != "_id"} for d in documents]
+    return [{k: d[k] for k in fields} for d in documents]
+
+
+def before(documents, model):
+    return json.dumps(jsonable_encoder([model(**d) for d in documents]))
+
+
+def after(documents):
+    return read_path.dumps(documents)
+
+
+def cpu_ms_per_1000(fn, records: int, repeat: int) -> float:
+    fn()  # warm up
+    started = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - started) * 1000 / repeat * 1000 / records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'collection':<20}{'view':<8}{'before ms':>12}{'after ms':>12}{'speedup':>10}   (CPU per 1000 records)")
+    for collection_name, model in MODELS.items():
+        full = make_documents(collection_name, args.records)
+        baseline = cpu_ms_per_1000(lambda: before(full, model), args.records, args.repeat)
+        for view in ("detail", "list"):
+            projected = project(full, collection_name, view)
+            trusted = cpu_ms_per_1000(lambda: after(projected), args.records, args.repeat)
+            print(f"{collection_name:<20}{view:<8}{baseline:>12.2f}{trusted:>12.2f}{baseline / trusted:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Stake-solver throughput in markets per second.
+
+Run from the backend directory:
+
+    python benchmarks/bench_stake_solver.py [--markets 500] [--outcomes 3] [--accounts 4]
+
+Generates 1X2-style markets priced at every account's bookmaker, with lay
+prices on the exchanges, and solves them the way ``POST /api/solver/stakes``
+does. Reports how many went through the closed form and how many needed the
+LP, since the LP dominates the cost.
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stake_solver import accounts_from_documents, solve_markets
+
+EXCHANGES = {"betfair", "smarkets"}
+
+
+def make_accounts(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    bookmakers = ["betfair", "smarkets", "bet365", "williamhill", "paddypower", "unibet"]
+    return accounts_from_documents([
+        {
+            "id": str(i),
+            "account_name": f"account {i}",
+            "account_type": bookmakers[i % len(bookmakers)],
+            "balance": rng.choice([50, 200, 1000, 5000]),
+            "commission_rate": 0.02 if bookmakers[i % len(bookmakers)] in EXCHANGES else 0,
+        }
+        for i in range(count)
+    ])
+
+
+def make_markets(count: int, outcomes: int, accounts, seed: int = 7):
+    rng = random.Random(seed)
+    markets = []
+    for m in range(count):
+        fair = [rng.uniform(1.5, 6.0) for _ in range(outcomes)]
+        scale = sum(1 / odds for odds in fair)
+        rows = []
+        for o, odds in enumerate(fair):
+            true_odds = odds * scale
+            prices = []
+            for account in accounts:
+                price = {"bookmaker": account.bookmaker, "back": round(true_odds * rng.uniform(0.90, 1.02), 2)}
+                if account.bookmaker in EXCHANGES:
+                    price["lay"] = max(price["back"], round(true_odds * rng.uniform(1.0, 1.05), 2))
+                prices.append(price)
+            rows.append({"name": str(o), "prices": prices})
+        markets.append({"market_id": f"m{m}", "outcomes": rows})
+    return markets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--markets", type=int, default=500)
+    parser.add_argument("--outcomes", type=int, default=3)
+    parser.add_argument("--accounts", type=int, default=4)
+    args = parser.parse_args()
+
+    accounts = make_accounts(args.accounts)
+    markets = make_markets(args.markets, args.outcomes, accounts)
+    started = time.perf_counter()
+    results = solve_markets(markets, accounts)
+    elapsed = time.perf_counter() - started
+
+    methods = {}
+    for result in results:
+        methods[result["method"]] = methods.get(result["method"], 0) + 1
+    profitable = sum(1 for result in results if result["bets"])
+    print(f"{len(markets) / elapsed:,.0f} markets/s ({elapsed * 1000:.0f} ms for {len(markets)}; "
+          f"{profitable} with a guaranteed profit; methods {methods})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Cold-start benchmark and ``-X importtime`` report for the API.
+
+Run from the backend directory:
+
+    python benchmarks/bench_startup.py [--runs 5] [--budget-ms 1500] [--top 15]
+
+Each run is a fresh interpreter that imports ``server``, runs the startup hooks
+and serves one liveness request. The median is checked against the budget, and
+the run fails if any module that should be lazily loaded shows up at import.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Must not be imported just to boot a worker
+LAZY_MODULES = ("pandas", "numpy", "boto3", "passlib", "jose", "bcrypt")
+
+COLD_START_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+# Checked right after import: the TestClient itself may pull in extra modules
+loaded = set(sys.modules)
+from fastapi.testclient import TestClient
+with TestClient(server.app) as client:
+    ready = time.perf_counter()
+    client.get("/api/health/live")
+    served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "first_request_ms": (served - ready) * 1000,
+    "total_ms": (served - started) * 1000,
+    "loaded_lazy_modules": [m for m in %r if m in loaded],
+}))
+"""
+
+
+def _child_env():
+    env = dict(os.environ)
+    # Startup must not depend on the DB being reachable; fail fast if it is touched
+    env.setdefault("MONGO_SERVER_SELECTION_TIMEOUT_MS", "200")
+    return env
+
+
+def cold_start_once(lazy_modules):
+    script = COLD_START_SCRIPT % (lazy_modules,)
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=BACKEND_DIR, env=_child_env(), capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def importtime_report(top: int):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, env=_child_env(), capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.replace("import time:", "", 1).split("|")
+        name = name[1:]  # drop the separator's padding; the rest is nesting indent
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+
+    total_us = sum(self_us for _, self_us, _, _ in rows)
+    return {
+        "total_ms": round(total_us / 1000, 1),
+        "modules": len(rows),
+        "top_cumulative": [
+            {"module": name, "cumulative_ms": round(cum / 1000, 1)}
+            for name, _, cum, depth in sorted(rows, key=lambda r: r[2], reverse=True)
+            if depth <= 1
+        ][:top],
+        "top_packages_self": [
+            {"package": package, "self_ms": round(us / 1000, 1)}
+            for package, us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)
+        ][:top],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("COLD_START_BUDGET_MS", 1500)))
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    args = parser.parse_args()
+
+    runs = [cold_start_once(LAZY_MODULES) for _ in range(args.runs)]
+    median = {key: round(statistics.median(run[key] for run in runs), 1)
+              for key in ("import_ms", "startup_ms", "first_request_ms", "total_ms")}
+    eagerly_loaded = sorted({m for run in runs for m in run["loaded_lazy_modules"]})
+    report = {
+        "runs": args.runs,
+        "budget_ms": args.budget_ms,
+        "median": median,
+        "eagerly_loaded": eagerly_loaded,
+        "importtime": importtime_report(args.top),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Cold start (median of {args.runs}): {median['total_ms']} ms "
+              f"[import {median['import_ms']} / startup {median['startup_ms']} / "
+              f"first request {median['first_request_ms']}] budget {args.budget_ms} ms")
+        print(f"\n-X importtime: {report['importtime']['total_ms']} ms over {report['importtime']['modules']} modules")
+        print("\nTop imports (cumulative):")
+        for row in report["importtime"]["top_cumulative"]:
+            print(f"  {row['cumulative_ms']:>8} ms  {row['module']}")
+        print("\nTop packages (self):")
+        for row in report["importtime"]["top_packages_self"]:
+            print(f"  {row['self_ms']:>8} ms  {row['package']}")
+        if eagerly_loaded:
+            print(f"\nLoaded at import but should be lazy: {', '.join(eagerly_loaded)}")
+
+    if median["total_ms"] > args.budget_ms or eagerly_loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Graceful drain before a worker restarts.
+
+Without it, every socket on a restarting worker drops at the same instant and
+all of those clients reconnect together. ``DrainController.drain()`` instead:
+
+1. marks the worker as draining. ``/api/health/ready`` starts failing so the
+   load balancer stops routing to it, and new WebSocket handshakes get a
+   ``reconnect`` hint and close code 1012 instead of a session;
+2. waits for broadcasts already being sent to finish;
+3. runs the flushers (the write-behind buffer), so acknowledged saves are
+   persisted;
+4. sends every open socket a ``reconnect`` message whose ``retry_after`` is
+   drawn uniformly from ``DRAIN_RECONNECT_SPREAD_SECONDS``, then closes it with
+   1012 (service restart).
+
+All of this is bounded by ``DRAIN_DEADLINE_SECONDS``, after which the
+remaining sockets are closed without waiting. Drain is triggered by SIGTERM
+(after which the server's normal shutdown follows) or by the admin endpoint.
+"""
+import asyncio
+import logging
+import os
+import random
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from starlette.websockets import WebSocket
+
+logger = logging.getLogger(__name__)
+
+SERVICE_RESTART = 1012
+
+
+class DrainController:
+    def __init__(self, manager, flushers: List[Callable[[], Awaitable[Any]]],
+                 deadline_seconds: float = 20, spread_seconds: float = 10):
+        self.manager = manager
+        self.flushers = flushers
+        self.deadline_seconds = deadline_seconds
+        self.spread_seconds = spread_seconds
+        self.draining = False
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.reason: Optional[str] = None
+        self.sockets_closed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, manager, flushers) -> "DrainController":
+        return cls(
+            manager, flushers,
+            deadline_seconds=float(os.environ.get('DRAIN_DEADLINE_SECONDS', 20)),
+            spread_seconds=float(os.environ.get('DRAIN_RECONNECT_SPREAD_SECONDS', 10)),
+        )
+
+    def retry_hint(self) -> float:
+        """Seconds a client should wait before reconnecting, spread across the window."""
+        return round(random.uniform(1.0, max(self.spread_seconds, 1.0)), 3)
+
+    def start(self, reason: str) -> asyncio.Task:
+        """Begin draining (once); returns the drain task."""
+        if self._task is None:
+            self.draining = True
+            self.reason = reason
+            self.started_at = time.monotonic()
+            logger.warning("Draining worker (%s)", reason)
+            self._task = asyncio.ensure_future(self._drain())
+        return self._task
+
+    async def drain(self, reason: str):
+        await asyncio.shield(self.start(reason))
+
+    async def _release(self, websocket: WebSocket, user_id: str):
+        try:
+            await websocket.send_json({
+                "type": "reconnect",
+                "retry_after": self.retry_hint(),
+                "reason": "draining",
+            })
+            await websocket.close(code=SERVICE_RESTART)
+        except Exception:
+            pass  # already gone
+        finally:
+            self.manager.disconnect(websocket, user_id)
+            self.sockets_closed += 1
+
+    async def _drain(self):
+        deadline = self.started_at + self.deadline_seconds
+        try:
+            await asyncio.wait_for(self._drain_steps(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            logger.warning("Drain deadline reached; closing remaining sockets")
+        except Exception:
+            logger.exception("Drain step failed; closing remaining sockets")
+        for user_id, websocket in self.manager.sockets():
+            self.manager.disconnect(websocket, user_id)
+            try:
+                await asyncio.wait_for(websocket.close(code=SERVICE_RESTART), 0.5)
+            except Exception:
+                pass
+            self.sockets_closed += 1
+        self.finished_at = time.monotonic()
+        logger.info("Drain finished in %.1fs, %d sockets released",
+                    self.finished_at - self.started_at, self.sockets_closed)
+
+    async def _drain_steps(self):
+        await self.manager.wait_until_idle()
+        for flush in self.flushers:
+            await flush()
+        await asyncio.gather(*(self._release(websocket, user_id) for user_id, websocket in self.manager.sockets()))
+
+    def install_signal_handler(self, then_signal: int = signal.SIGINT):
+        """Drain on SIGTERM, then re-raise ``then_signal`` so the server shuts down as usual."""
+        loop = asyncio.get_running_loop()
+
+        def on_sigterm():
+            task = self.start("SIGTERM")
+            task.add_done_callback(lambda _: os.kill(os.getpid(), then_signal))
+
+        try:
+            loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+        except (NotImplementedError, RuntimeError):
+            # Not on the main thread (e.g. tests) or no signal support; admin endpoint still works
+            logger.info("SIGTERM drain handler not installed")
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.monotonic()) - self.started_at, 3)
+        return {
+            "draining": self.draining,
+            "reason": self.reason,
+            "finished": self.finished_at is not None,
+            "elapsed_seconds": elapsed,
+            "sockets_closed": self.sockets_closed,
+            "deadline_seconds": self.deadline_seconds,
+        }
@@ -0,0 +1,90 @@
+"""Liveness/readiness probe helpers.
+
+Readiness is polled every second by several load-balancer probes per worker, so
+the Mongo ping is cached for a short TTL and concurrent probes share a single
+in-flight ping instead of each issuing their own. Without Mongo
+(``STORAGE_BACKEND=memory``) there is no ping and no pool to check.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+class CachedPing:
+    def __init__(self, client, ttl_seconds: float = 2.0, timeout_seconds: float = 1.0):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.timeout_seconds = timeout_seconds
+        self._result: Optional[Dict[str, Any]] = None
+        self._checked_at = 0.0
+        self._in_flight: Optional[asyncio.Task] = None
+
+    async def _ping(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.client.admin.command("ping"), self.timeout_seconds)
+            result = {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+        except Exception as exc:
+            result = {"ok": False, "error": type(exc).__name__}
+        self._result = result
+        self._checked_at = time.monotonic()
+        return result
+
+    async def get(self) -> Dict[str, Any]:
+        age = time.monotonic() - self._checked_at
+        if self._result is not None and age < self.ttl_seconds:
+            return dict(self._result, age_seconds=round(age, 3), cached=True)
+        if self._in_flight is None or self._in_flight.done():
+            self._in_flight = asyncio.ensure_future(self._ping())
+        # Shield so a probe that disconnects doesn't cancel the ping others wait on
+        result = await asyncio.shield(self._in_flight)
+        return dict(result, age_seconds=0.0, cached=False)
+
+
+async def measure_loop_lag() -> float:
+    """Milliseconds between scheduling a callback and the loop getting round to it."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    scheduled = time.perf_counter()
+    loop.call_soon(lambda: future.done() or future.set_result(time.perf_counter()))
+    ran = await future
+    return (ran - scheduled) * 1000
+
+
+class ReadinessProbe:
+    def __init__(self, ping: Optional[CachedPing], pool_monitor, manager, loop_monitor=None, drain=None):
+        self.ping = ping
+        self.drain = drain
+        self.pool_monitor = pool_monitor
+        self.manager = manager
+        self.loop_monitor = loop_monitor
+        self.max_loop_lag_ms = float(os.environ.get('READINESS_MAX_LOOP_LAG_MS', 250))
+        self.max_pool_waiters = int(os.environ.get('READINESS_MAX_POOL_WAITERS', 50))
+
+    async def check(self) -> Dict[str, Any]:
+        loop_lag_ms = await measure_loop_lag()
+        if self.loop_monitor is not None:
+            # A stall that just ended won't show up in a single probe-time sample
+            loop_lag_ms = max(loop_lag_ms, self.loop_monitor.recent_max_lag_ms())
+        mongo = await self.ping.get() if self.ping is not None else None
+        pool = self.pool_monitor.snapshot()
+
+        reasons = []
+        if self.drain is not None and self.drain.draining:
+            reasons.append("draining")
+        if mongo is not None and not mongo["ok"]:
+            reasons.append("mongo_unreachable")
+        if loop_lag_ms > self.max_loop_lag_ms:
+            reasons.append("event_loop_lagging")
+        if mongo is not None and pool["waiting"] > self.max_pool_waiters:
+            reasons.append("mongo_pool_exhausted")
+
+        return {
+            "ready": not reasons,
+            "reasons": reasons,
+            "mongo": mongo,
+            "loop_lag_ms": round(loop_lag_ms, 3),
+            "mongo_pool": {k: pool[k] for k in ("max_pool_size", "open", "in_use", "waiting", "saturation")},
+            "websockets": self.manager.connection_counts(),
+        }
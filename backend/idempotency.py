@@ -0,0 +1,343 @@
+"""``Idempotency-Key`` support for the save endpoints.
+
+Clients retry a save after a timeout without knowing whether the first attempt
+landed. When the request carries an ``Idempotency-Key`` header, the first
+attempt claims the key in ``idempotency_keys``. Its 2xx response is stored
+there (for ``IDEMPOTENCY_TTL_SECONDS``, via a TTL index) and in a small
+in-process cache. Any repeat of the key gets that response back with an
+``Idempotent-Replayed: true`` header, without running the handler again: no
+calculator write and no broadcast.
+
+Duplicates that arrive while the first attempt is still running wait for it.
+On the same worker they wait on a future; on another worker they poll the
+stored claim. A claim whose owner died is taken over after
+``IDEMPOTENCY_LOCK_SECONDS``. Non-2xx outcomes release the claim so the retry
+can run. A key is scoped to the caller's credentials and the route, and
+reusing it with a different body is rejected with 422.
+
+With ``STORAGE_BACKEND=memory`` the claims live in a dict in this process
+instead of the collection; replay and waiting work the same, but only within
+one worker.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+from starlette.datastructures import Headers
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+DEFAULT_PATHS = "/api/single/data,/api/pro/data,/api/broker/accounts"
+# Response headers worth replaying; the rest are regenerated per response
+_STORED_HEADERS = {b"content-type", b"x-causal-token"}
+
+
+class IdempotencyMismatch(Exception):
+    pass
+
+
+class IdempotencyBusy(Exception):
+    pass
+
+
+class MongoClaimStore:
+    """Claims shared by every worker through the TTL-indexed ``idempotency_keys`` collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def claim(self, key: str, fingerprint: str, lock_seconds: float, ttl_seconds: float) -> bool:
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "_id": key,
+                "fingerprint": fingerprint,
+                "state": "in_progress",
+                "lock_until": now + timedelta(seconds=lock_seconds),
+                "expires_at": now + timedelta(seconds=ttl_seconds),
+            })
+            return True
+        except DuplicateKeyError:
+            # Take over a claim whose owner never finished (crashed worker)
+            taken = await self.collection.find_one_and_update(
+                {"_id": key, "state": "in_progress", "fingerprint": fingerprint, "lock_until": {"$lt": now}},
+                {"$set": {"lock_until": now + timedelta(seconds=lock_seconds)}},
+            )
+            return taken is not None
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"_id": key})
+
+    async def complete(self, key: str, response: Dict[str, Any]):
+        await self.collection.update_one(
+            {"_id": key}, {"$set": {"state": "done", "response": response}, "$unset": {"lock_until": ""}}
+        )
+
+    async def release(self, key: str):
+        await self.collection.delete_one({"_id": key, "state": "in_progress"})
+
+
+class InMemoryClaimStore:
+    """Per-process claims, bounded like the response cache; expired ones are dropped on access."""
+
+    def __init__(self, max_keys: int = 50000):
+        self.max_keys = max_keys
+        self._claims: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    async def ensure_indexes(self):
+        pass
+
+    def _live(self, key: str) -> Optional[Dict[str, Any]]:
+        claim = self._claims.get(key)
+        if claim is not None and claim["expires_at"] < time.monotonic():
+            del self._claims[key]
+            return None
+        return claim
+
+    async def claim(self, key: str, fingerprint: str, lock_seconds: float, ttl_seconds: float) -> bool:
+        now = time.monotonic()
+        claim = self._live(key)
+        if claim is None:
+            self._claims[key] = {"fingerprint": fingerprint, "state": "in_progress",
+                                 "lock_until": now + lock_seconds, "expires_at": now + ttl_seconds}
+            while len(self._claims) > self.max_keys:
+                self._claims.popitem(last=False)
+            return True
+        if claim["state"] == "in_progress" and claim["fingerprint"] == fingerprint and claim["lock_until"] < now:
+            claim["lock_until"] = now + lock_seconds
+            return True
+        return False
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        claim = self._live(key)
+        return dict(claim) if claim is not None else None
+
+    async def complete(self, key: str, response: Dict[str, Any]):
+        claim = self._live(key)
+        if claim is not None:
+            claim.update(state="done", response=response)
+            claim.pop("lock_until", None)
+
+    async def release(self, key: str):
+        claim = self._live(key)
+        if claim is not None and claim["state"] == "in_progress":
+            del self._claims[key]
+
+
+class IdempotencyStore:
+    def __init__(self, claims, ttl_seconds: float = 86400, lock_seconds: float = 30,
+                 wait_seconds: float = 10, cache_size: int = 10000):
+        self.claims = claims
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[float, str, Dict[str, Any]]]" = OrderedDict()
+        self._local: Dict[str, asyncio.Future] = {}
+        self.stats = {"executed": 0, "replayed": 0, "waited": 0, "mismatched": 0, "busy": 0}
+
+    @classmethod
+    def from_env(cls, db, persistent: bool = True) -> "IdempotencyStore":
+        return cls(
+            MongoClaimStore(db.idempotency_keys) if persistent else InMemoryClaimStore(),
+            ttl_seconds=float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 86400)),
+            lock_seconds=float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', 30)),
+            wait_seconds=float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 10)),
+            cache_size=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000)),
+        )
+
+    async def ensure_indexes(self):
+        await self.claims.ensure_indexes()
+
+    def _cached(self, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, stored_fingerprint, response = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        if stored_fingerprint != fingerprint:
+            self.stats["mismatched"] += 1
+            raise IdempotencyMismatch()
+        return response
+
+    def _remember(self, key: str, fingerprint: str, response: Dict[str, Any]):
+        self._cache.pop(key, None)
+        self._cache[key] = (time.monotonic() + self.ttl_seconds, fingerprint, response)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _settle_local(self, key: str):
+        waiter = self._local.pop(key, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def begin(self, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """The stored response to replay, or None once this request owns the key."""
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            response = self._cached(key, fingerprint)
+            if response is not None:
+                self.stats["replayed"] += 1
+                return response
+
+            waiter = self._local.get(key)
+            if waiter is not None:
+                self.stats["waited"] += 1
+                await asyncio.shield(waiter)
+                continue
+
+            # Register before the DB round-trip so same-worker duplicates queue behind us
+            self._local[key] = asyncio.get_running_loop().create_future()
+            try:
+                claimed = await self.claims.claim(key, fingerprint, self.lock_seconds, self.ttl_seconds)
+            except BaseException:
+                self._settle_local(key)
+                raise
+            if claimed:
+                self.stats["executed"] += 1
+                return None
+            self._settle_local(key)
+
+            doc = await self.claims.get(key)
+            if doc is None:
+                continue  # released (failed first attempt) or expired meanwhile
+            if doc["fingerprint"] != fingerprint:
+                self.stats["mismatched"] += 1
+                raise IdempotencyMismatch()
+            if doc["state"] == "done":
+                self._remember(key, fingerprint, doc["response"])
+                continue
+            if time.monotonic() >= deadline:
+                self.stats["busy"] += 1
+                raise IdempotencyBusy()
+            await asyncio.sleep(0.1)
+
+    async def complete(self, key: str, fingerprint: str, response: Dict[str, Any]):
+        self._remember(key, fingerprint, response)
+        try:
+            await self.claims.complete(key, response)
+        finally:
+            self._settle_local(key)
+
+    async def abort(self, key: str):
+        try:
+            await self.claims.release(key)
+        finally:
+            self._settle_local(key)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.stats, cached=len(self._cache), in_flight=len(self._local))
+
+
+def _json_response(status: int, detail: str, extra_headers: Optional[List[Tuple[bytes, bytes]]] = None):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    return status, headers + (extra_headers or []), body
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware applying ``IdempotencyStore`` to the configured write paths."""
+
+    def __init__(self, app, store: IdempotencyStore, paths: Tuple[str, ...]):
+        self.app = app
+        self.store = store
+        self.paths = set(paths)
+
+    @staticmethod
+    async def _send_response(send, status: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT") or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        request_headers = Headers(scope=scope)
+        idempotency_key = request_headers.get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            return await self.app(scope, receive, send)
+        if len(idempotency_key) > 255:
+            return await self._send_response(send, *_json_response(400, "Idempotency-Key is too long"))
+
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+
+        # Keys are per caller (token) and per route, so clients can't collide with each other
+        caller = hashlib.sha256(request_headers.get("authorization", "").encode()).hexdigest()[:32]
+        key = f"{caller}:{scope['method']} {scope['path']}:{idempotency_key}"
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        try:
+            stored = await self.store.begin(key, fingerprint)
+        except IdempotencyMismatch:
+            return await self._send_response(send, *_json_response(
+                422, "Idempotency-Key was already used with a different request body"))
+        except IdempotencyBusy:
+            return await self._send_response(send, *_json_response(
+                409, "A request with this Idempotency-Key is still in progress", [(b"retry-after", b"1")]))
+        if stored is not None:
+            headers = [(name.encode(), value.encode()) for name, value in stored["headers"]]
+            headers += [(b"content-length", str(len(stored["body"])).encode()), (REPLAYED_HEADER.lower().encode(), b"true")]
+            return await self._send_response(send, stored["status"], headers, stored["body"])
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        captured: Dict[str, Any] = {"status": 500, "headers": [], "body": []}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                captured["headers"] = [
+                    (name.decode(), value.decode()) for name, value in message.get("headers", [])
+                    if name.lower() in _STORED_HEADERS
+                ]
+            elif message["type"] == "http.response.body":
+                captured["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await self.store.abort(key)
+            raise
+        try:
+            if 200 <= captured["status"] < 300:
+                await self.store.complete(key, fingerprint, {
+                    "status": captured["status"],
+                    "headers": captured["headers"],
+                    "body": b"".join(captured["body"]),
+                })
+            else:
+                await self.store.abort(key)
+        except Exception:
+            # The response is already sent; a stale claim just expires after the lock timeout
+            logger.exception("Could not record outcome for idempotency key %s", idempotency_key)
+
+
+def idempotent_paths() -> Tuple[str, ...]:
+    return tuple(path.strip() for path in os.environ.get('IDEMPOTENCY_PATHS', DEFAULT_PATHS).split(",") if path.strip())
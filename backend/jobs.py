@@ -0,0 +1,345 @@
+"""Background jobs: persisted in ``jobs``, scheduled on the event loop.
+
+Each job type is registered with a per-type concurrency limit. Handlers are
+coroutines that receive a ``JobContext``; they report progress through it
+(persisted at most every ``PROGRESS_INTERVAL`` seconds and pushed to the
+owner's sockets as ``job_progress`` messages), hand CPU-bound steps to a
+process pool with ``run_cpu`` and store downloadable output in GridFS.
+
+Cancelling a job on this worker cancels its task; the ``cancel_requested``
+flag covers jobs running on another worker and is checked at every progress
+update. A CPU step already handed to the pool runs to completion first.
+
+Every job is stamped with the worker that owns it, and that worker refreshes
+``heartbeat_at`` on all of its queued and running jobs every
+``JOB_HEARTBEAT_SECONDS``. A job whose heartbeat is older than
+``JOB_STALE_SECONDS`` belonged to a worker that died; any worker marks it
+failed on its next beat. Jobs waiting on their type's semaphore, or running
+for a long time, keep beating, so they are never taken for dead.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
+
+from models import BrokerAccount, Job, ProCalculatorData, SingleCalculatorData
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 0.5
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobError(Exception):
+    """Submission rejected (unknown type, bad params, not allowed)."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class JobType:
+    name: str
+    handler: Callable[["JobContext", Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+    semaphore: asyncio.Semaphore
+    admin_only: bool = False
+    # Params passed to the handler but not persisted on the job document (e.g. import rows)
+    transient_params: Tuple[str, ...] = ()
+
+
+@dataclass
+class JobContext:
+    runner: "JobRunner"
+    job: Job
+    _last_progress: float = field(default=0.0)
+
+    @property
+    def user_id(self) -> str:
+        return self.job.user_id
+
+    @property
+    def db(self):
+        return self.runner.db
+
+    async def progress(self, fraction: float, message: str = "", force: bool = False):
+        self.job.progress = max(0.0, min(1.0, fraction))
+        self.job.message = message
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        doc = await self.runner.db.jobs.find_one_and_update(
+            {"id": self.job.id},
+            {"$set": {"progress": self.job.progress, "message": message, "updated_at": datetime.utcnow()}},
+            projection={"cancel_requested": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        await self.runner.notify(self.job)
+        if doc and doc.get("cancel_requested"):
+            raise JobCancelled()
+
+    async def run_cpu(self, fn: Callable, *args):
+        """Run a picklable top-level function in the process pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.runner.process_pool(), fn, *args)
+
+    async def store_result(self, filename: str, data: bytes, content_type: str) -> str:
+        file_id = await self.runner.results.upload_from_stream(
+            filename, data,
+            metadata={"job_id": self.job.id, "user_id": self.job.user_id, "content_type": content_type},
+        )
+        return str(file_id)
+
+
+class JobRunner:
+    def __init__(self, db, manager, process_workers: int = 2, stale_seconds: float = 300,
+                 heartbeat_seconds: float = 30):
+        self.db = db
+        self.manager = manager
+        self.process_workers = process_workers
+        self.stale_seconds = stale_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        # Unique per process lifetime, so a recycled pid can't inherit a dead worker's jobs
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self.types: Dict[str, JobType] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.results = AsyncIOMotorGridFSBucket(db, bucket_name="job_results")
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, db, manager) -> "JobRunner":
+        return cls(
+            db, manager,
+            process_workers=int(os.environ.get('JOB_PROCESS_WORKERS', min(2, os.cpu_count() or 1))),
+            stale_seconds=float(os.environ.get('JOB_STALE_SECONDS', 300)),
+            heartbeat_seconds=float(os.environ.get('JOB_HEARTBEAT_SECONDS', 30)),
+        )
+
+    def process_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, not fork: a forked child would inherit the Mongo driver's threads and sockets
+            self._pool = ProcessPoolExecutor(self.process_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def job_type(self, name: str, concurrency: int = 1, admin_only: bool = False,
+                 transient_params: Tuple[str, ...] = ()):
+        def register(handler):
+            self.types[name] = JobType(name, handler, asyncio.Semaphore(concurrency), admin_only, transient_params)
+            return handler
+        return register
+
+    async def notify(self, job: Job):
+        await self.manager.broadcast_to_user({
+            "type": "job_progress",
+            "job": {
+                "id": job.id,
+                "type": job.type,
+                "status": job.status,
+                "progress": job.progress,
+                "message": job.message,
+                "error": job.error,
+            },
+            "timestamp": datetime.utcnow().isoformat()
+        }, job.user_id)
+
+    async def submit(self, user_id: str, job_type: str, params: Dict[str, Any], is_admin: bool = False) -> Job:
+        spec = self.types.get(job_type)
+        if spec is None:
+            raise JobError(f"Unknown job type: {job_type}")
+        if spec.admin_only and not is_admin:
+            raise JobError("Admin access required", status_code=403)
+
+        stored_params = {k: v for k, v in params.items() if k not in spec.transient_params}
+        for name in spec.transient_params:
+            if isinstance(params.get(name), list):
+                stored_params[f"{name}_count"] = len(params[name])
+        job = Job(user_id=user_id, type=job_type, params=stored_params)
+        await self.db.jobs.insert_one(dict(job.dict(), owner=self.worker_id, heartbeat_at=job.created_at))
+        self.tasks[job.id] = asyncio.ensure_future(self._execute(job, spec, params))
+        return job
+
+    async def _set(self, job: Job, **fields):
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.updated_at = datetime.utcnow()
+        await self.db.jobs.update_one({"id": job.id}, {"$set": dict(fields, updated_at=job.updated_at)})
+        await self.notify(job)
+
+    async def _execute(self, job: Job, spec: JobType, params: Dict[str, Any]):
+        try:
+            async with spec.semaphore:
+                await self._set(job, status="running", started_at=datetime.utcnow())
+                ctx = JobContext(self, job)
+                result = await spec.handler(ctx, params)
+            await self._set(job, status="succeeded", progress=1.0, result=result or {},
+                            finished_at=datetime.utcnow())
+        except (asyncio.CancelledError, JobCancelled):
+            if self._closing:
+                await self._set(job, status="failed", error="Interrupted by shutdown", finished_at=datetime.utcnow())
+            else:
+                await self._set(job, status="cancelled", finished_at=datetime.utcnow())
+        except Exception as exc:
+            logger.exception("Job %s (%s) failed", job.id, job.type)
+            await self._set(job, status="failed", error=str(exc) or type(exc).__name__,
+                            finished_at=datetime.utcnow())
+        finally:
+            self.tasks.pop(job.id, None)
+
+    async def get(self, job_id: str, user_id: str) -> Optional[Job]:
+        doc = await self.db.jobs.find_one({"id": job_id, "user_id": user_id}, {"_id": 0})
+        return Job(**doc) if doc else None
+
+    async def list(self, user_id: str, limit: int = 50) -> List[Job]:
+        docs = await self.db.jobs.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(limit)
+        return [Job(**doc) for doc in docs]
+
+    async def cancel(self, job_id: str, user_id: str) -> Optional[Job]:
+        job = await self.get(job_id, user_id)
+        if job is None or job.status in FINISHED:
+            return job
+        task = self.tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        else:
+            await self.db.jobs.update_one({"id": job_id}, {"$set": {"cancel_requested": True}})
+        job.cancel_requested = True
+        return job
+
+    async def open_result(self, job: Job):
+        """GridFS stream for a finished job's output, or None."""
+        file_id = (job.result or {}).get("file_id")
+        if not file_id:
+            return None
+        from bson import ObjectId
+        return await self.results.open_download_stream(ObjectId(file_id))
+
+    async def heartbeat(self):
+        """Show the jobs this worker still holds (queued or running) are alive."""
+        if self.tasks:
+            await self.db.jobs.update_many(
+                {"id": {"$in": list(self.tasks)}, "owner": self.worker_id},
+                {"$set": {"heartbeat_at": datetime.utcnow()}},
+            )
+
+    async def recover_stale(self):
+        """Fail jobs left queued/running by a worker that died without finishing them."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        result = await self.db.jobs.update_many(
+            {
+                "status": {"$in": ["queued", "running"]},
+                "owner": {"$ne": self.worker_id},
+                # Jobs from before heartbeats only have updated_at to go on
+                "$or": [
+                    {"heartbeat_at": {"$lt": cutoff}},
+                    {"heartbeat_at": {"$exists": False}, "updated_at": {"$lt": cutoff}},
+                ],
+            },
+            {"$set": {"status": "failed", "error": "Interrupted", "finished_at": datetime.utcnow()}},
+        )
+        if result.modified_count:
+            logger.info("Marked %d interrupted jobs as failed", result.modified_count)
+
+    async def ensure_indexes(self):
+        await self.db.jobs.create_index("id", unique=True)
+        await self.db.jobs.create_index([("user_id", 1), ("created_at", -1)])
+        await self.db.jobs.create_index([("status", 1), ("heartbeat_at", 1)])
+
+    async def _run(self):
+        try:
+            await self.ensure_indexes()
+        except Exception:
+            logger.exception("Could not create job indexes")
+        while True:
+            try:
+                await self.heartbeat()
+                await self.recover_stale()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+            await asyncio.sleep(self.heartbeat_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "running": len(self.tasks),
+            "free_slots": {name: spec.semaphore._value for name, spec in self.types.items()},
+            "process_pool": self._pool is not None,
+        }
+
+    async def close(self):
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self.tasks.values()):
+            task.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# CPU-bound steps (run in the process pool, so top-level and picklable)
+
+IMPORT_MODELS = {
+    "single": SingleCalculatorData,
+    "pro": ProCalculatorData,
+    "broker": BrokerAccount,
+}
+
+
+def render_export(documents: List[Dict[str, Any]], fields: List[str], fmt: str) -> bytes:
+    def plain(value):
+        return value.isoformat() if isinstance(value, datetime) else value
+
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps({name: plain(doc.get(name)) for name in fields}) + "\n" for doc in documents
+        ).encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for doc in documents:
+        writer.writerow([plain(doc.get(name, "")) for name in fields])
+    return buffer.getvalue().encode()
+
+
+def validate_records(kind: str, records: List[Dict[str, Any]], user_id: str):
+    """Validated documents plus (index, error) pairs for the rows that failed."""
+    model = IMPORT_MODELS[kind]
+    valid, errors = [], []
+    now = datetime.utcnow()
+    for index, record in enumerate(records):
+        try:
+            document = model(**dict(record, user_id=user_id)).dict()
+        except Exception as exc:
+            errors.append((index, str(exc).splitlines()[0]))
+            continue
+        document["updated_at"] = now
+        valid.append(document)
+    return valid, errors
@@ -0,0 +1,364 @@
+"""Production entry point: a pre-forking supervisor over uvicorn workers.
+
+Run from the backend directory:
+
+    python launcher.py [--workers N] [--host 0.0.0.0] [--port 8001]
+
+The supervisor binds the listening socket once, imports the app's
+dependencies (preload), then forks one uvicorn worker per slot. All workers
+accept from the shared socket. ``uvicorn server:app --reload`` is for
+development only.
+
+Sizing. Without ``--workers``/``WEB_CONCURRENCY``, one async worker per
+usable CPU (affinity mask and cgroup ``cpu.max`` quota), capped so
+``WORKER_MEMORY_MB`` per worker plus ``LAUNCHER_MEMORY_RESERVE_MB`` fits
+in available memory (cgroup ``memory.max`` or ``MemAvailable``). Each
+worker's job process pool defaults to its share of the CPUs, so N workers
+don't start 2N pool processes.
+
+Preload. The supervisor imports every module ``server.py`` imports, which
+includes FastAPI, pydantic, Motor and the lazily imported auth libraries,
+but not ``server`` itself. Forked workers share those pages and only run
+``server``'s own setup. The Motor client, the logging thread and every
+other per-process singleton are therefore created after the fork. A
+client created before a fork would carry its pool and monitor threads
+into the child.
+
+Recycling. A worker drains and exits after ``WORKER_MAX_REQUESTS``
+requests, plus up to ``WORKER_MAX_REQUESTS_JITTER`` so the workers don't all
+recycle at once. It drains through the same SIGTERM path as a rolling
+restart. The supervisor starts a replacement in the same slot. Workers that
+keep crashing on start are restarted with backoff.
+
+Signals to the supervisor: SIGTERM/SIGINT drain all workers and stop (bounded
+by ``WORKER_GRACEFUL_TIMEOUT``); SIGHUP restarts the workers one at a time.
+
+Workers get ``WORKER_INDEX``/``WORKER_COUNT``. Worker 0 bootstraps the admin
+user, and broadcasts reach other workers' sockets through the relay in
+``worker_relay.py``.
+"""
+import argparse
+import ast
+import importlib
+import importlib.util
+import logging
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT_DIR))
+
+logger = logging.getLogger("launcher")
+
+# A worker that exits sooner than this after starting counts as a crash loop
+MIN_UPTIME_SECONDS = 5.0
+MAX_BACKOFF_SECONDS = 30.0
+
+
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def available_memory_mb() -> Optional[int]:
+    limits = []
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            value = Path(path).read_text().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:  # cgroup v1 reports "unlimited" as a huge number
+            limits.append(int(value) // 2**20)
+    try:
+        for line in Path("/proc/meminfo").read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                limits.append(int(line.split()[1]) // 1024)
+    except (OSError, ValueError):
+        pass
+    return min(limits) if limits else None
+
+
+def default_workers(cpus: int, memory_mb: Optional[int], worker_memory_mb: int, reserve_mb: int) -> int:
+    workers = cpus
+    if memory_mb is not None and worker_memory_mb > 0:
+        workers = min(workers, (memory_mb - reserve_mb) // worker_memory_mb)
+    return max(1, workers)
+
+
+def app_imports(path: Path = ROOT_DIR / "server.py") -> List[str]:
+    """Modules ``server.py`` imports, including the ones it imports inside functions."""
+    names = []
+    for node in ast.walk(ast.parse(path.read_text())):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    return [name for name in dict.fromkeys(names) if name != "server"]
+
+
+def preload() -> int:
+    """Import the app's dependencies in the supervisor so forked workers share them."""
+    loaded = 0
+    for name in app_imports():
+        try:
+            importlib.import_module(name)
+            loaded += 1
+        except Exception:
+            logger.warning("Could not preload %s; workers will import it themselves", name)
+    return loaded
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+@dataclass
+class LaunchConfig:
+    host: str
+    port: int
+    workers: int
+    preload: bool
+    max_requests: int
+    max_requests_jitter: int
+    graceful_timeout: float
+    backlog: int
+    loop: str
+    http: str
+
+    @classmethod
+    def from_args(cls, argv: Optional[List[str]] = None) -> "LaunchConfig":
+        cpus, memory_mb = available_cpus(), available_memory_mb()
+        sized = default_workers(
+            cpus, memory_mb,
+            worker_memory_mb=int(os.environ.get('WORKER_MEMORY_MB', 256)),
+            reserve_mb=int(os.environ.get('LAUNCHER_MEMORY_RESERVE_MB', 256)),
+        )
+        parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+        parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'))
+        parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', 8001)))
+        parser.add_argument("--workers", type=int, default=int(os.environ.get('WEB_CONCURRENCY', sized)),
+                            help=f"default: {sized} ({cpus} CPUs, {memory_mb} MB available)")
+        parser.add_argument("--no-preload", dest="preload", action="store_false",
+                            default=os.environ.get('LAUNCHER_PRELOAD', 'true').lower() == 'true')
+        parser.add_argument("--max-requests", type=int, default=int(os.environ.get('WORKER_MAX_REQUESTS', 10000)),
+                            help="recycle a worker after this many requests (0: never)")
+        parser.add_argument("--max-requests-jitter", type=int,
+                            default=int(os.environ.get('WORKER_MAX_REQUESTS_JITTER', 1000)))
+        parser.add_argument("--graceful-timeout", type=float,
+                            default=float(os.environ.get('WORKER_GRACEFUL_TIMEOUT',
+                                                         float(os.environ.get('DRAIN_DEADLINE_SECONDS', 20)) + 10)))
+        parser.add_argument("--backlog", type=int, default=int(os.environ.get('LAUNCHER_BACKLOG', 2048)))
+        # uvloop/httptools when installed (pip install uvloop httptools); asyncio/h11 otherwise
+        parser.add_argument("--loop", choices=["auto", "uvloop", "asyncio"], default="auto")
+        parser.add_argument("--http", choices=["auto", "httptools", "h11"], default="auto")
+        args = parser.parse_args(argv)
+        if args.loop == "auto":
+            args.loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+        if args.http == "auto":
+            args.http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+        return cls(**{field: getattr(args, field) for field in cls.__dataclass_fields__})
+
+
+def run_worker(config: LaunchConfig, index: int, sock: socket.socket, relay_dir: str):
+    """Body of a forked worker; never returns."""
+    code = 1
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)  # a hangup reaching the whole group is the supervisor's to handle
+        random.seed()  # the fork copied the supervisor's random state into every worker
+        os.environ.update(WORKER_INDEX=str(index), WORKER_COUNT=str(config.workers), WORKER_RELAY_DIR=relay_dir)
+        max_requests = None
+        if config.max_requests:
+            max_requests = config.max_requests + random.randint(0, config.max_requests_jitter)
+
+        import uvicorn
+
+        class RecyclingServer(uvicorn.Server):
+            """Drain via SIGTERM once recycled or orphaned, instead of dropping sockets mid-request."""
+
+            recycling = False
+
+            async def on_tick(self, counter: int) -> bool:
+                if not self.recycling and (
+                    (max_requests and self.server_state.total_requests >= max_requests)
+                    or os.getppid() != supervisor_pid
+                ):
+                    self.recycling = True
+                    logger.info("Worker %d recycling after %d requests", index, self.server_state.total_requests)
+                    os.kill(os.getpid(), signal.SIGTERM)
+                return await super().on_tick(counter)
+
+        supervisor_pid = os.getppid()
+        server = RecyclingServer(uvicorn.Config(
+            "server:app", loop=config.loop, http=config.http, lifespan="on", log_config=None,
+            access_log=False, timeout_graceful_shutdown=int(config.graceful_timeout),
+        ))
+        server.run(sockets=[sock])
+        code = 0 if server.started else 3
+    except Exception:
+        logger.exception("Worker %d failed", index)
+    finally:
+        logging.shutdown()
+        os._exit(code)
+
+
+class Supervisor:
+    def __init__(self, config: LaunchConfig):
+        self.config = config
+        self.slots: Dict[int, int] = {}  # slot index -> worker pid
+        self.started_at: Dict[int, float] = {}
+        self.backoff: Dict[int, float] = {}
+        self.restart_at: Dict[int, float] = {}
+        self.retiring: List[int] = []
+        self.stopping = False
+        self.reload_requested = False
+        self.sock: Optional[socket.socket] = None
+        self.relay_dir = ""
+
+    def spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.config, index, self.sock, self.relay_dir)
+        self.slots[index] = pid
+        self.started_at[index] = time.monotonic()
+        logger.info("Started worker %d (pid %d)", index, pid)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = next((i for i, p in self.slots.items() if p == pid), None)
+            if index is None:
+                continue
+            del self.slots[index]
+            uptime = time.monotonic() - self.started_at[index]
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0 and uptime < MIN_UPTIME_SECONDS:
+                self.backoff[index] = min(max(1.0, self.backoff.get(index, 0.5) * 2), MAX_BACKOFF_SECONDS)
+                logger.error("Worker %d exited with %d after %.1fs; restarting in %.0fs",
+                             index, code, uptime, self.backoff[index])
+            else:
+                self.backoff.pop(index, None)
+                logger.info("Worker %d (pid %d) exited with %d after %.0fs", index, pid, code, uptime)
+            self.restart_at[index] = time.monotonic() + self.backoff.get(index, 0.0)
+
+    def _signal(self, sig, frame):
+        if sig == signal.SIGHUP:
+            self.reload_requested = True
+        elif sig in (signal.SIGTERM, signal.SIGINT):
+            self.stopping = True
+
+    def run(self) -> int:
+        config = self.config
+        self.sock = bind_socket(config.host, config.port, config.backlog)
+        self.relay_dir = tempfile.mkdtemp(prefix="bettingcalc-relay-")
+        if config.preload:
+            started = time.perf_counter()
+            count = preload()
+            logger.info("Preloaded %d modules in %.0f ms", count, (time.perf_counter() - started) * 1000)
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self._signal)
+        logger.info("Serving on %s:%d with %d workers (loop=%s, http=%s, max_requests=%s)",
+                    config.host, config.port, config.workers, config.loop, config.http, config.max_requests or None)
+        for index in range(config.workers):
+            self.spawn(index)
+        try:
+            while not self.stopping:
+                self.reap()
+                now = time.monotonic()
+                for index in range(config.workers):
+                    if index not in self.slots and now >= self.restart_at.get(index, 0.0) and not self.stopping:
+                        self.spawn(index)
+                if self.reload_requested:
+                    self.reload_requested = False
+                    self.retiring = list(self.slots.values())
+                    logger.info("Restarting %d workers one at a time", len(self.retiring))
+                # One worker drains at a time, and only once every slot is serving again
+                if self.retiring and len(self.slots) == config.workers and \
+                        now - max(self.started_at.values()) >= MIN_UPTIME_SECONDS:
+                    pid = self.retiring.pop(0)
+                    if pid in self.slots.values():
+                        os.kill(pid, signal.SIGTERM)
+                time.sleep(0.5)
+        finally:
+            self.shutdown()
+        return 0
+
+    def shutdown(self):
+        logger.info("Stopping %d workers", len(self.slots))
+        for pid in self.slots.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.config.graceful_timeout
+        while self.slots and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for index, pid in list(self.slots.items()):
+            logger.warning("Worker %d did not drain in %.0fs; killing it", index, self.config.graceful_timeout)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.slots.clear()
+        self.sock.close()
+        shutil.rmtree(self.relay_dir, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    load_dotenv(ROOT_DIR / ".env")
+    from structured_logging import JsonFormatter
+
+    # A plain handler, not the queue-backed one: its writer thread would not survive the fork
+    handler = logging.StreamHandler()
+    if os.environ.get('LOG_FORMAT', 'json').lower() == 'json':
+        handler.setFormatter(JsonFormatter())
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), handlers=[handler])
+    config = LaunchConfig.from_args(argv)
+    if not hasattr(os, "fork"):
+        logger.warning("No fork() on this platform; running a single worker")
+        import uvicorn
+        uvicorn.run("server:app", host=config.host, port=config.port, log_config=None, access_log=False)
+        return 0
+    # Each worker gets its share of the CPUs for its own job process pool, unless the
+    # environment or .env pins it (.env ships with it commented out for this reason)
+    os.environ.setdefault('JOB_PROCESS_WORKERS', str(max(1, available_cpus() // config.workers)))
+    return Supervisor(config).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
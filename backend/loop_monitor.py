@@ -0,0 +1,162 @@
+"""Event-loop lag sampling, stall detection and an on-demand sampling profiler.
+
+The sampler is a coroutine that sleeps a fixed interval and records how late it
+wakes up. A watchdog thread watches the sampler's heartbeat; when it goes stale
+the loop is blocked, so the watchdog grabs the loop thread's stack and the route
+of the task that is running and logs them. The profiler samples the same stack
+from a thread and emits collapsed stacks (``a;b;c 42``) that flamegraph.pl and
+speedscope read directly.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Dict, Optional
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class RouteTracker:
+    """ASGI middleware remembering which route each request task is serving."""
+
+    def __init__(self, app, registry: Dict[asyncio.Task, str]):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        task = asyncio.current_task()
+        self.registry[task] = f"{scope.get('method', 'WS')} {scope['path']}"
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.registry.pop(task, None)
+
+
+class LoopMonitor:
+    def __init__(self, interval_ms: float = 100, slow_threshold_ms: float = 200, window: int = 50):
+        self.interval = interval_ms / 1000.0
+        self.slow_threshold = slow_threshold_ms / 1000.0
+        self.lag_ms = Histogram()
+        self.recent_lag_ms = deque(maxlen=window)
+        self.stalls = 0
+        self.active_routes: Dict[asyncio.Task, str] = {}
+        self._heartbeat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._sampler: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._sampler = asyncio.ensure_future(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._sampler:
+            self._sampler.cancel()
+            try:
+                await self._sampler
+            except asyncio.CancelledError:
+                pass
+
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, (now - expected) * 1000)
+            self.lag_ms.observe(lag)
+            self.recent_lag_ms.append(lag)
+            self._heartbeat = now
+
+    def _watch(self):
+        reported_for = None
+        while not self._stopped.wait(self.slow_threshold / 4):
+            if self._loop.is_closed():
+                return
+            heartbeat = self._heartbeat
+            stalled_for = time.monotonic() - heartbeat - self.interval
+            if stalled_for < self.slow_threshold or reported_for == heartbeat:
+                continue
+            reported_for = heartbeat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<unavailable>"
+            task = asyncio.current_task(self._loop)
+            route = self.active_routes.get(task, "<no request>")
+            logger.warning(
+                "Event loop blocked for %.0f ms (route: %s)\n%s",
+                stalled_for * 1000, route, stack,
+            )
+
+    def recent_max_lag_ms(self) -> float:
+        return max(self.recent_lag_ms, default=0.0)
+
+    def snapshot(self) -> dict:
+        return {
+            "lag_ms": self.lag_ms.snapshot(),
+            "recent_max_lag_ms": round(self.recent_max_lag_ms(), 3),
+            "stalls": self.stalls,
+            "slow_threshold_ms": self.slow_threshold * 1000,
+        }
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples thread stacks on a background thread for a fixed duration."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def _run(self, thread_ids, seconds: float, interval: float) -> Counter:
+        samples: Counter = Counter()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or (thread_ids is not None and thread_id not in thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                samples[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return samples
+
+    async def profile(self, seconds: float, interval_ms: float = 5, all_threads: bool = False) -> str:
+        """Collapsed-stack profile of the loop thread (or every thread) over ``seconds``."""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            thread_ids = None if all_threads else {threading.get_ident()}
+            samples = await asyncio.get_running_loop().run_in_executor(
+                None, self._run, thread_ids, seconds, interval_ms / 1000.0
+            )
+        finally:
+            self._lock.release()
+        return "\n".join(f"{stack} {count}" for stack, count in samples.most_common()) + "\n"
@@ -0,0 +1,60 @@
+"""Small in-process metric primitives shared by the monitoring hooks.
+
+Listeners from the Mongo driver fire on executor threads, so everything here is
+guarded by a lock and cheap enough to update on every event.
+"""
+import bisect
+import threading
+from typing import Dict, List, Optional, Sequence
+
+# Millisecond bucket upper bounds, roughly log-spaced from sub-ms to 10s
+DEFAULT_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th percentile (max for the overflow bucket)."""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q / 100.0 * self.count
+            seen = 0
+            for index, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= rank and bucket_count:
+                    return self.buckets[index] if index < len(self.buckets) else self.max
+            return self.max
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": round(self.max, 3) if self.count else None,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
@@ -0,0 +1,308 @@
+"""Online migration of calculator and broker collections to the compact schema.
+
+Run from the backend directory, against the database in ``.env``:
+
+    python migrate_storage.py status
+    python migrate_storage.py migrate [--collection single_calculator] [--batch-size 500] [--max-docs-per-second 2000]
+    python migrate_storage.py abort --collection single_calculator
+    python migrate_storage.py drop-legacy --collection single_calculator --yes
+
+``migrate`` walks each collection through the states described in
+``storage_schema.py``, while the API keeps serving:
+
+1. it builds the ``<name>_v2`` indexes (the legacy indexes, translated)
+   and sets ``migrating``, so every worker starts writing both collections;
+2. once workers have picked the state up (``--settle-seconds``, three
+   refresh intervals by default), it backfills in ``_id`` order, in
+   unordered batches, at most ``--max-docs-per-second``. A compact document
+   is inserted if missing, and replaced only if it has an older
+   ``updated_at``, so a dual write that landed first is never overwritten;
+3. it deletes compact documents whose record is gone from legacy (deleted
+   during the backfill), then sets ``cutover``. Workers read the compact
+   collection and keep writing both;
+4. after another settle, it runs a last catch-up and reconcile for writes a
+   worker may have made only to legacy before it switched, then sets
+   ``compact``. Legacy gets no more writes.
+
+Before and after, it reads ``$collStats`` for both collections: document
+count, average document size, data size, storage size and per-index sizes.
+It prints the comparison and saves it on the ``schema_versions`` document.
+``GET /api/admin/storage`` shows the saved reports.
+
+Until ``compact``, ``abort`` puts a collection back on legacy: legacy
+received every write, so nothing is lost. After ``compact`` the legacy
+collection is stale. ``drop-legacy`` removes it once you're satisfied.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+
+from storage_schema import SCHEMAS, VERSIONS_COLLECTION, CompactSchema, compact_name, decode_value
+
+ROOT_DIR = Path(__file__).parent
+logger = logging.getLogger("migrate_storage")
+
+# Options create_index accepts that index_information() reports back
+INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "default_language", "language_override", "collation")
+
+
+def index_name(keys: List[Any]) -> str:
+    return "_".join(f"{name}_{kind}" for name, kind in keys)
+
+
+def compact_indexes(schema: CompactSchema, info: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The legacy indexes as ``create_index`` arguments on compact names."""
+    indexes = []
+    for name, spec in info.items():
+        keys = list(spec["key"])
+        if name == "_id_" or [field for field, _ in keys] == ["id"]:
+            continue  # the _id index covers id now
+        if "weights" in spec:
+            # Text indexes report ("_fts", "text"), ("_ftsx", 1) in place of the text fields
+            prefix = [(field, kind) for field, kind in keys if field not in ("_fts", "_ftsx")]
+            keys = prefix + [(field, "text") for field in spec["weights"]]
+        options = {option: spec[option] for option in INDEX_OPTIONS if option in spec}
+        if "weights" in spec and any(weight != 1 for weight in spec["weights"].values()):
+            options["weights"] = {schema.path(field): weight for field, weight in spec["weights"].items()}
+        if "partialFilterExpression" in spec:
+            options["partialFilterExpression"] = schema.filter(spec["partialFilterExpression"])
+        translated = schema.index_keys(keys)
+        # Keep names given explicitly, so the app's own create_index calls match; default the rest
+        options["name"] = name if name != index_name(keys) else index_name(translated)
+        indexes.append({"keys": translated, **options})
+    return indexes
+
+
+async def collection_stats(db, name: str) -> Optional[Dict[str, Any]]:
+    if name not in await db.list_collection_names(filter={"name": name}):
+        return None
+    rows = await db[name].aggregate([{"$collStats": {"storageStats": {}}}]).to_list(None)
+    stats = rows[0]["storageStats"] if rows else {}
+    return {
+        "count": stats.get("count", 0),
+        "avg_document_bytes": stats.get("avgObjSize", 0),
+        "data_bytes": stats.get("size", 0),
+        "storage_bytes": stats.get("storageSize", 0),
+        "index_bytes": stats.get("totalIndexSize", 0),
+        "indexes": stats.get("indexSizes", {}),
+    }
+
+
+def size_report(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> List[str]:
+    lines = [f"{'':22}{'legacy':>14}{'compact':>14}{'change':>9}"]
+    for key in ("count", "avg_document_bytes", "data_bytes", "storage_bytes", "index_bytes"):
+        old, new = (before or {}).get(key, 0), (after or {}).get(key, 0)
+        change = f"{(new - old) / old * 100:+.0f}%" if old else ""
+        lines.append(f"{key:22}{old:>14,}{new:>14,}{change:>9}")
+    for name, size in sorted((before or {}).get("indexes", {}).items()):
+        lines.append(f"  legacy index {name}: {size:,}")
+    for name, size in sorted((after or {}).get("indexes", {}).items()):
+        lines.append(f"  compact index {name}: {size:,}")
+    return lines
+
+
+class Migration:
+    def __init__(self, db, batch_size: int = 500, max_docs_per_second: float = 2000, settle_seconds: float = 30):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_docs_per_second = max_docs_per_second
+        self.settle_seconds = settle_seconds
+
+    @property
+    def versions(self):
+        return self.db[VERSIONS_COLLECTION]
+
+    async def state(self, name: str) -> str:
+        document = await self.versions.find_one({"_id": name})
+        return document.get("state", "legacy") if document else "legacy"
+
+    async def set_state(self, name: str, state: str, **fields):
+        logger.info("%s: %s", name, state)
+        await self.versions.update_one(
+            {"_id": name},
+            {"$set": {"state": state, "version": SCHEMAS[name].version, "physical": compact_name(name),
+                      "updated_at": datetime.utcnow(), **fields}},
+            upsert=True,
+        )
+
+    async def settle(self):
+        """Give every worker a refresh interval or three to act on a new state."""
+        logger.info("Waiting %.0fs for workers to pick up the new state", self.settle_seconds)
+        await asyncio.sleep(self.settle_seconds)
+
+    async def create_indexes(self, name: str):
+        schema = SCHEMAS[name]
+        for index in compact_indexes(schema, await self.db[name].index_information()):
+            keys = index.pop("keys")
+            logger.info("%s: index %s", compact_name(name), index["name"])
+            await self.db[compact_name(name)].create_index(keys, **index)
+
+    async def backfill(self, name: str, since: Optional[datetime] = None) -> int:
+        """Copy legacy documents (changed since ``since``) into the compact collection."""
+        schema = SCHEMAS[name]
+        query = {"updated_at": {"$gte": since}} if since else {}
+        legacy, compact = self.db[name], self.db[compact_name(name)]
+        started, copied = time.monotonic(), 0
+        cursor = legacy.find(query).sort("_id", 1).batch_size(self.batch_size)
+        batch: List[Any] = []
+        async for document in cursor:
+            if "id" not in document:
+                continue
+            encoded = schema.encode(document)
+            fields = {key: value for key, value in encoded.items() if key != "_id"}
+            batch.append(UpdateOne({"_id": encoded["_id"]}, {"$setOnInsert": fields}, upsert=True))
+            if "ua" in encoded:
+                # Newer than what a dual write (or an earlier pass) left there
+                batch.append(ReplaceOne({"_id": encoded["_id"], "ua": {"$lt": encoded["ua"]}}, encoded))
+            copied += 1
+            if copied % self.batch_size == 0:
+                await compact.bulk_write(batch, ordered=False)
+                batch = []
+                await self._throttle(started, copied)
+                logger.info("%s: copied %d", name, copied)
+        if batch:
+            await compact.bulk_write(batch, ordered=False)
+        logger.info("%s: copied %d in %.1fs", name, copied, time.monotonic() - started)
+        return copied
+
+    async def _throttle(self, started: float, copied: int):
+        if self.max_docs_per_second > 0:
+            ahead = copied / self.max_docs_per_second - (time.monotonic() - started)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+    async def reconcile(self, name: str) -> int:
+        """Delete compact documents whose legacy record no longer exists."""
+        legacy, compact = self.db[name], self.db[compact_name(name)]
+        removed = 0
+        cursor = compact.find({}, {"_id": 1}).sort("_id", 1).batch_size(self.batch_size)
+        ids: List[Any] = []
+
+        async def check(ids):
+            record_ids = [decode_value(stored) for stored in ids]
+            present = set(await legacy.distinct("id", {"id": {"$in": record_ids}}))
+            gone = [stored for stored, record_id in zip(ids, record_ids) if record_id not in present]
+            if gone:
+                await compact.bulk_write([DeleteMany({"_id": {"$in": gone}})])
+            return len(gone)
+
+        async for document in cursor:
+            ids.append(document["_id"])
+            if len(ids) >= self.batch_size:
+                removed += await check(ids)
+                ids = []
+        if ids:
+            removed += await check(ids)
+        if removed:
+            logger.info("%s: removed %d deleted during the migration", name, removed)
+        return removed
+
+    async def migrate(self, name: str):
+        state = await self.state(name)
+        if state == "compact":
+            logger.info("%s: already compact", name)
+            return
+        before = await collection_stats(self.db, name)
+        started = datetime.utcnow()
+        if state == "legacy":
+            await self.create_indexes(name)
+            await self.set_state(name, "migrating", started_at=started)
+            await self.settle()
+        if state in ("legacy", "migrating"):
+            copied = await self.backfill(name)
+            await self.reconcile(name)
+            await self.set_state(name, "cutover", copied=copied)
+            await self.settle()
+        # Writes a worker made to legacy alone, before it saw the dual-write state
+        await self.backfill(name, since=started if state == "legacy" else None)
+        await self.reconcile(name)
+        after = await collection_stats(self.db, compact_name(name))
+        report = {"before": before, "after": after, "finished_at": datetime.utcnow()}
+        await self.set_state(name, "compact", report=report)
+        print(f"\n{name} -> {compact_name(name)}")
+        print("\n".join(size_report(before, after)))
+
+    async def abort(self, name: str):
+        state = await self.state(name)
+        if state == "compact":
+            raise SystemExit(f"{name} is compact; the legacy collection no longer receives writes")
+        await self.set_state(name, "legacy")
+        await self.settle()
+        await self.db.drop_collection(compact_name(name))
+
+    async def drop_legacy(self, name: str):
+        if await self.state(name) != "compact":
+            raise SystemExit(f"{name} is not compact yet")
+        await self.db.drop_collection(name)
+        await self.versions.update_one({"_id": name}, {"$set": {"legacy_dropped_at": datetime.utcnow()}})
+        logger.info("%s: legacy collection dropped", name)
+
+    async def status(self):
+        documents = {document["_id"]: document async for document in self.versions.find({})}
+        for name in SCHEMAS:
+            document = documents.get(name, {})
+            print(f"{name}: {document.get('state', 'legacy')}")
+            report = document.get("report")
+            if report:
+                print("\n".join("    " + line for line in size_report(report["before"], report["after"])))
+
+
+async def run(args) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    migration = Migration(
+        client[os.environ['DB_NAME']],
+        batch_size=args.batch_size,
+        max_docs_per_second=args.max_docs_per_second,
+        settle_seconds=args.settle_seconds,
+    )
+    try:
+        if args.command == "status":
+            await migration.status()
+            return 0
+        for name in args.collection or list(SCHEMAS):
+            if args.command == "migrate":
+                await migration.migrate(name)
+            elif args.command == "abort":
+                await migration.abort(name)
+            elif args.command == "drop-legacy":
+                if not args.yes:
+                    raise SystemExit("drop-legacy deletes data; pass --yes")
+                await migration.drop_legacy(name)
+        return 0
+    finally:
+        client.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    load_dotenv(ROOT_DIR / ".env")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    refresh = float(os.environ.get('STORAGE_SCHEMA_REFRESH_SECONDS', 10))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("status", "migrate", "abort", "drop-legacy"))
+    parser.add_argument("--collection", action="append", choices=list(SCHEMAS),
+                        help="repeatable; default all")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get('STORAGE_MIGRATION_BATCH_SIZE', 500)))
+    parser.add_argument("--max-docs-per-second", type=float,
+                        default=float(os.environ.get('STORAGE_MIGRATION_MAX_DOCS_PER_SECOND', 2000)),
+                        help="backfill rate limit; 0 for none")
+    parser.add_argument("--settle-seconds", type=float, default=3 * refresh)
+    parser.add_argument("--yes", action="store_true", help="confirm drop-legacy")
+    args = parser.parse_args(argv)
+    if args.command in ("abort", "drop-legacy") and not args.collection:
+        parser.error(f"{args.command} needs --collection")
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
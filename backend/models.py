@@ -0,0 +1,124 @@
+"""Pydantic models shared by the API routes and background workers.
+
+Kept free of app/DB setup so process-pool workers can import them cheaply.
+"""
+from pydantic import BaseModel, Field, EmailStr
+from typing import Any, Dict, List, Literal, Optional
+import uuid
+from datetime import datetime
+
+# User Models
+class UserBase(BaseModel):
+    email: EmailStr
+    username: str
+    full_name: Optional[str] = None
+    is_active: bool = True
+
+class UserCreate(UserBase):
+    password: str
+
+class UserLogin(BaseModel):
+    username: str
+    password: str
+
+class User(UserBase):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str
+
+class TokenData(BaseModel):
+    username: Optional[str] = None
+
+# Calculator Data Models
+class SingleCalculatorData(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    match_name: str = ""
+    stake: float = 0.0
+    odds: float = 0.0
+    commission: float = 0.0
+    potential_profit: float = 0.0
+    lay_odds: float = 0.0
+    lay_stake: float = 0.0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ProCalculatorData(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    match_name: str = ""
+    back_stake: float = 0.0
+    back_odds: float = 0.0
+    lay_stake: float = 0.0
+    lay_odds: float = 0.0
+    commission: float = 0.0
+    profit_loss: float = 0.0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class BrokerAccount(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    account_name: str
+    balance: float = 0.0
+    commission_rate: float = 0.0
+    account_type: str = "betfair"  # betfair, smarkets, etc.
+    is_active: bool = True
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+# Stake Solver Models
+class SolverPrice(BaseModel):
+    bookmaker: str  # matched against BrokerAccount.account_type
+    back: Optional[float] = None
+    lay: Optional[float] = None
+
+class SolverOutcome(BaseModel):
+    name: str
+    prices: List[SolverPrice] = Field(default_factory=list)
+
+class SolverMarket(BaseModel):
+    market_id: str
+    name: str = ""
+    outcomes: List[SolverOutcome] = Field(default_factory=list)  # empty: take prices from the odds feed
+
+class StakeSolveRequest(BaseModel):
+    markets: List[SolverMarket] = Field(max_length=1000)
+    account_ids: Optional[List[str]] = None  # default: all active accounts
+    max_stake_per_market: Optional[float] = Field(default=None, gt=0)
+
+# Simulation Models
+class SimulationRequest(BaseModel):
+    account_type: Literal["all", "single", "pro"] = "all"
+    simulations: int = Field(default=10_000, ge=100)
+    horizon: int = Field(default=500, ge=1)  # bets per simulated path
+    seed: Optional[int] = Field(default=None, ge=0)
+    bankroll: Optional[float] = Field(default=None, gt=0)  # default: active broker balances
+    ruin_level: float = 0.0
+    stake_scale: float = Field(default=1.0, gt=0)
+    percentiles: List[float] = Field(default_factory=lambda: [5, 25, 50, 75, 95], min_length=1, max_length=9)
+
+# Background Job Models
+class JobSubmit(BaseModel):
+    type: str
+    params: Dict[str, Any] = Field(default_factory=dict)
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    type: str
+    params: Dict[str, Any] = Field(default_factory=dict)
+    status: str = "queued"  # queued, running, succeeded, failed, cancelled
+    progress: float = 0.0
+    message: str = ""
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,168 @@
+"""Mongo client tuning from the environment plus pool/command instrumentation.
+
+Pool checkout wait and server-side command latency are recorded separately so a
+slow handler can be attributed to pool exhaustion or to the server itself.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict
+
+from pymongo import monitoring
+
+from metrics import Histogram
+
+DRIVER_DEFAULT_MAX_POOL_SIZE = 100
+
+_COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+
+def _available_compressors(requested: str):
+    compressors = []
+    for name in [c.strip().lower() for c in requested.split(",") if c.strip()]:
+        module = _COMPRESSOR_MODULES.get(name)
+        if module is None:
+            continue
+        try:
+            __import__(module)
+        except ImportError:
+            # Asking the driver for a codec it can't load fails client creation
+            continue
+        compressors.append(name)
+    return compressors
+
+
+def mongo_client_options() -> Dict[str, Any]:
+    """Keyword options for ``AsyncIOMotorClient``; unset variables keep driver/URI defaults."""
+    options: Dict[str, Any] = {}
+    int_settings = {
+        'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+        'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+        'MONGO_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+        'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+        'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    }
+    for env_name, option in int_settings.items():
+        value = os.environ.get(env_name)
+        if value:
+            options[option] = int(value)
+
+    read_preference = os.environ.get('MONGO_READ_PREFERENCE')
+    if read_preference:
+        options['readPreference'] = read_preference
+
+    compressors = _available_compressors(os.environ.get('MONGO_COMPRESSORS', ''))
+    if compressors:
+        options['compressors'] = ",".join(compressors)
+    return options
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Tracks open/in-use connections, checkout waiters and checkout wait time."""
+
+    def __init__(self, max_pool_size: int):
+        self.max_pool_size = max_pool_size
+        self.checkout_wait_ms = Histogram()
+        self.open_connections = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkout_failures = defaultdict(int)
+        self.pools_cleared = 0  # not pool_cleared: that name is the listener callback
+        self._lock = threading.Lock()
+        # Checkout start and completion fire on the same driver thread
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pools_cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections = max(0, self.open_connections - 1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+
+    def _checkout_finished(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        with self._lock:
+            self.waiting = max(0, self.waiting - 1)
+        return started
+
+    def connection_check_out_failed(self, event):
+        self._checkout_finished()
+        with self._lock:
+            self.checkout_failures[str(event.reason)] += 1
+
+    def connection_checked_out(self, event):
+        started = self._checkout_finished()
+        if started is not None:
+            self.checkout_wait_ms.observe((time.perf_counter() - started) * 1000)
+        with self._lock:
+            self.in_use += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_pool_size": self.max_pool_size,
+            "open": self.open_connections,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "saturation": round(self.in_use / self.max_pool_size, 3) if self.max_pool_size else None,
+            "checkout_failures": dict(self.checkout_failures),
+            "pool_cleared": self.pools_cleared,
+            "checkout_wait_ms": self.checkout_wait_ms.snapshot(),
+        }
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """Server round-trip latency per command name (find, update, insert, ...)."""
+
+    def __init__(self):
+        self.latency_ms: Dict[str, Histogram] = defaultdict(Histogram)
+        self.failures: Dict[str, int] = defaultdict(int)
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.latency_ms[event.command_name].observe(event.duration_micros / 1000.0)
+
+    def failed(self, event):
+        self.latency_ms[event.command_name].observe(event.duration_micros / 1000.0)
+        self.failures[event.command_name] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            name: dict(histogram.snapshot(), failures=self.failures.get(name, 0))
+            for name, histogram in list(self.latency_ms.items())
+        }
+
+
+def build_monitors(options: Dict[str, Any]):
+    pool_monitor = PoolMonitor(options.get('maxPoolSize', DRIVER_DEFAULT_MAX_POOL_SIZE))
+    command_monitor = CommandMonitor()
+    return pool_monitor, command_monitor
@@ -0,0 +1,360 @@
+"""Odds-feed ingestion with live arbitrage alerts.
+
+A source yields odds ticks: NDJSON objects of the form
+
+    {"market_id": "m1", "match": "Arsenal v Chelsea", "outcome": "A",
+     "bookmaker": "bet365", "odds": 2.10, "ts": 1718000000.0}
+
+``outcome`` is ``A`` or ``B``, the two sides of the Pro calculator. Odds of 1.0
+or less withdraw that bookmaker's quote (market suspended). ``OddsIndex``
+keeps the latest quote per (market, outcome, bookmaker) and the best price per
+outcome. A tick re-evaluates only its own market, using the Pro calculator's
+margin formula ``(1/oddsA + 1/oddsB - 1) * 100``. A negative margin means
+backing both sides at the best prices locks in a profit.
+
+When a market's margin drops to ``ODDS_ALERT_MARGIN`` or below, or moves by
+at least ``ODDS_ALERT_MIN_CHANGE`` points while it stays there, an
+``odds_alert`` is queued. The alert goes to every user watching that match;
+watching is requested over the WebSocket with
+``{"type": "watch_odds", "matches": [...]}``. A ``closed`` alert follows
+when the opportunity goes away. Alerts are coalesced per market and sent by a
+separate task, so slow sockets never hold up ingestion.
+
+Sources are pluggable: ``ODDS_FEED_SOURCE`` takes ``file:<path>`` (replay,
+paced by ``ODDS_FEED_REPLAY_SPEED``; 0 means as fast as possible) or
+``tcp://host:port`` (NDJSON lines, reconnecting with backoff). Other schemes
+can be added to ``SOURCE_TYPES``.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+OUTCOMES = ("A", "B")
+
+
+@dataclass
+class Tick:
+    market_id: str
+    match: str
+    outcome: str
+    bookmaker: str
+    odds: float
+    ts: float
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Tick":
+        outcome = str(data["outcome"]).upper()
+        if outcome not in OUTCOMES:
+            raise ValueError(f"Unknown outcome {outcome!r}")
+        return cls(
+            market_id=str(data["market_id"]),
+            match=str(data.get("match", data["market_id"])),
+            outcome=outcome,
+            bookmaker=str(data.get("bookmaker", "")),
+            odds=float(data["odds"]),
+            ts=float(data.get("ts") or time.time()),
+        )
+
+
+def match_key(name: str) -> str:
+    return " ".join(name.casefold().split())
+
+
+def margin(odds_a: float, odds_b: float) -> Optional[float]:
+    """Book margin in percent, as in the Pro calculator; negative is an arbitrage."""
+    if odds_a <= 1 or odds_b <= 1:
+        return None
+    return (1 / odds_a + 1 / odds_b - 1) * 100
+
+
+def stakes(odds_a: float, odds_b: float, stake_a: float) -> Dict[str, float]:
+    """Pro calculator's optimal B stake (no cashback) and the resulting profit either way."""
+    stake_b = stake_a * odds_a / odds_b
+    return {
+        "stake_a": round(stake_a, 2),
+        "stake_b": round(stake_b, 2),
+        "profit_if_a": round(stake_a * (odds_a - 1) - stake_b, 2),
+        "profit_if_b": round(stake_b * (odds_b - 1) - stake_a, 2),
+    }
+
+
+class Market:
+    __slots__ = ("market_id", "match", "quotes", "best", "margin", "alerted_margin", "updated_at")
+
+    def __init__(self, market_id: str, match: str):
+        self.market_id = market_id
+        self.match = match
+        self.quotes: Dict[str, Dict[str, float]] = {outcome: {} for outcome in OUTCOMES}
+        self.best: Dict[str, Tuple[Optional[str], float]] = {outcome: (None, 0.0) for outcome in OUTCOMES}
+        self.margin: Optional[float] = None
+        self.alerted_margin: Optional[float] = None
+        self.updated_at = 0.0
+
+    def apply(self, tick: Tick) -> bool:
+        """Update one quote; True if the best price for that outcome changed."""
+        quotes = self.quotes[tick.outcome]
+        previous_best = self.best[tick.outcome]
+        if tick.odds > 1:
+            quotes[tick.bookmaker] = tick.odds
+        else:
+            quotes.pop(tick.bookmaker, None)
+        self.updated_at = tick.ts
+
+        best_bookmaker, best_odds = previous_best
+        if tick.odds > best_odds and tick.odds > 1:
+            self.best[tick.outcome] = (tick.bookmaker, tick.odds)
+        elif tick.bookmaker == best_bookmaker:
+            # The best quote moved down or went away: rescan this outcome's few bookmakers
+            self.best[tick.outcome] = max(quotes.items(), key=lambda item: item[1], default=(None, 0.0))
+        return self.best[tick.outcome] != previous_best
+
+    def to_dict(self, stake_a: float = 100.0) -> Dict[str, Any]:
+        (book_a, odds_a), (book_b, odds_b) = self.best["A"], self.best["B"]
+        data = {
+            "market_id": self.market_id,
+            "match": self.match,
+            "best": {"A": {"bookmaker": book_a, "odds": odds_a}, "B": {"bookmaker": book_b, "odds": odds_b}},
+            "margin": None if self.margin is None else round(self.margin, 4),
+            "updated_at": self.updated_at,
+        }
+        if self.margin is not None:
+            data["stakes"] = stakes(odds_a, odds_b, stake_a)
+        return data
+
+
+class OddsIndex:
+    def __init__(self, alert_margin: float = 0.0, min_change: float = 0.1):
+        self.alert_margin = alert_margin
+        self.min_change = min_change
+        self.markets: Dict[str, Market] = {}
+        self.by_match: Dict[str, Set[str]] = {}
+        self.evaluations = 0
+
+    def apply(self, tick: Tick) -> Optional[Tuple[str, Market]]:
+        """Apply a tick; returns ``(status, market)`` when watchers should hear about it."""
+        market = self.markets.get(tick.market_id)
+        if market is None:
+            market = self.markets[tick.market_id] = Market(tick.market_id, tick.match)
+            self.by_match.setdefault(match_key(tick.match), set()).add(tick.market_id)
+        if not market.apply(tick):
+            return None
+
+        self.evaluations += 1
+        market.margin = margin(market.best["A"][1], market.best["B"][1])
+        is_open = market.margin is not None and market.margin <= self.alert_margin
+        if is_open:
+            if market.alerted_margin is None or abs(market.margin - market.alerted_margin) >= self.min_change:
+                market.alerted_margin = market.margin
+                return "open", market
+        elif market.alerted_margin is not None:
+            market.alerted_margin = None
+            return "closed", market
+        return None
+
+    def markets_for(self, match: str) -> List[Market]:
+        return [self.markets[market_id] for market_id in self.by_match.get(match_key(match), ())]
+
+    def opportunities(self) -> List[Market]:
+        return sorted((m for m in self.markets.values() if m.alerted_margin is not None), key=lambda m: m.margin)
+
+
+class Throughput:
+    """Ticks per second over a sliding window of one-second buckets."""
+
+    def __init__(self, window_seconds: int = 10):
+        self.buckets: deque = deque(maxlen=window_seconds + 1)
+
+    def add(self, count: int = 1, now: Optional[float] = None):
+        second = int(now if now is not None else time.monotonic())
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1][1] += count
+        else:
+            self.buckets.append([second, count])
+
+    def rate(self, now: Optional[float] = None) -> float:
+        current = int(now if now is not None else time.monotonic())
+        # Only whole seconds: the current one is still filling up
+        window = self.buckets.maxlen - 1
+        return sum(count for second, count in self.buckets if current - window <= second < current) / window
+
+
+# Sources
+
+async def file_source(path: str, speed: float = 0.0) -> AsyncIterator[Dict[str, Any]]:
+    """Replay an NDJSON file; ``speed`` > 0 paces ticks by their timestamps (2.0 = twice as fast)."""
+    lines = await asyncio.to_thread(Path(path).read_text)
+    first_ts, started = None, time.monotonic()
+    for count, line in enumerate(lines.splitlines()):
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        if speed > 0 and "ts" in data:
+            first_ts = first_ts if first_ts is not None else float(data["ts"])
+            delay = (float(data["ts"]) - first_ts) / speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif count % 1000 == 0:
+            await asyncio.sleep(0)  # unpaced replay: let requests run between chunks
+        yield data
+
+
+async def tcp_source(address: str) -> AsyncIterator[Dict[str, Any]]:
+    """NDJSON over TCP, reconnecting with jittered backoff."""
+    host, port = address.rsplit(":", 1)
+    backoff = 1.0
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, int(port))
+        except OSError as exc:
+            logger.warning("Odds feed %s unavailable (%s); retrying in %.1fs", address, exc, backoff)
+            await asyncio.sleep(backoff * (1 + random.random()))
+            backoff = min(backoff * 2, 30.0)
+            continue
+        backoff = 1.0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            writer.close()
+        logger.warning("Odds feed %s closed the connection; reconnecting", address)
+
+
+SOURCE_TYPES: Dict[str, Callable[..., AsyncIterator[Dict[str, Any]]]] = {
+    "file": lambda target: file_source(target, float(os.environ.get('ODDS_FEED_REPLAY_SPEED', 0))),
+    "tcp": lambda target: tcp_source(target.lstrip("/")),
+}
+
+
+def build_source(spec: str) -> Optional[AsyncIterator[Dict[str, Any]]]:
+    if not spec:
+        return None
+    scheme, _, target = spec.partition(":")
+    if scheme not in SOURCE_TYPES:
+        raise ValueError(f"Unknown odds feed source {spec!r}")
+    return SOURCE_TYPES[scheme](target)
+
+
+class OddsFeed:
+    def __init__(self, manager, index: OddsIndex, source_spec: str = "", alert_stake: float = 100.0):
+        self.manager = manager
+        self.index = index
+        self.source_spec = source_spec
+        self.alert_stake = alert_stake
+        self.watchers: Dict[str, Set[str]] = {}  # match key -> user ids
+        self.throughput = Throughput()
+        self.stats = {"ticks": 0, "invalid": 0, "alerts_queued": 0, "alerts_sent": 0,
+                      "last_tick_lag_ms": None}
+        self._pending: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self._wake = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    @classmethod
+    def from_env(cls, manager) -> "OddsFeed":
+        return cls(
+            manager,
+            OddsIndex(
+                alert_margin=float(os.environ.get('ODDS_ALERT_MARGIN', 0)),
+                min_change=float(os.environ.get('ODDS_ALERT_MIN_CHANGE', 0.1)),
+            ),
+            source_spec=os.environ.get('ODDS_FEED_SOURCE', ''),
+            alert_stake=float(os.environ.get('ODDS_ALERT_STAKE', 100)),
+        )
+
+    # Watch lists (per user, replaced by each watch_odds message)
+
+    def watch(self, user_id: str, matches: Iterable[str]) -> List[Dict[str, Any]]:
+        self.unwatch(user_id)
+        keys = {match_key(match) for match in matches if match and match.strip()}
+        for key in keys:
+            self.watchers.setdefault(key, set()).add(user_id)
+        # Current state of what they now watch, so the client doesn't wait for the next tick
+        return [market.to_dict(self.alert_stake) for key in keys for market in self.index.markets_for(key)]
+
+    def unwatch(self, user_id: str):
+        for key in [key for key, users in self.watchers.items() if user_id in users]:
+            self.watchers[key].discard(user_id)
+            if not self.watchers[key]:
+                del self.watchers[key]
+
+    # Ingestion
+
+    def ingest(self, data: Dict[str, Any]):
+        try:
+            tick = Tick.from_dict(data)
+        except (KeyError, TypeError, ValueError):
+            self.stats["invalid"] += 1
+            return
+        self.stats["ticks"] += 1
+        self.throughput.add()
+        self.stats["last_tick_lag_ms"] = round((time.time() - tick.ts) * 1000, 1)
+        change = self.index.apply(tick)
+        if change is None:
+            return
+        status, market = change
+        if match_key(market.match) in self.watchers:
+            # Coalesced per market: only the latest state is sent
+            self._pending[market.market_id] = (status, market.to_dict(self.alert_stake))
+            self.stats["alerts_queued"] += 1
+            self._wake.set()
+
+    async def consume(self, source: AsyncIterator[Dict[str, Any]]):
+        async for data in source:
+            self.ingest(data)
+
+    async def _dispatch(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            pending, self._pending = self._pending, {}
+            for status, market in pending.values():
+                message = {"type": "odds_alert", "status": status, "market": market,
+                           "timestamp": datetime.utcnow().isoformat()}
+                for user_id in list(self.watchers.get(match_key(market["match"]), ())):
+                    try:
+                        # Every worker runs its own feed for its own watchers, so no cross-worker relay
+                        await self.manager.broadcast_to_user(message, user_id, relay=False)
+                        self.stats["alerts_sent"] += 1
+                    except Exception:
+                        logger.exception("Could not send odds alert to %s", user_id)
+
+    async def _run_source(self, source):
+        try:
+            await self.consume(source)
+            logger.info("Odds feed %s finished", self.source_spec)
+        except Exception:
+            logger.exception("Odds feed %s failed", self.source_spec)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        self._tasks.append(asyncio.ensure_future(self._dispatch()))
+        source = build_source(self.source_spec)
+        if source is not None:
+            self._tasks.append(asyncio.ensure_future(self._run_source(source)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.stats, source=self.source_spec or None, markets=len(self.index.markets),
+                    evaluations=self.index.evaluations,
+                    opportunities=len(self.index.opportunities()), watched_matches=len(self.watchers),
+                    ticks_per_second=round(self.throughput.rate(), 1))
@@ -0,0 +1,144 @@
+"""Projected, validation-free reads for documents the server wrote itself.
+
+Every calculator and broker document was built from a Pydantic model before it
+was stored, so re-validating it on the way out only burns CPU. In ``trusted``
+mode (the default) list endpoints ask Mongo for just the fields the view needs
+and encode the raw dicts straight to JSON; ``READ_PATH_MODE=validated`` restores
+the old build-a-model-per-document behaviour.
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Type
+
+from pydantic import BaseModel
+from starlette.responses import Response, StreamingResponse
+
+READ_PATH_MODE = os.environ.get('READ_PATH_MODE', 'trusted').lower()
+
+_SINGLE_LIST = ["id", "match_name", "stake", "odds", "potential_profit", "updated_at"]
+_PRO_LIST = ["id", "match_name", "back_stake", "back_odds", "lay_stake", "lay_odds", "profit_loss", "updated_at"]
+_BROKER_LIST = ["id", "account_name", "balance", "commission_rate", "account_type", "is_active", "updated_at"]
+
+# Field lists per collection and view; None means every stored field except _id
+VIEW_FIELDS: Dict[str, Dict[str, Optional[List[str]]]] = {
+    "single_calculator": {
+        "list": _SINGLE_LIST,
+        "detail": None,
+        "export": ["match_name", "stake", "odds", "commission", "potential_profit",
+                   "lay_odds", "lay_stake", "created_at", "updated_at"],
+    },
+    "pro_calculator": {
+        "list": _PRO_LIST,
+        "detail": None,
+        "export": ["match_name", "back_stake", "back_odds", "lay_stake", "lay_odds",
+                   "commission", "profit_loss", "created_at", "updated_at"],
+    },
+    "broker_accounts": {
+        "list": _BROKER_LIST,
+        "detail": None,
+        "export": ["account_name", "account_type", "balance", "commission_rate",
+                   "is_active", "created_at", "updated_at"],
+    },
+}
+
+
+def projection(collection_name: str, view: str) -> Dict[str, int]:
+    fields = VIEW_FIELDS[collection_name][view]
+    if fields is None:
+        return {"_id": 0}
+    return {"_id": 0, **{name: 1 for name in fields}}
+
+
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(documents: Any) -> str:
+    """JSON encoding matching FastAPI's output for these documents (ISO datetimes)."""
+    return json.dumps(documents, default=_json_default, separators=(",", ":"))
+
+
+def _overlay(documents: List[Dict[str, Any]], pending: List[Dict[str, Any]], fields: Optional[List[str]]):
+    """Replace/append stored documents with not-yet-flushed versions of the same records."""
+    if not pending:
+        return documents
+    by_id = {document["id"]: document for document in pending}
+    merged = [by_id.pop(document["id"], document) for document in documents]
+    merged.extend(by_id.values())
+    if fields is not None:
+        merged = [{name: document[name] for name in fields if name in document} for document in merged]
+    return merged
+
+
+async def read_documents(collection, query: Dict[str, Any], model: Type[BaseModel],
+                         view: str = "detail", limit: int = 1000,
+                         pending: Optional[List[Dict[str, Any]]] = None, session=None):
+    """Documents for a list endpoint, as a ready JSON response or validated models.
+
+    ``pending`` carries write-behind saves that haven't reached Mongo yet.
+    """
+    if READ_PATH_MODE == "validated":
+        documents = await collection.find(query, session=session).to_list(limit)
+    else:
+        documents = await collection.find(query, projection(collection.name, view), session=session).to_list(limit)
+    return render_documents(documents, collection.name, model, view, pending)
+
+
+def view_fields(collection_name: str, view: str) -> Optional[List[str]]:
+    """Fields a stored document is cut down to for ``view`` (None: keep it whole)."""
+    return None if READ_PATH_MODE == "validated" else VIEW_FIELDS[collection_name][view]
+
+
+def render_documents(documents: List[Dict[str, Any]], collection_name: str, model: Type[BaseModel],
+                     view: str = "detail", pending: Optional[List[Dict[str, Any]]] = None):
+    """The list response for documents already fetched and cut to ``view_fields``."""
+    if READ_PATH_MODE == "validated":
+        return [model(**document) for document in _overlay(documents, pending, None)]
+    documents = _overlay(documents, pending, VIEW_FIELDS[collection_name][view])
+    return Response(dumps(documents), media_type="application/json")
+
+
+async def _chain(*sources) -> AsyncIterator[Dict[str, Any]]:
+    for source in sources:
+        async for document in source:
+            yield document
+
+
+async def _csv_rows(documents: AsyncIterator[Dict[str, Any]], fields: List[str]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    batch = 0
+    async for document in documents:
+        writer.writerow([
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in (document.get(name, "") for name in fields)
+        ])
+        batch += 1
+        if batch >= 500:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            batch = 0
+    yield buffer.getvalue()
+
+
+def export_csv(collection, query: Dict[str, Any], filename: str,
+               archived: Optional[AsyncIterator[Dict[str, Any]]] = None) -> StreamingResponse:
+    """Stream the export view as CSV straight from the cursor, one batch at a time.
+
+    ``archived`` records (older, moved out of the collection) are written first.
+    """
+    fields = VIEW_FIELDS[collection.name]["export"]
+    cursor = collection.find(query, projection(collection.name, "export")).sort("created_at", 1)
+    documents = _chain(archived, cursor) if archived is not None else cursor
+    return StreamingResponse(
+        _csv_rows(documents, fields),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
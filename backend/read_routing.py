@@ -0,0 +1,133 @@
+"""Per-route read preferences with read-your-own-writes on secondaries.
+
+List, export, analytics and admin report reads may go to secondaries (``READ_PREFERENCE_*``);
+authentication and every write stay on the primary through the plain ``db``
+handle. To keep a user's own saves visible, writes run in a causally consistent
+session whose ``operationTime``/``$clusterTime`` are remembered per user and
+also handed to the client as an ``X-Causal-Token`` header. The next list read
+advances a fresh session to the newer of the two, so the secondary waits until
+it has caught up to that write before answering. Should a secondary reject the
+token (e.g. a tampered cluster-time signature), the read is retried on the
+primary.
+
+For local testing, a single-node replica set is enough:
+
+    docker run -d -p 27017:27017 mongo:7 --replSet rs0
+    docker exec <container> mongosh --eval 'rs.initiate()'
+    MONGO_URL='mongodb://localhost:27017/?replicaSet=rs0'
+"""
+import base64
+import logging
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import bson
+from pymongo.errors import OperationFailure
+from pymongo.read_preferences import (
+    Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred,
+)
+
+logger = logging.getLogger(__name__)
+
+CAUSAL_TOKEN_HEADER = "X-Causal-Token"
+
+ROUTE_DEFAULTS = {
+    "list": "secondaryPreferred",
+    "export": "secondaryPreferred",
+    "analytics": "secondaryPreferred",
+    "reports": "secondaryPreferred",
+}
+
+_MODES = {
+    "primarypreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondarypreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def _read_preference(mode: str, max_staleness: int):
+    if mode.lower() == "primary":
+        return Primary()
+    return _MODES[mode.lower()](max_staleness=max_staleness)
+
+
+class ReadRouter:
+    def __init__(self, client, db, policies: Dict[str, str], max_staleness: int = -1):
+        self.client = client
+        self.primary_db = db
+        self.policies = policies
+        self._databases = {
+            route_class: db.with_options(read_preference=_read_preference(mode, max_staleness))
+            for route_class, mode in policies.items()
+        }
+        self._tokens: "OrderedDict[str, Tuple[Any, Any]]" = OrderedDict()
+        self.max_users = 10000
+        self.primary_fallbacks = 0
+
+    @classmethod
+    def from_env(cls, client, db) -> "ReadRouter":
+        policies = {
+            route_class: os.environ.get(f'READ_PREFERENCE_{route_class.upper()}', default)
+            for route_class, default in ROUTE_DEFAULTS.items()
+        }
+        # -1 lets the driver pick; otherwise must be >= 90 seconds
+        max_staleness = int(os.environ.get('READ_MAX_STALENESS_SECONDS', -1))
+        return cls(client, db, policies, max_staleness)
+
+    def database(self, route_class: str):
+        return self._databases.get(route_class, self.primary_db)
+
+    # Causal tokens
+
+    def _remember(self, user_id: str, session):
+        if session.operation_time is None:
+            # Standalone server: no cluster time, and no secondaries to be stale either
+            return
+        self._tokens.pop(user_id, None)
+        self._tokens[user_id] = (session.operation_time, session.cluster_time)
+        while len(self._tokens) > self.max_users:
+            self._tokens.popitem(last=False)
+
+    def token_for(self, user_id: str) -> Optional[str]:
+        remembered = self._tokens.get(user_id)
+        if remembered is None:
+            return None
+        operation_time, cluster_time = remembered
+        raw = bson.encode({"operationTime": operation_time, "clusterTime": cluster_time})
+        return base64.urlsafe_b64encode(raw).decode()
+
+    @staticmethod
+    def _decode(token: Optional[str]):
+        if not token:
+            return None
+        try:
+            decoded = bson.decode(base64.urlsafe_b64decode(token.encode()))
+            return decoded["operationTime"], decoded["clusterTime"]
+        except Exception:
+            return None
+
+    @asynccontextmanager
+    async def write_session(self, user_id: str):
+        async with await self.client.start_session(causal_consistency=True) as session:
+            yield session
+            self._remember(user_id, session)
+
+    async def read(self, route_class: str, user_id: str, client_token: Optional[str],
+                   operation: Callable[[Any, Any], Awaitable[Any]]):
+        """Run ``operation(db, session)`` on the route's read preference, after the user's last write."""
+        candidates = [c for c in (self._tokens.get(user_id), self._decode(client_token)) if c]
+        if not candidates or self.policies.get(route_class, "primary").lower() == "primary":
+            return await operation(self.database(route_class), None)
+        try:
+            async with await self.client.start_session(causal_consistency=True) as session:
+                for operation_time, cluster_time in candidates:
+                    session.advance_cluster_time(cluster_time)
+                    session.advance_operation_time(operation_time)
+                return await operation(self.database(route_class), session)
+        except OperationFailure as exc:
+            self.primary_fallbacks += 1
+            logger.warning("Causal read on %s failed (%s); retrying on primary", route_class, exc.code)
+            return await operation(self.primary_db, None)
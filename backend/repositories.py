@@ -0,0 +1,247 @@
+"""Storage behind the user, calculator and broker account routes.
+
+These routes use a repository rather than a Motor collection, so they run
+on either of two backends, chosen by ``STORAGE_BACKEND``:
+
+``mongo`` (default)  the collections as before. Writes go through
+                     causally consistent sessions and list reads go
+                     through ``ReadRouter``, so causal tokens and
+                     read-preference routing work as they did;
+``memory``           dicts in this process, indexed the way the routes
+                     look things up: users by username and email, records
+                     by user and then id, in insertion order (Mongo's
+                     natural order for these collections).
+
+Both backends hand the same documents to ``read_path``, so responses are
+byte-for-byte the same. The memory backend is for tests and benchmarks:
+nothing is persisted or shared between workers, there is no write-behind
+buffer, and the Mongo-only features (analytics, search, jobs, exports,
+archival and admin reports) are not available: their routes answer 501. ``benchmarks/bench_api.py``
+runs the same requests on both backends to separate the framework's cost
+from the database's.
+"""
+import logging
+import os
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Dict, List, Optional, Type
+
+from pydantic import BaseModel
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from models import BrokerAccount, ProCalculatorData, SingleCalculatorData
+from read_path import read_documents, render_documents, view_fields
+
+# kind -> (collection, model)
+RECORDS = {
+    "single": ("single_calculator", SingleCalculatorData),
+    "pro": ("pro_calculator", ProCalculatorData),
+    "broker": ("broker_accounts", BrokerAccount),
+}
+
+LIST_LIMIT = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicateUser(Exception):
+    """The username is taken (possibly by a registration that won a race)."""
+
+
+class DuplicateRecord(Exception):
+    """The record id is taken by another user's record (ids are unique across users)."""
+
+
+def _matches(document: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    for name, condition in filters.items():
+        if isinstance(condition, dict) and "$in" in condition:
+            if document.get(name) not in condition["$in"]:
+                return False
+        elif document.get(name) != condition:
+            return False
+    return True
+
+
+def _cut(document: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return dict(document)
+    return {name: document[name] for name in fields if name in document}
+
+
+class MongoUserRepository:
+    def __init__(self, db):
+        self.collection = db.users
+
+    async def ensure_indexes(self):
+        # Several workers start at once; the unique index lets only one insert win
+        try:
+            await self.collection.create_index("username", unique=True)
+        except OperationFailure as exc:
+            # Usually duplicates already in users (DuplicateKeyError); logins still work, so carry on
+            logger.error("Could not create the unique username index, so concurrent registrations "
+                         "can duplicate a username until it exists: %s", exc)
+
+    async def find_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"username": username})
+
+    async def exists(self, username: str, email: str) -> bool:
+        return await self.collection.find_one({"$or": [{"username": username}, {"email": email}]}) is not None
+
+    async def insert(self, user: Dict[str, Any]):
+        try:
+            await self.collection.insert_one(user)
+        except DuplicateKeyError:
+            raise DuplicateUser(user["username"])
+
+
+class InMemoryUserRepository:
+    def __init__(self):
+        self._by_username: Dict[str, Dict[str, Any]] = {}
+        self._emails: Dict[str, str] = {}
+
+    async def ensure_indexes(self):
+        pass
+
+    async def find_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        user = self._by_username.get(username)
+        return dict(user) if user is not None else None
+
+    async def exists(self, username: str, email: str) -> bool:
+        return username in self._by_username or email in self._emails
+
+    async def insert(self, user: Dict[str, Any]):
+        if user["username"] in self._by_username:
+            raise DuplicateUser(user["username"])
+        self._by_username[user["username"]] = dict(user)
+        self._emails[user.get("email")] = user["username"]
+
+
+class MongoRecordRepository:
+    def __init__(self, db, read_router, name: str, model: Type[BaseModel]):
+        self.db = db
+        self.read_router = read_router
+        self.name = name
+        self.model = model
+
+    @property
+    def collection(self):
+        return self.db[self.name]
+
+    async def list(self, user_id: str, view: str = "detail", causal_token: Optional[str] = None,
+                   pending: Optional[List[Dict[str, Any]]] = None):
+        return await self.read_router.read(
+            "list", user_id, causal_token,
+            lambda reader, session: read_documents(
+                reader[self.name], {"user_id": user_id}, self.model, view, pending=pending, session=session,
+            ),
+        )
+
+    async def find(self, user_id: str, filters: Optional[Dict[str, Any]] = None,
+                   fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        projection = {"_id": 0, **{name: 1 for name in fields or ()}}
+        return await self.collection.find({"user_id": user_id, **(filters or {})}, projection).to_list(None)
+
+    async def save(self, document: Dict[str, Any]):
+        """Insert or overwrite the user's record with this id."""
+        key = {"id": document["id"], "user_id": document["user_id"]}
+        async with self.read_router.write_session(document["user_id"]) as session:
+            try:
+                await self.collection.update_one(key, {"$set": document}, upsert=True, session=session)
+            except DuplicateKeyError:
+                # Either a concurrent first save of this record won the insert, or the id is another user's
+                result = await self.collection.update_one(key, {"$set": document}, session=session)
+                if result.matched_count == 0:
+                    raise DuplicateRecord(document["id"])
+
+    async def save_many(self, user_id: str, documents: List[Dict[str, Any]]):
+        """``save`` for a batch of the user's records, in one unordered bulk write."""
+        async with self.read_router.write_session(user_id) as session:
+            await self.collection.bulk_write([
+                UpdateOne({"id": document["id"], "user_id": user_id}, {"$set": document}, upsert=True)
+                for document in documents
+            ], ordered=False, session=session)
+
+    async def update(self, document: Dict[str, Any]) -> bool:
+        """Overwrite an existing record; False if the user has none with this id."""
+        key = {"id": document["id"], "user_id": document["user_id"]}
+        async with self.read_router.write_session(document["user_id"]) as session:
+            result = await self.collection.update_one(key, {"$set": document}, session=session)
+        return result.matched_count > 0
+
+    async def delete(self, user_id: str, record_id: str) -> bool:
+        async with self.read_router.write_session(user_id) as session:
+            result = await self.collection.delete_one({"id": record_id, "user_id": user_id}, session=session)
+        return result.deleted_count > 0
+
+
+class InMemoryRecordRepository:
+    def __init__(self, name: str, model: Type[BaseModel]):
+        self.name = name
+        self.model = model
+        # user_id -> record id -> document; dicts keep insertion order
+        self._by_user: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._owners: Dict[str, str] = {}  # record id -> user_id, as the unique _id enforces on Mongo
+
+    async def list(self, user_id: str, view: str = "detail", causal_token: Optional[str] = None,
+                   pending: Optional[List[Dict[str, Any]]] = None):
+        fields = view_fields(self.name, view)
+        documents = [_cut(document, fields)
+                     for document in islice(self._by_user.get(user_id, {}).values(), LIST_LIMIT)]
+        return render_documents(documents, self.name, self.model, view, pending)
+
+    async def find(self, user_id: str, filters: Optional[Dict[str, Any]] = None,
+                   fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return [_cut(document, fields) for document in self._by_user.get(user_id, {}).values()
+                if _matches(document, filters or {})]
+
+    async def save(self, document: Dict[str, Any]):
+        if self._owners.setdefault(document["id"], document["user_id"]) != document["user_id"]:
+            raise DuplicateRecord(document["id"])
+        self._by_user.setdefault(document["user_id"], {})[document["id"]] = dict(document)
+
+    async def save_many(self, user_id: str, documents: List[Dict[str, Any]]):
+        for document in documents:
+            await self.save(dict(document, user_id=user_id))
+
+    async def update(self, document: Dict[str, Any]) -> bool:
+        records = self._by_user.get(document["user_id"], {})
+        if document["id"] not in records:
+            return False
+        records[document["id"]] = dict(document)
+        return True
+
+    async def delete(self, user_id: str, record_id: str) -> bool:
+        if self._by_user.get(user_id, {}).pop(record_id, None) is None:
+            return False
+        del self._owners[record_id]
+        return True
+
+
+@dataclass
+class Repositories:
+    users: Any
+    records: Dict[str, Any]  # by kind: "single", "pro", "broker"
+    backend: str
+
+    @property
+    def persistent(self) -> bool:
+        return self.backend == "mongo"
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"backend": self.backend}
+
+
+def build_repositories(db, read_router) -> Repositories:
+    backend = os.environ.get('STORAGE_BACKEND', 'mongo').lower()
+    if backend == 'memory':
+        return Repositories(
+            InMemoryUserRepository(),
+            {kind: InMemoryRecordRepository(name, model) for kind, (name, model) in RECORDS.items()},
+            backend,
+        )
+    return Repositories(
+        MongoUserRepository(db),
+        {kind: MongoRecordRepository(db, read_router, name, model) for kind, (name, model) in RECORDS.items()},
+        'mongo',
+    )
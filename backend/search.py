@@ -0,0 +1,220 @@
+"""Match-name search and autocomplete for calculator records.
+
+Full search (``/api/search``) is a ``$text`` query against a compound
+``(user_id, match_name text)`` index on each calculator collection. The
+equality prefix keeps each query inside one user's records, and the index
+uses language ``none``, so team names aren't stemmed. A query with no whole
+word hit, such as a half-typed "arse", falls back to the names the prefix
+index knows and fetches their records via ``(user_id, match_name)``.
+
+Autocomplete (``/api/search/suggest``) never touches Mongo once warm. Each
+user has a sorted array of ``(key, name)`` pairs, one per word start of every
+distinct match name ("chelsea vs arsenal", "vs arsenal", "arsenal"). Keys are
+case- and accent-folded, so a prefix lookup is two ``bisect`` calls. The
+array is built on a user's first lookup from the name of each record, and
+the save handlers keep it current per record. A rename drops the record's
+previous name, so the half-typed names an autosaved edit passes through
+don't linger as suggestions. Saves made on another
+worker show up once the entry expires (``SEARCH_INDEX_TTL_SECONDS``). The
+least recently used users are dropped past ``SEARCH_INDEX_MAX_USERS``.
+"""
+import asyncio
+import bisect
+import heapq
+import os
+import re
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from read_path import projection
+
+COLLECTIONS = {"single": "single_calculator", "pro": "pro_calculator"}
+CACHED_LOOKUPS = 256
+_WORD_START = re.compile(r"(?:^|(?<=[\s\-/&.,(]))\w", re.UNICODE)
+
+
+def fold(text: str) -> str:
+    """Lower-case, accent-free form used for keys and queries."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+def name_keys(name: str) -> List[str]:
+    folded = fold(name)
+    return [folded[match.start():] for match in _WORD_START.finditer(folded)]
+
+
+class PrefixIndex:
+    """One user's match names, as a sorted array of (folded suffix, name)."""
+
+    def __init__(self, names: Dict[str, str]):
+        self.names = names  # record id -> its current match name
+        self.counts: Dict[str, int] = dict(Counter(names.values()))
+        self.lengths = {name: len(fold(name)) for name in self.counts}
+        self.entries: List[Tuple[str, str]] = sorted(
+            (key, name) for name in self.counts for key in name_keys(name)
+        )
+        self.built_at = time.monotonic()
+        # Short prefixes match much of the array; remember answers until the next change
+        self._cache: Dict[Tuple[str, int], List[str]] = {}
+
+    def set(self, record_id: str, name: str):
+        """Record ``record_id`` now carries ``name`` (empty: none)."""
+        previous = self.names.get(record_id)
+        if previous == name:
+            return
+        self._cache.clear()
+        if previous:
+            self._remove(previous)
+        if name:
+            self.names[record_id] = name
+            self._add(name)
+        else:
+            self.names.pop(record_id, None)
+
+    def _add(self, name: str):
+        if name in self.counts:
+            self.counts[name] += 1
+            return
+        self.counts[name] = 1
+        self.lengths[name] = len(fold(name))
+        for key in name_keys(name):
+            bisect.insort(self.entries, (key, name))
+
+    def _remove(self, name: str):
+        self.counts[name] -= 1
+        if self.counts[name] > 0:
+            return
+        del self.counts[name], self.lengths[name]
+        for key in name_keys(name):
+            position = bisect.bisect_left(self.entries, (key, name))
+            if position < len(self.entries) and self.entries[position] == (key, name):
+                del self.entries[position]
+
+    def lookup(self, prefix: str, limit: int) -> List[str]:
+        prefix = fold(prefix)
+        cached = self._cache.get((prefix, limit))
+        if cached is None:
+            if len(self._cache) >= CACHED_LOOKUPS:
+                self._cache.clear()
+            cached = self._cache[(prefix, limit)] = self._lookup(prefix, limit)
+        return cached
+
+    def _lookup(self, prefix: str, limit: int) -> List[str]:
+        start = bisect.bisect_left(self.entries, (prefix,))
+        end = bisect.bisect_left(self.entries, (prefix + "\U0010ffff",), lo=start)
+        # name -> matched from its first word (that key is the whole folded name)
+        first_word: Dict[str, bool] = {}
+        for key, name in self.entries[start:end]:
+            first_word[name] = first_word.get(name, False) or len(key) == self.lengths[name]
+        # Names the user saves most often first, then those matching from their first word
+        return heapq.nsmallest(limit, first_word, key=lambda name: (-self.counts[name], not first_word[name], name))
+
+
+class MatchSearch:
+    def __init__(self, db, ttl_seconds: float = 300, max_users: int = 5000, limit: int = 50):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self.limit = limit
+        self._indexes: "OrderedDict[str, PrefixIndex]" = OrderedDict()
+        self._building: Dict[str, asyncio.Future] = {}
+        self._saved_while_building: Dict[str, List[Tuple[str, str]]] = {}
+        self.stats = {"builds": 0, "suggest": 0, "search": 0, "fallbacks": 0}
+
+    @classmethod
+    def from_env(cls, db) -> "MatchSearch":
+        return cls(
+            db,
+            ttl_seconds=float(os.environ.get('SEARCH_INDEX_TTL_SECONDS', 300)),
+            max_users=int(os.environ.get('SEARCH_INDEX_MAX_USERS', 5000)),
+            limit=int(os.environ.get('SEARCH_RESULT_LIMIT', 50)),
+        )
+
+    async def ensure_indexes(self):
+        for name in COLLECTIONS.values():
+            await self.db[name].create_index(
+                [("user_id", 1), ("match_name", "text")], default_language="none", name="user_match_name_text",
+            )
+            await self.db[name].create_index([("user_id", 1), ("match_name", 1)])
+
+    async def _build(self, user_id: str) -> PrefixIndex:
+        names: Dict[str, str] = {}
+        for name in COLLECTIONS.values():
+            async for row in self.db[name].find(
+                {"user_id": user_id, "match_name": {"$nin": ["", None]}}, {"_id": 0, "id": 1, "match_name": 1},
+            ):
+                names[row["id"]] = row["match_name"]
+        self.stats["builds"] += 1
+        return PrefixIndex(names)
+
+    async def index_for(self, user_id: str) -> PrefixIndex:
+        index = self._indexes.get(user_id)
+        if index is not None and time.monotonic() - index.built_at < self.ttl_seconds:
+            self._indexes.move_to_end(user_id)
+            return index
+        building = self._building.get(user_id)
+        if building is None:
+            # One build per user however many keystrokes arrive while it runs
+            building = self._building[user_id] = asyncio.ensure_future(self._build(user_id))
+            building.add_done_callback(lambda _: self._building.pop(user_id, None))
+        index = await asyncio.shield(building)
+        for record_id, match_name in self._saved_while_building.pop(user_id, ()):
+            index.set(record_id, match_name)
+        self._indexes[user_id] = index
+        self._indexes.move_to_end(user_id)
+        while len(self._indexes) > self.max_users:
+            self._indexes.popitem(last=False)
+        return index
+
+    def record_saved(self, user_id: str, record_id: str, match_name: str):
+        """Keep an already-built index current; unbuilt users pick the name up on first use."""
+        if user_id in self._building:
+            self._saved_while_building.setdefault(user_id, []).append((record_id, match_name))
+        index = self._indexes.get(user_id)
+        if index is not None:
+            index.set(record_id, match_name)
+
+    def forget(self, user_id: str):
+        self._indexes.pop(user_id, None)
+
+    async def suggest(self, user_id: str, prefix: str, limit: int = 10) -> List[str]:
+        self.stats["suggest"] += 1
+        limit = max(1, min(limit, self.limit))
+        if not fold(prefix):
+            return []
+        return (await self.index_for(user_id)).lookup(prefix, limit)
+
+    async def search(self, reader, user_id: str, query: str, kinds: List[str],
+                     limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Records whose match name contains the query's words, best matches first."""
+        self.stats["search"] += 1
+        limit = max(1, min(limit or self.limit, self.limit))
+        results: List[Dict[str, Any]] = []
+        for kind in kinds:
+            collection = reader[COLLECTIONS[kind]]
+            fields = projection(collection.name, "list") | {"score": {"$meta": "textScore"}}
+            cursor = collection.find({"user_id": user_id, "$text": {"$search": query}}, fields)
+            async for document in cursor.sort([("score", {"$meta": "textScore"})]).limit(limit):
+                results.append(dict(document, kind=kind))
+        if not results:
+            names = (await self.index_for(user_id)).lookup(query, limit)
+            if names:
+                self.stats["fallbacks"] += 1
+            for kind in kinds if names else ():
+                collection = reader[COLLECTIONS[kind]]
+                cursor = collection.find({"user_id": user_id, "match_name": {"$in": names}},
+                                         projection(collection.name, "list"))
+                async for document in cursor.sort("updated_at", -1).limit(limit):
+                    results.append(dict(document, kind=kind, score=None))
+        results.sort(key=lambda document: -(document["score"] or 0))
+        return results[:limit]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(
+            self.stats,
+            users=len(self._indexes),
+            entries=sum(len(index.entries) for index in self._indexes.values()),
+        )
@@ -1,20 +1,45 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict
-import uuid
+from typing import List, Literal, Optional, Dict
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
-from jose import JWTError, jwt
 import hashlib
 import json
 import asyncio
+import signal
+import time
+from admission import RateLimited, build_auth_rate_limiter, build_connection_gate, client_ip
+from mongo_pool import build_monitors, mongo_client_options
+from health import CachedPing, ReadinessProbe
+from loop_monitor import LoopMonitor, RouteTracker, SamplingProfiler
+from static_assets import FrontendMount, StaticAssets, resolve_build_dir
+from read_path import VIEW_FIELDS, export_csv, projection
+from write_behind import WriteBehindBuffer
+from analytics import AnalyticsRollups
+from archive import CalculatorArchiver
+from odds_feed import OddsFeed
+from simulation import MonteCarloSimulator, SimulationError, bet_table
+from search import COLLECTIONS as SEARCH_KINDS, MatchSearch
+from storage_schema import VERSIONS_COLLECTION, SchemaDatabase, SchemaRegistry
+from structured_logging import (
+    REQUEST_ID_HEADER, AccessLogMiddleware, LoggingSetup, LogSampler, access_log_options, current_request_id,
+)
+from ws_commands import CommandError, CommandProtocol
+from tracing import PRODUCER, Tracer, TracingCommandListener, TracingMiddleware
+from worker_relay import BroadcastRelay
+from read_routing import CAUSAL_TOKEN_HEADER, ReadRouter
+from repositories import DuplicateRecord, DuplicateUser, build_repositories
+from admin_reports import AdminReports
+from drain import SERVICE_RESTART, DrainController
+from idempotency import REPLAYED_HEADER, IdempotencyMiddleware, IdempotencyStore, idempotent_paths
+from jobs import JobError, JobRunner, render_export, validate_records
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -22,22 +47,48 @@ load_dotenv(ROOT_DIR / '.env')
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 db_name = os.environ['DB_NAME']
-client = AsyncIOMotorClient(mongo_url)
-db = client[db_name]
+mongo_options = mongo_client_options()
+pool_monitor, command_monitor = build_monitors(mongo_options)
+# Request tracing (off unless TRACE_EXPORTER is set); Mongo commands become child spans of the request
+tracer = Tracer.from_env()
+mongo_listeners = [pool_monitor, command_monitor] + ([TracingCommandListener(tracer)] if tracer.enabled else [])
+# connect=False: no monitor threads or sockets until the first operation
+client = AsyncIOMotorClient(mongo_url, connect=False, event_listeners=mongo_listeners, **mongo_options)
+# Calculator/broker collections go through the versioned compact schema (see storage_schema.py)
+schema_registry = SchemaRegistry.from_env(client[db_name])
+db = SchemaDatabase(client[db_name], schema_registry)
 
-# Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Security (passlib/bcrypt and jose are imported on first use to keep cold start fast)
+_pwd_context = None
 security = HTTPBearer()
 
+def get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-super-secret-jwt-key-change-in-production')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRES_IN = os.environ.get('JWT_EXPIRES_IN', '7d')
 
+# Structured logging: JSON written from a listener thread, sampled access lines, request ids
+logging_setup = LoggingSetup.from_env().install()
+log_sampler = LogSampler.from_env()
+logger = logging.getLogger(__name__)
+
 # WebSocket Connection Manager
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, relay: BroadcastRelay):
         self.active_connections: Dict[str, List[WebSocket]] = {}
+        # Other workers' sockets, when the launcher runs several (see worker_relay.py)
+        self.relay = relay
+        # Sends in progress, so a drain can let them finish before closing sockets
+        self.sending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
         
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
@@ -47,24 +98,124 @@ class ConnectionManager:
         
     def disconnect(self, websocket: WebSocket, user_id: str):
         if user_id in self.active_connections:
-            self.active_connections[user_id].remove(websocket)
+            if websocket in self.active_connections[user_id]:
+                self.active_connections[user_id].remove(websocket)
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
                 
     async def send_personal_message(self, message: str, user_id: str):
         if user_id in self.active_connections:
-            for connection in self.active_connections[user_id]:
-                try:
-                    await connection.send_text(message)
-                except:
-                    # Connection closed, remove it
-                    await self.disconnect(connection, user_id)
+            self.sending += 1
+            self._idle.clear()
+            try:
+                for index, connection in enumerate(list(self.active_connections.get(user_id, []))):
+                    try:
+                        with tracer.span("ws.send", PRODUCER, **{"ws.user_id": user_id, "ws.socket": index}):
+                            await connection.send_text(message)
+                    except Exception:
+                        # Connection closed, remove it
+                        self.disconnect(connection, user_id)
+            finally:
+                self.sending -= 1
+                if not self.sending:
+                    self._idle.set()
                     
-    async def broadcast_to_user(self, data: dict, user_id: str):
+    async def broadcast_to_user(self, data: dict, user_id: str, relay: bool = True):
+        request_id = current_request_id()
+        if request_id and "request_id" not in data:
+            # Lets a client tie the update back to the request (X-Request-ID) that caused it
+            data = dict(data, request_id=request_id)
+        if user_id in self.active_connections and log_sampler.sample(f"broadcast:{data.get('type')}"):
+            logger.info("broadcast %s", data.get("type"), extra={
+                "user_id": user_id, "sockets": len(self.active_connections[user_id]),
+            })
         message = json.dumps(data)
-        await self.send_personal_message(message, user_id)
+        if relay:
+            self.relay.publish(user_id, message)
+        with tracer.span(f"broadcast {data.get('type')}", **{"ws.user_id": user_id}):
+            await self.send_personal_message(message, user_id)
+        
+    def deliver_relayed(self, user_id: str, message: str):
+        # Sent by another worker; only users with sockets here need it
+        if user_id in self.active_connections:
+            self.relay.stats["delivered"] += 1
+            asyncio.ensure_future(self.send_personal_message(message, user_id))
+
+    async def wait_until_idle(self):
+        await self._idle.wait()
+        
+    def sockets(self) -> List[tuple]:
+        return [(user_id, websocket) for user_id, sockets in self.active_connections.items() for websocket in list(sockets)]
+        
+    def connection_counts(self) -> dict:
+        return {
+            "users": len(self.active_connections),
+            "sockets": sum(len(sockets) for sockets in self.active_connections.values()),
+        }
+
+manager = ConnectionManager(BroadcastRelay.from_env())
+
+# Read-preference routing (lists/exports/analytics may use secondaries)
+read_router = ReadRouter.from_env(client, db)
+
+# Users, calculator records and broker accounts: Mongo, or in-process for tests/benchmarks (STORAGE_BACKEND)
+repositories = build_repositories(db, read_router)
+
+# Optional write-behind buffering for calculator autosave (in-memory saves have nothing to batch)
+write_behind = WriteBehindBuffer.from_env(db)
+write_behind.enabled = write_behind.enabled and repositories.persistent
+
+# P&L rollups for the analytics series
+analytics_rollups = AnalyticsRollups.from_env(db, read_db=read_router.database("analytics"))
+
+# Hot/cold archival of old calculator records
+archiver = CalculatorArchiver.from_env(db, ROOT_DIR)
+
+# Idempotency-Key replay for retried saves (claims kept in-process on the memory backend)
+idempotency_store = IdempotencyStore.from_env(db, persistent=repositories.persistent)
+
+# Cached cross-user reports for the admin dashboard
+admin_reports = AdminReports.from_env(read_router.database("reports"))
+
+# Match-name search (Mongo text index) and autocomplete (per-user in-memory prefix index)
+match_search = MatchSearch.from_env(db)
+
+# Background jobs (export/import/rebuild), progress pushed over WebSocket
+job_runner = JobRunner.from_env(db.raw, manager)  # GridFS needs the Motor database itself
 
-manager = ConnectionManager()
+# Monte Carlo bankroll simulation, chunked over the job process pool
+simulator = MonteCarloSimulator.from_env(job_runner.process_pool)
+
+# Event loop monitoring
+loop_monitor = LoopMonitor(
+    interval_ms=float(os.environ.get('LOOP_LAG_SAMPLE_INTERVAL_MS', 100)),
+    slow_threshold_ms=float(os.environ.get('SLOW_CALLBACK_THRESHOLD_MS', 200)),
+)
+profiler = SamplingProfiler()
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'false').lower() == 'true'
+
+# Odds-feed ingestion with arbitrage alerts to watching users
+odds_feed = OddsFeed.from_env(manager)
+
+# Graceful drain (SIGTERM or admin): spread reconnects, flush buffered saves
+drain_controller = DrainController.from_env(manager, flushers=[write_behind.flush])
+
+# Readiness probe (cached ping, so probes add no DB load; nothing to ping on the memory backend)
+readiness_probe = ReadinessProbe(
+    CachedPing(
+        client,
+        ttl_seconds=float(os.environ.get('READINESS_PING_TTL_SECONDS', 2)),
+        timeout_seconds=float(os.environ.get('READINESS_PING_TIMEOUT_SECONDS', 1)),
+    ) if repositories.persistent else None,
+    pool_monitor,
+    manager,
+    loop_monitor,
+    drain_controller,
+)
+
+# Admission control (reconnect storms after deploys)
+auth_rate_limiter = build_auth_rate_limiter(db)
+ws_connection_gate = build_connection_gate()
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-super-secret-jwt-key-change-in-production')
@@ -77,78 +228,23 @@ app = FastAPI(title="Sports Betting Calculator API", version="1.0.0")
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# User Models
-class UserBase(BaseModel):
-    email: EmailStr
-    username: str
-    full_name: Optional[str] = None
-    is_active: bool = True
-
-class UserCreate(UserBase):
-    password: str
-
-class UserLogin(BaseModel):
-    username: str
-    password: str
-
-class User(UserBase):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
-
-class Token(BaseModel):
-    access_token: str
-    token_type: str
-
-class TokenData(BaseModel):
-    username: Optional[str] = None
-
-# Calculator Data Models
-class SingleCalculatorData(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    match_name: str = ""
-    stake: float = 0.0
-    odds: float = 0.0
-    commission: float = 0.0
-    potential_profit: float = 0.0
-    lay_odds: float = 0.0
-    lay_stake: float = 0.0
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
-
-class ProCalculatorData(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    match_name: str = ""
-    back_stake: float = 0.0
-    back_odds: float = 0.0
-    lay_stake: float = 0.0
-    lay_odds: float = 0.0
-    commission: float = 0.0
-    profit_loss: float = 0.0
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
-
-class BrokerAccount(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    account_name: str
-    balance: float = 0.0
-    commission_rate: float = 0.0
-    account_type: str = "betfair"  # betfair, smarkets, etc.
-    is_active: bool = True
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+# Models
+from models import (
+    UserCreate, UserLogin, User, TokenData,
+    SingleCalculatorData, ProCalculatorData, BrokerAccount, Job, JobSubmit, StakeSolveRequest,
+    SimulationRequest,
+)
 
 # Utility Functions
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
+    
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -158,56 +254,113 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
+async def enforce_auth_rate_limit(request: Request, route: str, username: Optional[str]):
+    try:
+        await auth_rate_limiter.check(route, client_ip(request), username)
+    except RateLimited as exc:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please retry later",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await user_from_token(credentials.credentials)
+
+async def user_from_token(token: str) -> User:
+    from jose import JWTError, jwt
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    with tracer.span("auth.user_from_token"):
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username)
+        except JWTError:
+            raise credentials_exception
+        
+        user = await repositories.users.find_by_username(token_data.username)
+        if user is None:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    
-    user = await db.users.find_one({"username": token_data.username})
-    if user is None:
-        raise credentials_exception
     
     return User(**user)
 
+async def save_record(kind: str, document: Dict):
+    try:
+        await repositories.records[kind].save(document)
+    except DuplicateRecord:
+        raise HTTPException(status_code=409, detail="A record with this id already exists")
+
+def set_causal_token(response: Response, user_id: str):
+    # Lets the client's next read wait for this write even on another worker
+    token = read_router.token_for(user_id)
+    if token:
+        response.headers[CAUSAL_TOKEN_HEADER] = token
+
+def is_admin(user: User) -> bool:
+    return user.username == os.environ.get('ADMIN_USERNAME', 'admin')
+
+async def require_admin(current_user: User = Depends(get_current_user)):
+    if not is_admin(current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+async def require_mongo():
+    # Exports, analytics, search, jobs and reports query Mongo directly; the memory backend has none of it
+    if not repositories.persistent:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail=f"Not available with STORAGE_BACKEND={repositories.backend}")
+
 # Authentication Routes
 @api_router.post("/auth/register", response_model=User)
-async def register(user: UserCreate):
+async def register(user: UserCreate, request: Request):
+    await enforce_auth_rate_limit(request, "register", user.username)
+    
     # Check if user already exists
-    existing_user = await db.users.find_one({"$or": [{"username": user.username}, {"email": user.email}]})
-    if existing_user:
+    if await repositories.users.exists(user.username, user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username or email already registered"
         )
     
-    # Hash password and create user
-    hashed_password = get_password_hash(user.password)
-    user_dict = user.dict()
-    user_dict.pop("password")
+    # Hash password and create user (bcrypt runs off the event loop)
+    hashed_password = await run_in_threadpool(get_password_hash, user.password)
+    new_user = User(**user.dict(exclude={"password"}))
+    # Stored with the generated id, so every later token lookup gets the same User.id
+    user_dict = new_user.dict()
     user_dict["hashed_password"] = hashed_password
     
-    new_user = User(**{k: v for k, v in user_dict.items() if k != "hashed_password"})
-    await db.users.insert_one(user_dict)  # Insert the full dict with hashed_password
+    try:
+        await repositories.users.insert(user_dict)  # Insert the full dict with hashed_password
+    except DuplicateUser:
+        # Lost a race with a concurrent registration of the same username
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username or email already registered"
+        )
     
     return new_user
 
 @api_router.post("/auth/login", response_model=dict)
-async def login(user_credentials: UserLogin):
+async def login(user_credentials: UserLogin, request: Request):
+    await enforce_auth_rate_limit(request, "login", user_credentials.username)
+    
     # Find user
-    user = await db.users.find_one({"username": user_credentials.username})
-    if not user or not verify_password(user_credentials.password, user.get("hashed_password")):
+    user = await repositories.users.find_by_username(user_credentials.username)
+    password_ok = False
+    if user:
+        # bcrypt is deliberately slow; keep it off the event loop
+        password_ok = await run_in_threadpool(
+            verify_password, user_credentials.password, user.get("hashed_password")
+        )
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -237,26 +390,40 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 async def logout():
     return {"message": "Successfully logged out"}
 
+# kind -> (collection, model, buffered by write-behind)
+RECORD_KINDS = {
+    "single": ("single_calculator", SingleCalculatorData, True),
+    "pro": ("pro_calculator", ProCalculatorData, True),
+    "broker": ("broker_accounts", BrokerAccount, False),
+}
+
+async def list_records(kind: str, user_id: str, view: str, causal_token: Optional[str]):
+    collection, model, buffered = RECORD_KINDS[kind]
+    pending = write_behind.pending_for(collection, user_id) if buffered else None
+    return await repositories.records[kind].list(user_id, view, causal_token, pending)
+
 # Single Calculator Routes
 @api_router.get("/single/data")
-async def get_single_data(current_user: User = Depends(get_current_user)):
-    data = await db.single_calculator.find({"user_id": current_user.id}).to_list(1000)
-    return [SingleCalculatorData(**item) for item in data]
+async def get_single_data(request: Request, view: Literal["list", "detail"] = "detail", current_user: User = Depends(get_current_user)):
+    return await list_records("single", current_user.id, view, request.headers.get(CAUSAL_TOKEN_HEADER))
+
+@api_router.get("/single/export", dependencies=[Depends(require_mongo)])
+async def export_single_data(include_archived: bool = True, current_user: User = Depends(get_current_user)):
+    reader = read_router.database("export")
+    archived = archiver.records("single", current_user.id, reader.single_calculator) if include_archived else None
+    return export_csv(reader.single_calculator, {"user_id": current_user.id}, "single_calculator.csv", archived)
 
 @api_router.post("/single/data")
-async def save_single_data(data: SingleCalculatorData, current_user: User = Depends(get_current_user)):
+async def save_single_data(data: SingleCalculatorData, response: Response, current_user: User = Depends(get_current_user)):
     data.user_id = current_user.id
     data.updated_at = datetime.utcnow()
     
-    # Check if record exists
-    existing = await db.single_calculator.find_one({"id": data.id, "user_id": current_user.id})
-    if existing:
-        await db.single_calculator.update_one(
-            {"id": data.id, "user_id": current_user.id},
-            {"$set": data.dict()}
-        )
+    if write_behind.enabled:
+        # Acknowledge now; the buffer persists the latest state within its max delay
+        write_behind.enqueue("single_calculator", data.dict())
     else:
-        await db.single_calculator.insert_one(data.dict())
+        await save_record("single", data.dict())
+        set_causal_token(response, current_user.id)
     
     # Send real-time update
     data_dict = data.dict()
@@ -265,6 +432,7 @@ async def save_single_data(data: SingleCalculatorData, current_user: User = Depe
         if isinstance(value, datetime):
             data_dict[key] = value.isoformat()
     
+    match_search.record_saved(current_user.id, data.id, data.match_name)
     await manager.broadcast_to_user({
         "type": "data_update",
         "calculator": "single",
@@ -277,24 +445,26 @@ async def save_single_data(data: SingleCalculatorData, current_user: User = Depe
 
 # Pro Calculator Routes
 @api_router.get("/pro/data")
-async def get_pro_data(current_user: User = Depends(get_current_user)):
-    data = await db.pro_calculator.find({"user_id": current_user.id}).to_list(1000)
-    return [ProCalculatorData(**item) for item in data]
+async def get_pro_data(request: Request, view: Literal["list", "detail"] = "detail", current_user: User = Depends(get_current_user)):
+    return await list_records("pro", current_user.id, view, request.headers.get(CAUSAL_TOKEN_HEADER))
+
+@api_router.get("/pro/export", dependencies=[Depends(require_mongo)])
+async def export_pro_data(include_archived: bool = True, current_user: User = Depends(get_current_user)):
+    reader = read_router.database("export")
+    archived = archiver.records("pro", current_user.id, reader.pro_calculator) if include_archived else None
+    return export_csv(reader.pro_calculator, {"user_id": current_user.id}, "pro_calculator.csv", archived)
 
 @api_router.post("/pro/data")
-async def save_pro_data(data: ProCalculatorData, current_user: User = Depends(get_current_user)):
+async def save_pro_data(data: ProCalculatorData, response: Response, current_user: User = Depends(get_current_user)):
     data.user_id = current_user.id
     data.updated_at = datetime.utcnow()
     
-    # Check if record exists
-    existing = await db.pro_calculator.find_one({"id": data.id, "user_id": current_user.id})
-    if existing:
-        await db.pro_calculator.update_one(
-            {"id": data.id, "user_id": current_user.id},
-            {"$set": data.dict()}
-        )
+    if write_behind.enabled:
+        # Acknowledge now; the buffer persists the latest state within its max delay
+        write_behind.enqueue("pro_calculator", data.dict())
     else:
-        await db.pro_calculator.insert_one(data.dict())
+        await save_record("pro", data.dict())
+        set_causal_token(response, current_user.id)
     
     # Send real-time update
     data_dict = data.dict()
@@ -303,6 +473,7 @@ async def save_pro_data(data: ProCalculatorData, current_user: User = Depends(ge
         if isinstance(value, datetime):
             data_dict[key] = value.isoformat()
     
+    match_search.record_saved(current_user.id, data.id, data.match_name)
     await manager.broadcast_to_user({
         "type": "data_update",
         "calculator": "pro",
@@ -315,24 +486,16 @@ async def save_pro_data(data: ProCalculatorData, current_user: User = Depends(ge
 
 # Broker Account Routes
 @api_router.get("/broker/accounts")
-async def get_broker_accounts(current_user: User = Depends(get_current_user)):
-    accounts = await db.broker_accounts.find({"user_id": current_user.id}).to_list(1000)
-    return [BrokerAccount(**account) for account in accounts]
+async def get_broker_accounts(request: Request, view: Literal["list", "detail"] = "detail", current_user: User = Depends(get_current_user)):
+    return await list_records("broker", current_user.id, view, request.headers.get(CAUSAL_TOKEN_HEADER))
 
 @api_router.post("/broker/accounts")
-async def save_broker_account(account: BrokerAccount, current_user: User = Depends(get_current_user)):
+async def save_broker_account(account: BrokerAccount, response: Response, current_user: User = Depends(get_current_user)):
     account.user_id = current_user.id
     account.updated_at = datetime.utcnow()
     
-    # Check if record exists
-    existing = await db.broker_accounts.find_one({"id": account.id, "user_id": current_user.id})
-    if existing:
-        await db.broker_accounts.update_one(
-            {"id": account.id, "user_id": current_user.id},
-            {"$set": account.dict()}
-        )
-    else:
-        await db.broker_accounts.insert_one(account.dict())
+    await save_record("broker", account.dict())
+    set_causal_token(response, current_user.id)
     
     # Send real-time update
     account_dict = account.dict()
@@ -352,60 +515,481 @@ async def save_broker_account(account: BrokerAccount, current_user: User = Depen
     return account
 
 @api_router.put("/broker/accounts/{account_id}")
-async def update_broker_account(account_id: str, account: BrokerAccount, current_user: User = Depends(get_current_user)):
+async def update_broker_account(account_id: str, account: BrokerAccount, response: Response, current_user: User = Depends(get_current_user)):
     account.user_id = current_user.id
     account.id = account_id
     account.updated_at = datetime.utcnow()
     
-    result = await db.broker_accounts.update_one(
-        {"id": account_id, "user_id": current_user.id},
-        {"$set": account.dict()}
-    )
-    
-    if result.matched_count == 0:
+    if not await repositories.records["broker"].update(account.dict()):
         raise HTTPException(status_code=404, detail="Account not found")
     
+    set_causal_token(response, current_user.id)
     return account
 
 @api_router.delete("/broker/accounts/{account_id}")
-async def delete_broker_account(account_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.broker_accounts.delete_one({"id": account_id, "user_id": current_user.id})
-    
-    if result.deleted_count == 0:
+async def delete_broker_account(account_id: str, response: Response, current_user: User = Depends(get_current_user)):
+    if not await repositories.records["broker"].delete(current_user.id, account_id):
         raise HTTPException(status_code=404, detail="Account not found")
     
+    set_causal_token(response, current_user.id)
     return {"message": "Account deleted successfully"}
 
+# Analytics Routes
+@api_router.get("/analytics/series", dependencies=[Depends(require_mongo)])
+async def get_analytics_series(
+    interval: Literal["day", "week", "month"] = "day",
+    account_type: Literal["all", "single", "pro"] = "all",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user),
+):
+    points = await analytics_rollups.series(current_user.id, interval, account_type, start, end)
+    return {
+        "interval": interval,
+        "account_type": account_type,
+        "points": points,
+        "refreshed_at": analytics_rollups.last_refresh,
+    }
+
+@api_router.post("/analytics/refresh", dependencies=[Depends(require_mongo)])
+async def refresh_analytics(current_user: User = Depends(require_admin)):
+    refreshed = await analytics_rollups.refresh()
+    return {"refreshed": refreshed, "timestamp": datetime.utcnow()}
+
+@api_router.post("/analytics/simulate", dependencies=[Depends(require_mongo)])
+async def simulate_bankroll(simulation: SimulationRequest, current_user: User = Depends(get_current_user)):
+    if any(not 0 <= p <= 100 for p in simulation.percentiles):
+        raise HTTPException(status_code=422, detail="Percentiles must be between 0 and 100")
+    reader = read_router.database("analytics")
+    recent = {"sort": [("created_at", -1)], "limit": simulator.max_history}
+    history = {}
+    for account_type, collection, fields in (
+        ("single", reader.single_calculator, ("stake", "odds", "commission", "lay_stake", "lay_odds")),
+        ("pro", reader.pro_calculator, ("back_stake", "back_odds", "commission", "lay_stake", "lay_odds")),
+    ):
+        history[account_type] = []
+        if simulation.account_type in ("all", account_type):
+            history[account_type] = await collection.find(
+                {"user_id": current_user.id}, {name: 1 for name in fields} | {"_id": 0}, **recent
+            ).to_list(None)
+
+    bankroll = simulation.bankroll
+    if bankroll is None:
+        accounts = await repositories.records["broker"].find(current_user.id, {"is_active": True}, ["balance"])
+        bankroll = sum(account.get("balance") or 0 for account in accounts)
+        if bankroll <= 0:
+            raise HTTPException(status_code=422, detail="No broker balance to simulate; pass a bankroll")
+
+    try:
+        return await simulator.run(
+            bet_table(history["single"], history["pro"]), bankroll, simulation.simulations, simulation.horizon,
+            seed=simulation.seed, ruin_level=simulation.ruin_level, stake_scale=simulation.stake_scale,
+            percentiles=simulation.percentiles,
+        )
+    except SimulationError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+# Search Routes
+@api_router.get("/search", dependencies=[Depends(require_mongo)])
+async def search_records(
+    q: str,
+    kind: Literal["all", "single", "pro"] = "all",
+    limit: Optional[int] = None,
+    current_user: User = Depends(get_current_user),
+):
+    if not q.strip():
+        raise HTTPException(status_code=422, detail="q must not be empty")
+    kinds = list(SEARCH_KINDS) if kind == "all" else [kind]
+    results = await match_search.search(read_router.database("list"), current_user.id, q, kinds, limit)
+    return {"query": q, "results": results}
+
+@api_router.get("/search/suggest", dependencies=[Depends(require_mongo)])
+async def suggest_match_names(q: str = "", limit: int = 10, current_user: User = Depends(get_current_user)):
+    return {"query": q, "suggestions": await match_search.suggest(current_user.id, q, limit)}
+
+# Admin Reporting Routes
+@api_router.get("/admin/reports", dependencies=[Depends(require_mongo)])
+async def get_admin_reports(refresh: bool = False, current_user: User = Depends(require_admin)):
+    return {"reports": await admin_reports.overview(refresh), "timestamp": datetime.utcnow()}
+
+@api_router.get("/admin/reports/{name}", dependencies=[Depends(require_mongo)])
+async def get_admin_report(
+    name: Literal["users", "activity", "brokers"],
+    refresh: bool = False,
+    current_user: User = Depends(require_admin),
+):
+    report = await admin_reports.report(name, refresh)
+    report["timestamp"] = datetime.utcnow()
+    return report
+
+# Odds Feed Routes
+@api_router.get("/odds/markets")
+async def get_odds_markets(match: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    markets = odds_feed.index.markets_for(match) if match else odds_feed.index.opportunities()
+    return {"markets": [market.to_dict(odds_feed.alert_stake) for market in markets[:200]]}
+
+@api_router.get("/odds/stats")
+async def get_odds_stats(current_user: User = Depends(get_current_user)):
+    return odds_feed.snapshot()
+
+# Stake Solver Routes
+@api_router.post("/solver/stakes")
+async def solve_stakes(solve: StakeSolveRequest, current_user: User = Depends(get_current_user)):
+    # numpy is only needed here; importing it per worker at boot would slow cold start
+    from stake_solver import accounts_from_documents, outcomes_from_quotes, solve_markets
+    
+    filters = {"is_active": True}
+    if solve.account_ids is not None:
+        filters["id"] = {"$in": solve.account_ids}
+    accounts = accounts_from_documents(await repositories.records["broker"].find(current_user.id, filters))
+    if not accounts:
+        raise HTTPException(status_code=400, detail="No active broker accounts with a balance")
+
+    markets = []
+    for market in solve.markets:
+        data = market.dict()
+        if not data["outcomes"]:
+            live = odds_feed.index.markets.get(market.market_id)
+            if live is None:
+                raise HTTPException(status_code=404, detail=f"Market {market.market_id} has no prices")
+            data["name"] = data["name"] or live.match
+            data["outcomes"] = outcomes_from_quotes(live.quotes)
+        markets.append(data)
+
+    # Each market is a small LP at worst; hundreds of them stay off the event loop
+    results = await run_in_threadpool(solve_markets, markets, accounts, solve.max_stake_per_market)
+    return {
+        "markets": results,
+        "accounts": [{"id": a.id, "account_name": a.name, "balance": a.balance, "commission": a.commission} for a in accounts],
+        "profitable": sum(1 for result in results if result["bets"]),
+    }
+
+# Drain Routes
+@api_router.post("/admin/drain", status_code=status.HTTP_202_ACCEPTED)
+async def start_drain(shutdown: bool = False, current_user: User = Depends(require_admin)):
+    task = drain_controller.start(f"admin:{current_user.username}")
+    if shutdown:
+        # Same path as SIGTERM: once drained, hand over to the server's own shutdown
+        task.add_done_callback(lambda _: os.kill(os.getpid(), signal.SIGINT))
+    return drain_controller.snapshot()
+
+@api_router.get("/admin/drain")
+async def get_drain_status(current_user: User = Depends(require_admin)):
+    return drain_controller.snapshot()
+
+# Tracing Routes
+@api_router.get("/admin/traces")
+async def get_recent_traces(limit: int = 20, current_user: User = Depends(require_admin)):
+    # Only the memory exporter keeps spans in-process; file/OTLP exporters are read elsewhere
+    if not hasattr(tracer.exporter, "traces"):
+        raise HTTPException(status_code=404, detail="Set TRACE_EXPORTER=memory to inspect traces here")
+    await asyncio.to_thread(tracer.flush)
+    return {"traces": tracer.exporter.traces(max(1, min(limit, 200))), "tracing": tracer.snapshot()}
+
+# Storage Schema Routes
+@api_router.get("/admin/storage", dependencies=[Depends(require_mongo)])
+async def get_storage_schema(current_user: User = Depends(require_admin)):
+    # Migration state and the last size report per collection, as written by migrate_storage.py
+    versions = await db[VERSIONS_COLLECTION].find({}).to_list(None)
+    return {"collections": versions, "schema": schema_registry.snapshot()}
+
+# Background Job Types
+JOB_COLLECTIONS = {"single": "single_calculator", "pro": "pro_calculator", "broker": "broker_accounts"}
+IMPORT_BATCH_SIZE = 500
+
+def _job_collection(params: Dict) -> str:
+    kind = params.get("calculator", "single")
+    if kind not in JOB_COLLECTIONS:
+        raise ValueError(f"Unknown calculator: {kind}")
+    return JOB_COLLECTIONS[kind]
+
+@job_runner.job_type("export", concurrency=int(os.environ.get('JOB_CONCURRENCY_EXPORT', 2)))
+async def export_job(ctx, params: Dict):
+    collection_name = _job_collection(params)
+    fmt = "ndjson" if params.get("format") == "ndjson" else "csv"
+    collection = read_router.database("export")[collection_name]
+    query = {"user_id": ctx.user_id}
+
+    documents = []
+    if collection_name in ("single_calculator", "pro_calculator") and params.get("include_archived", True):
+        await ctx.progress(0.0, "Reading archive", force=True)
+        async for document in archiver.records(params.get("calculator", "single"), ctx.user_id, collection):
+            documents.append(document)
+
+    total = (await collection.count_documents(query) + len(documents)) or 1
+    async for document in collection.find(query, projection(collection_name, "export")).sort("created_at", 1):
+        documents.append(document)
+        if len(documents) % 1000 == 0:
+            await ctx.progress(0.8 * len(documents) / total, "Reading records")
+
+    await ctx.progress(0.8, "Rendering file", force=True)
+    body = await ctx.run_cpu(render_export, documents, VIEW_FIELDS[collection_name]["export"], fmt)
+    filename = f"{collection_name}_{datetime.utcnow():%Y%m%d}.{fmt}"
+    file_id = await ctx.store_result(filename, body, "text/csv" if fmt == "csv" else "application/x-ndjson")
+    return {"file_id": file_id, "filename": filename, "rows": len(documents), "bytes": len(body)}
+
+@job_runner.job_type("import", concurrency=int(os.environ.get('JOB_CONCURRENCY_IMPORT', 1)),
+                     transient_params=("records",))
+async def import_job(ctx, params: Dict):
+    _job_collection(params)  # rejects an unknown calculator before any work
+    kind = params.get("calculator", "single")
+    records = params.get("records") or []
+    imported, errors = 0, []
+    for start in range(0, len(records), IMPORT_BATCH_SIZE):
+        batch = records[start:start + IMPORT_BATCH_SIZE]
+        valid, failed = await ctx.run_cpu(validate_records, kind, batch, ctx.user_id)
+        errors.extend({"row": start + index, "error": error} for index, error in failed)
+        if valid:
+            await repositories.records[kind].save_many(ctx.user_id, valid)
+            imported += len(valid)
+            match_search.forget(ctx.user_id)
+        await ctx.progress((start + len(batch)) / len(records), f"Imported {imported} of {len(records)}")
+    return {"imported": imported, "failed": len(errors), "errors": errors[:100]}
+
+@job_runner.job_type("analytics_rebuild", concurrency=1, admin_only=True)
+async def analytics_rebuild_job(ctx, params: Dict):
+    account_types = [params["account_type"]] if params.get("account_type") else ["single", "pro"]
+    refreshed = {}
+    for index, account_type in enumerate(account_types):
+        await ctx.progress(index / len(account_types), f"Rebuilding {account_type}", force=True)
+        refreshed.update(await analytics_rollups.rebuild(account_type))
+    return {"refreshed": {name: high.isoformat() for name, high in refreshed.items()}}
+
+@job_runner.job_type("archive", concurrency=1, admin_only=True)
+async def archive_job(ctx, params: Dict):
+    async def progress(account_type, totals):
+        await ctx.progress(0.5 if account_type == "pro" else 0.0,
+                           f"Archived {totals['records']} {account_type} records")
+
+    account_types = [params["account_type"]] if params.get("account_type") else None
+    return await archiver.archive(account_types, progress=progress)
+
+# Background Job Routes
+@api_router.post("/jobs", response_model=Job, status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(require_mongo)])
+async def submit_job(job: JobSubmit, current_user: User = Depends(get_current_user)):
+    try:
+        return await job_runner.submit(current_user.id, job.type, job.params, is_admin=is_admin(current_user))
+    except JobError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=str(exc))
+
+@api_router.get("/jobs", response_model=List[Job], dependencies=[Depends(require_mongo)])
+async def list_jobs(current_user: User = Depends(get_current_user)):
+    return await job_runner.list(current_user.id)
+
+@api_router.get("/jobs/{job_id}", response_model=Job, dependencies=[Depends(require_mongo)])
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await job_runner.get(job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.post("/jobs/{job_id}/cancel", response_model=Job, dependencies=[Depends(require_mongo)])
+async def cancel_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await job_runner.cancel(job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.get("/jobs/{job_id}/result", dependencies=[Depends(require_mongo)])
+async def get_job_result(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await job_runner.get(job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    stream = await job_runner.open_result(job)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Job has no downloadable result")
+
+    async def chunks():
+        while True:
+            chunk = await stream.readchunk()
+            if not chunk:
+                break
+            yield chunk
+
+    return StreamingResponse(
+        chunks(),
+        media_type=(stream.metadata or {}).get("content_type", "application/octet-stream"),
+        headers={"Content-Disposition": f'attachment; filename="{stream.filename}"'},
+    )
+
 # Health Check
 @api_router.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+    # Counters only; this must stay cheap enough to poll and never touch the DB
+    return {
+        "status": "healthy",
+        "timestamp": datetime.utcnow(),
+        "mongo_pool": pool_monitor.snapshot(),
+        "mongo_commands": command_monitor.snapshot(),
+        "event_loop": loop_monitor.snapshot(),
+        "write_behind": write_behind.snapshot(),
+        "jobs": job_runner.snapshot(),
+        "idempotency": idempotency_store.snapshot(),
+        "drain": drain_controller.snapshot(),
+        "odds_feed": odds_feed.snapshot(),
+        "simulations": simulator.snapshot(),
+        "ws_commands": ws_commands.snapshot(),
+        "search": match_search.snapshot(),
+        "logging": dict(logging_setup.snapshot(), sampled_out=log_sampler.sampled_out),
+        "tracing": tracer.snapshot(),
+        "worker_relay": manager.relay.snapshot(),
+        "storage_schema": schema_registry.snapshot(),
+        "storage": repositories.snapshot(),
+    }
+
+@api_router.get("/health/live")
+async def liveness_check():
+    # If the loop can run this handler, the worker is alive
+    return {"status": "alive", "timestamp": datetime.utcnow()}
+
+@api_router.get("/health/ready")
+async def readiness_check():
+    report = await readiness_probe.check()
+    report["timestamp"] = datetime.utcnow().isoformat()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+# Sampling profiler (opt-in via PROFILER_ENABLED)
+@api_router.get("/debug/profile", response_class=PlainTextResponse)
+async def capture_profile(
+    seconds: float = 10,
+    interval_ms: float = 5,
+    all_threads: bool = False,
+    current_user: User = Depends(require_admin),
+):
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    if not 0 < seconds <= 60 or not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 60] and interval_ms in [1, 1000]")
+    try:
+        collapsed = await profiler.profile(seconds, interval_ms=interval_ms, all_threads=all_threads)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return PlainTextResponse(collapsed)
+
+# WebSocket commands (save/list/delete over an authenticated socket, same handlers as HTTP)
+ws_commands = CommandProtocol(token_header=CAUSAL_TOKEN_HEADER, tracer=tracer)
+SAVE_HANDLERS = {"single": save_single_data, "pro": save_pro_data, "broker": save_broker_account}
+DELETE_HANDLERS = {"broker": delete_broker_account}
+
+def command_kind(message: dict, allowed) -> str:
+    kind = message.get("kind")
+    if kind not in allowed:
+        raise CommandError(f"kind must be one of: {', '.join(allowed)}")
+    return kind
+
+@ws_commands.command("save")
+async def save_command(user: User, message: dict, response: Response):
+    kind = command_kind(message, SAVE_HANDLERS)
+    data = message.get("data") or {}
+    if not isinstance(data, dict):
+        raise CommandError("data must be an object", 422)
+    record = RECORD_KINDS[kind][1](**dict(data, user_id=user.id))
+    return await SAVE_HANDLERS[kind](record, response, user)
+
+@ws_commands.command("list")
+async def list_command(user: User, message: dict, response: Response):
+    view = message.get("view", "detail")
+    if view not in ("list", "detail"):
+        raise CommandError("view must be list or detail")
+    return await list_records(command_kind(message, RECORD_KINDS), user.id, view, message.get("causal_token"))
+
+@ws_commands.command("delete")
+async def delete_command(user: User, message: dict, response: Response):
+    kind = command_kind(message, DELETE_HANDLERS)
+    return await DELETE_HANDLERS[kind](str(message.get("record_id", "")), response, user)
 
 # WebSocket endpoint for real-time updates
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
+    if drain_controller.draining:
+        # Worker is restarting: point the client at another one after a spread-out delay
+        await websocket.accept()
+        await websocket.send_text(json.dumps({
+            "type": "reconnect",
+            "retry_after": drain_controller.retry_hint(),
+            "reason": "draining",
+            "timestamp": datetime.utcnow().isoformat()
+        }))
+        await websocket.close(code=SERVICE_RESTART)
+        return
+    
+    if not ws_connection_gate.try_acquire():
+        # Too many handshakes in flight: accept just long enough to hand out a
+        # jittered retry hint, so refused clients don't all come back together
+        await websocket.accept()
+        await websocket.send_text(json.dumps({
+            "type": "reconnect",
+            "retry_after": ws_connection_gate.retry_hint(),
+            "timestamp": datetime.utcnow().isoformat()
+        }))
+        await websocket.close(code=1013)
+        return
+    
     try:
+        await manager.connect(websocket, user_id)
         # Send welcome message
         await manager.broadcast_to_user({
             "type": "connection",
             "message": "Connected to real-time updates",
             "timestamp": datetime.utcnow().isoformat()
-        }, user_id)
-        
+        }, user_id, relay=False)
+    finally:
+        ws_connection_gate.release()
+    
+    session_user: Optional[User] = None
+    session_expires_at: Optional[float] = None  # the token's exp; HTTP would reject it after this
+    try:
         while True:
             # Keep connection alive and listen for messages
             data = await websocket.receive_text()
             message_data = json.loads(data)
             
-            if message_data.get("type") == "ping":
+            if message_data.get("type") in ws_commands:
+                if session_user is not None and session_expires_at is not None and time.time() >= session_expires_at:
+                    session_user = None
+                    reply = ws_commands.error(message_data.get("id"), 401, "Token expired; send a new auth message")
+                elif session_user is None:
+                    reply = ws_commands.error(message_data.get("id"), 401, "Send an auth message first")
+                else:
+                    reply = await ws_commands.handle(session_user, message_data)
+                await websocket.send_text(reply)
+            elif message_data.get("type") == "auth":
+                # Authenticate once per socket; commands then skip the per-request JWT decode and user lookup
+                token = str(message_data.get("token", ""))
+                try:
+                    session_user = await user_from_token(token)
+                except HTTPException:
+                    session_user = None
+                if session_user is not None and session_user.id != user_id:
+                    session_user = None
+                if session_user is not None:
+                    from jose import jwt
+                    # Already verified by user_from_token
+                    session_expires_at = jwt.get_unverified_claims(token).get("exp")
+                await websocket.send_text(json.dumps({
+                    "type": "auth",
+                    "ok": session_user is not None,
+                    "timestamp": datetime.utcnow().isoformat()
+                }))
+            elif message_data.get("type") == "ping":
                 await manager.broadcast_to_user({
                     "type": "pong",
                     "timestamp": datetime.utcnow().isoformat()
-                }, user_id)
+                }, user_id, relay=False)
+            elif message_data.get("type") == "watch_odds":
+                markets = odds_feed.watch(user_id, message_data.get("matches") or [])
+                await websocket.send_text(json.dumps({
+                    "type": "odds_snapshot",
+                    "markets": markets,
+                    "timestamp": datetime.utcnow().isoformat()
+                }))
                 
     except WebSocketDisconnect:
         manager.disconnect(websocket, user_id)
+        if user_id not in manager.active_connections:
+            odds_feed.unwatch(user_id)
 
 # Legacy status check (keeping for compatibility)
 @api_router.get("/")
@@ -415,6 +999,17 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Serve the built frontend (mounted last, and never for /api or /ws, so the API's routes and errors win)
+frontend_build_dir = resolve_build_dir(ROOT_DIR)
+if frontend_build_dir is not None and os.environ.get('SERVE_FRONTEND', 'true').lower() == 'true':
+    app.router.routes.append(FrontendMount("/", app=StaticAssets(frontend_build_dir), name="frontend"))
+
+# Replay stored responses for retried saves (inside CORS, so replays get CORS headers too)
+app.add_middleware(IdempotencyMiddleware, store=idempotency_store, paths=idempotent_paths())
+
+# Tag request tasks with their route so loop stalls can be attributed
+app.add_middleware(RouteTracker, registry=loop_monitor.active_routes)
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -422,39 +1017,102 @@ app.add_middleware(
     allow_origins=["*"],  # In production, specify your frontend domain
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[CAUSAL_TOKEN_HEADER, REPLAYED_HEADER, REQUEST_ID_HEADER],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+# Root span per sampled request (inside the access log, so spans can carry the request id)
+app.add_middleware(TracingMiddleware, tracer=tracer)
 
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Starting Sports Betting Calculator API...")
-    
+# Request ids and sampled access lines (outermost, so every layer logs under the request's id)
+app.add_middleware(AccessLogMiddleware, sampler=log_sampler, **access_log_options())
+
+async def bootstrap_admin():
     # Create admin user if it doesn't exist
     admin_username = os.environ.get('ADMIN_USERNAME', 'admin')
     admin_password = os.environ.get('ADMIN_PASSWORD', 'password123')
     admin_email = os.environ.get('ADMIN_EMAIL', 'admin@bettingcalc.com')
     
-    existing_admin = await db.users.find_one({"username": admin_username})
-    if not existing_admin:
-        admin_user = User(
-            username=admin_username,
-            email=admin_email,
-            full_name="Administrator",
-            is_active=True
-        )
-        admin_dict = admin_user.dict()
-        admin_dict["hashed_password"] = get_password_hash(admin_password)
-        
-        await db.users.insert_one(admin_dict)
-        logger.info(f"Created admin user: {admin_username}")
+    try:
+        await repositories.users.ensure_indexes()
+    except Exception:
+        logger.exception("Could not create user indexes")
+    if os.environ.get('WORKER_INDEX', '0') != '0':
+        # Leave the bcrypt hash to the first worker rather than paying it in every process
+        return
+    try:
+        existing_admin = await repositories.users.find_by_username(admin_username)
+        if not existing_admin:
+            admin_user = User(
+                username=admin_username,
+                email=admin_email,
+                full_name="Administrator",
+                is_active=True
+            )
+            admin_dict = admin_user.dict()
+            admin_dict["hashed_password"] = await run_in_threadpool(get_password_hash, admin_password)
+            
+            await repositories.users.insert(admin_dict)
+            logger.info(f"Created admin user: {admin_username}")
+    except DuplicateUser:
+        pass
+    except Exception:
+        logger.exception("Admin bootstrap failed")
+
+async def ensure_idempotency_indexes():
+    try:
+        await idempotency_store.ensure_indexes()
+    except Exception:
+        logger.exception("Could not create idempotency indexes")
+
+async def ensure_archive_indexes():
+    # Exports read the archive even when ARCHIVE_INTERVAL_SECONDS leaves archiving itself off
+    try:
+        await archiver.ensure_indexes()
+    except Exception:
+        logger.exception("Could not prepare the archive store")
+
+async def ensure_search_indexes():
+    try:
+        await match_search.ensure_indexes()
+    except Exception:
+        logger.exception("Could not create search indexes")
+
+@app.on_event("startup")
+async def startup_event():
+    logger.info("Starting Sports Betting Calculator API...")
+    loop_monitor.start()
+    write_behind.start()
+    odds_feed.start()
+    tracer.start()
+    manager.relay.start(asyncio.get_running_loop(), manager.deliver_relayed)
+    if repositories.persistent:
+        # Mongo-only background work; with STORAGE_BACKEND=memory there is no database to maintain
+        analytics_rollups.start()
+        archiver.start()
+        schema_registry.start()
+        job_runner.start()
+        app.state.idempotency_indexes = asyncio.ensure_future(ensure_idempotency_indexes())
+        app.state.search_indexes = asyncio.ensure_future(ensure_search_indexes())
+        app.state.archive_indexes = asyncio.ensure_future(ensure_archive_indexes())
+    drain_controller.install_signal_handler()
+    
+    # Don't hold up the first request on a DB round-trip plus a bcrypt hash
+    app.state.admin_bootstrap = asyncio.ensure_future(bootstrap_admin())
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Normally already drained by SIGTERM; otherwise release sockets before the client goes away
+    await drain_controller.drain("shutdown")
+    manager.relay.stop()
+    # Persist buffered autosaves before the client goes away
+    await write_behind.close()
+    await job_runner.close()
+    await archiver.stop()
+    await odds_feed.stop()
+    await analytics_rollups.stop()
+    await loop_monitor.stop()
+    await schema_registry.stop()
     client.close()
     logger.info("Database connection closed.")
+    await tracer.stop()
+    logging_setup.stop()
@@ -0,0 +1,226 @@
+"""Monte Carlo bankroll simulation over a user's logged bets.
+
+Every logged calculator record becomes a two-way bet: the back selection
+wins with probability ``p`` and pays ``win``, or loses and pays ``lose``. The
+lay side, when present, hedges both outcomes. ``p`` is the exchange-implied
+probability ``1 / lay_odds``, or ``1 / back_odds`` for back-only records, so
+a history of fairly priced bets has zero edge. Whatever expected value the
+simulation shows comes from the prices the user actually took.
+
+A simulated path starts from the user's active broker balances. At each step
+it draws one bet from the history (with replacement) and resolves it. A path
+is ruined once its bankroll reaches ``ruin_level`` and stops betting there.
+Paths are computed column-wise in NumPy, a block of steps at a time.
+
+Paths are split into chunks that run in the job runner's process pool. Each
+chunk gets its own child of the request's ``SeedSequence``, so a given seed
+reproduces the same result whatever the pool size. Each chunk also gets a
+share of the request's CPU budget (``time.process_time``), checked after
+every block; a chunk that runs over gives up, and the request fails with
+422 instead of holding a pool process. Concurrent simulations per worker are
+capped as well.
+"""
+import asyncio
+import os
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np  # imported on first use; numpy is too heavy to load at worker boot
+
+# Floats per block (steps x paths) kept in memory at once by a chunk
+BLOCK_CELLS = 1_000_000
+
+
+class SimulationError(Exception):
+    def __init__(self, message: str, status_code: int = 422):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CPUBudgetExceeded(Exception):
+    pass
+
+
+def _two_way(stake, odds, commission, lay_stake, lay_odds) -> Optional[Tuple[float, float, float]]:
+    """(probability, pnl if the back wins, pnl if it loses) of one record."""
+    if stake <= 0 or odds <= 1:
+        return None
+    keep = 1 - commission / 100
+    win = stake * (odds - 1) * keep
+    lose = -stake
+    if lay_stake > 0 and lay_odds > 1:
+        win -= lay_stake * (lay_odds - 1)
+        lose += lay_stake * keep
+        return 1 / lay_odds, win, lose
+    return 1 / odds, win, lose
+
+
+def bet_table(single: Sequence[Dict[str, Any]], pro: Sequence[Dict[str, Any]]) -> "np.ndarray":
+    """``(n, 3)`` array of probability, win and lose pnl for every usable record."""
+    import numpy as np
+
+    rows = []
+    for record in single:
+        rows.append(_two_way(record.get("stake") or 0, record.get("odds") or 0, record.get("commission") or 0,
+                             record.get("lay_stake") or 0, record.get("lay_odds") or 0))
+    for record in pro:
+        rows.append(_two_way(record.get("back_stake") or 0, record.get("back_odds") or 0,
+                             record.get("commission") or 0, record.get("lay_stake") or 0,
+                             record.get("lay_odds") or 0))
+    return np.array([row for row in rows if row is not None], dtype=np.float64).reshape(-1, 3)
+
+
+def checkpoint_steps(horizon: int, points: int) -> "np.ndarray":
+    import numpy as np
+
+    return np.unique(np.linspace(0, horizon, min(points, horizon) + 1).round().astype(np.int64))
+
+
+def simulate_chunk(bets: "np.ndarray", bankroll: float, horizon: int, paths: int, seed: "np.random.SeedSequence",
+                   checkpoints: "np.ndarray", ruin_level: float, stake_scale: float,
+                   cpu_budget: float) -> Dict[str, Any]:
+    """Simulate ``paths`` bankrolls; runs in a pool process."""
+    import numpy as np
+
+    started = time.process_time()
+    rng = np.random.default_rng(seed)
+    probability, win, lose = bets[:, 0], bets[:, 1] * stake_scale, bets[:, 2] * stake_scale
+    current = np.full(paths, bankroll)
+    alive = current > ruin_level
+    ruined_at = np.full(paths, -1, dtype=np.int64)
+    recorded = np.empty((len(checkpoints), paths), dtype=np.float32)
+    recorded[0] = current
+    next_checkpoint = 1
+    block = max(1, BLOCK_CELLS // paths)
+    columns = np.arange(paths)
+
+    step = 0
+    while step < horizon:
+        size = min(block, horizon - step)
+        picks = rng.integers(len(bets), size=(size, paths))
+        pnl = np.where(rng.random((size, paths)) < probability[picks], win[picks], lose[picks])
+        pnl[:, ~alive] = 0.0
+        path = current + np.cumsum(pnl, axis=0)
+
+        below = (path <= ruin_level) & alive
+        hit = below.any(axis=0)
+        if hit.any():
+            first = below.argmax(axis=0)
+            frozen = (np.arange(size)[:, None] >= first) & hit
+            path = np.where(frozen, path[first, columns], path)
+            ruined_at[hit] = step + 1 + first[hit]
+            alive &= ~hit
+
+        while next_checkpoint < len(checkpoints) and checkpoints[next_checkpoint] <= step + size:
+            recorded[next_checkpoint] = path[checkpoints[next_checkpoint] - step - 1]
+            next_checkpoint += 1
+        current = path[-1]
+        step += size
+        if time.process_time() - started > cpu_budget:
+            raise CPUBudgetExceeded()
+
+    return {"bankroll": recorded, "ruined_at": ruined_at, "cpu_seconds": time.process_time() - started}
+
+
+class MonteCarloSimulator:
+    def __init__(self, pool_factory: Callable, chunk_paths: int = 5000, max_simulations: int = 50_000,
+                 max_horizon: int = 5000, cpu_seconds: float = 10.0, timeout_seconds: float = 30.0,
+                 concurrency: int = 2, max_history: int = 5000):
+        self.pool_factory = pool_factory
+        self.chunk_paths = chunk_paths
+        self.max_simulations = max_simulations
+        self.max_horizon = max_horizon
+        self.cpu_seconds = cpu_seconds
+        self.timeout_seconds = timeout_seconds
+        self.max_history = max_history
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.stats = {"completed": 0, "over_budget": 0, "rejected": 0}
+
+    @classmethod
+    def from_env(cls, pool_factory: Callable) -> "MonteCarloSimulator":
+        return cls(
+            pool_factory,
+            chunk_paths=int(os.environ.get('SIMULATION_CHUNK_PATHS', 5000)),
+            max_simulations=int(os.environ.get('SIMULATION_MAX_PATHS', 50_000)),
+            max_horizon=int(os.environ.get('SIMULATION_MAX_HORIZON', 5000)),
+            cpu_seconds=float(os.environ.get('SIMULATION_CPU_SECONDS', 10)),
+            timeout_seconds=float(os.environ.get('SIMULATION_TIMEOUT_SECONDS', 30)),
+            concurrency=int(os.environ.get('SIMULATION_CONCURRENCY', 2)),
+            max_history=int(os.environ.get('SIMULATION_MAX_HISTORY', 5000)),
+        )
+
+    async def run(self, bets: "np.ndarray", bankroll: float, simulations: int, horizon: int,
+                  seed: Optional[int] = None, ruin_level: float = 0.0, stake_scale: float = 1.0,
+                  percentiles: Sequence[float] = (5, 25, 50, 75, 95), points: int = 50) -> Dict[str, Any]:
+        import numpy as np
+
+        if not len(bets):
+            raise SimulationError("No logged bets with usable stakes and odds to simulate")
+        if simulations > self.max_simulations or horizon > self.max_horizon:
+            raise SimulationError(f"At most {self.max_simulations} simulations of {self.max_horizon} bets")
+        if ruin_level >= bankroll:
+            # Every path would start ruined, with no step at which it got there
+            raise SimulationError("ruin_level must be below the starting bankroll")
+        if self.semaphore.locked():
+            self.stats["rejected"] += 1
+            raise SimulationError("Too many simulations running, try again shortly", status_code=429)
+
+        if seed is None:
+            seed = int(np.random.SeedSequence().entropy % 2**53)  # exact in JSON/JavaScript, so it can be replayed
+        sequence = np.random.SeedSequence(seed)
+        checkpoints = checkpoint_steps(horizon, points)
+        sizes = [min(self.chunk_paths, simulations - start) for start in range(0, simulations, self.chunk_paths)]
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        async with self.semaphore:
+            futures = [
+                loop.run_in_executor(
+                    self.pool_factory(), simulate_chunk, bets, bankroll, horizon, size, child, checkpoints,
+                    ruin_level, stake_scale, self.cpu_seconds * size / simulations,
+                )
+                for size, child in zip(sizes, sequence.spawn(len(sizes)))
+            ]
+            try:
+                chunks = await asyncio.wait_for(asyncio.gather(*futures), self.timeout_seconds)
+            except CPUBudgetExceeded:
+                self.stats["over_budget"] += 1
+                raise SimulationError("Simulation exceeded its CPU budget; lower simulations or horizon")
+            except asyncio.TimeoutError:
+                self.stats["over_budget"] += 1
+                raise SimulationError("Simulation timed out waiting for the process pool", status_code=503)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        bankrolls = np.concatenate([chunk["bankroll"] for chunk in chunks], axis=1)
+        ruined_at = np.concatenate([chunk["ruined_at"] for chunk in chunks])
+        final = bankrolls[-1].astype(np.float64)
+        curves = np.percentile(bankrolls, percentiles, axis=1)
+        probability, win, lose = bets[:, 0], bets[:, 1] * stake_scale, bets[:, 2] * stake_scale
+        self.stats["completed"] += 1
+        return {
+            "seed": seed,
+            "simulations": simulations,
+            "horizon": horizon,
+            "history_bets": len(bets),
+            "start_bankroll": round(bankroll, 2),
+            "expected_profit_per_bet": round(float(np.mean(probability * win + (1 - probability) * lose)), 4),
+            "risk_of_ruin": round(float(np.mean(ruined_at >= 0)), 4),
+            "ruin_level": ruin_level,
+            "median_bets_to_ruin": int(np.median(ruined_at[ruined_at >= 0])) if (ruined_at >= 0).any() else None,
+            "curves": {
+                "steps": checkpoints.tolist(),
+                **{f"p{p:g}": np.round(curve, 2).tolist() for p, curve in zip(percentiles, curves)},
+            },
+            "final": {
+                "mean": round(float(final.mean()), 2),
+                "probability_of_loss": round(float(np.mean(final < bankroll)), 4),
+                **{f"p{p:g}": round(float(value), 2) for p, value in zip(percentiles, np.percentile(final, percentiles))},
+            },
+            "cpu_seconds": round(sum(chunk["cpu_seconds"] for chunk in chunks), 3),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.stats, free_slots=self.semaphore._value)
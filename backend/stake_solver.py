@@ -0,0 +1,271 @@
+"""Stake allocation across a user's broker accounts for N-outcome markets.
+
+For each market every (outcome, account, side) with a price is a candidate
+bet. Per unit of stake, a bet has a profit vector over the outcomes:
+
+* back at odds ``o`` with commission ``c``: ``(o - 1)(1 - c)`` if its outcome
+  wins, ``-1`` otherwise; it ties up ``1`` of the account's balance;
+* lay at odds ``L``: ``-(L - 1)`` if its outcome wins, ``1 - c`` otherwise;
+  it ties up its liability ``L - 1``.
+
+The aim is to maximise the guaranteed profit ``t``, the worst case over the
+outcomes, without any account committing more than its balance.
+
+The closed form backs each outcome at its best commission-adjusted price
+(``e_i = 1 + (o_i - 1)(1 - c)``). It splits a total ``T`` as ``T / (e_i * S)``
+with ``S = sum(1 / e_i)``, and grows ``T`` until the first account's balance
+binds. That is optimal when every outcome has exactly one priced account and
+there are no lays. Otherwise, once a balance binds it can pay to move
+capital to the next-best price or to a lay, so the full problem is solved as
+a linear program:
+
+    max t   s.t.   t - sum_k r_kj x_k <= 0      for every outcome j
+                   sum_{k on a} w_k x_k <= B_a  for every account a
+                   x, t >= 0
+
+A small dense simplex solves it (Bland's rule; the origin is feasible, and
+every stake sits under a balance row, so the program is bounded). Markets
+are solved in the order given, each against what the earlier markets left
+in every account, so together they never ask an account for more than its
+balance.
+"""
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+EPS = 1e-9
+
+
+@dataclass
+class Account:
+    id: str
+    name: str
+    bookmaker: str
+    balance: float
+    commission: float  # fraction
+
+
+@dataclass
+class Bet:
+    outcome: int
+    account: int
+    side: str  # "back" or "lay"
+    odds: float
+
+
+def commission_fraction(rate: float) -> float:
+    """``BrokerAccount.commission_rate`` as a fraction (values above 1 are percentages)."""
+    return rate / 100 if rate > 1 else rate
+
+
+def accounts_from_documents(documents: List[Dict[str, Any]]) -> List[Account]:
+    return [
+        Account(doc["id"], doc.get("account_name", ""), doc.get("account_type", "").lower(),
+                float(doc.get("balance") or 0), commission_fraction(float(doc.get("commission_rate") or 0)))
+        for doc in documents
+        if doc.get("is_active", True) and (doc.get("balance") or 0) > 0
+    ]
+
+
+def candidate_bets(outcomes: List[Dict[str, Any]], accounts: List[Account]) -> List[Bet]:
+    by_bookmaker: Dict[str, List[int]] = {}
+    for index, account in enumerate(accounts):
+        by_bookmaker.setdefault(account.bookmaker, []).append(index)
+    bets = []
+    for outcome_index, outcome in enumerate(outcomes):
+        for price in outcome.get("prices", []):
+            for account_index in by_bookmaker.get(str(price.get("bookmaker", "")).lower(), []):
+                for side in ("back", "lay"):
+                    odds = price.get(side)
+                    if odds is not None and odds > 1:
+                        bets.append(Bet(outcome_index, account_index, side, float(odds)))
+    return bets
+
+
+def outcomes_from_quotes(quotes: Dict[str, Dict[str, float]]) -> List[Dict[str, Any]]:
+    """Solver outcomes from an odds-feed ``Market.quotes`` (back prices only)."""
+    return [
+        {"name": outcome, "prices": [{"bookmaker": bookmaker, "back": odds} for bookmaker, odds in by_bookmaker.items()]}
+        for outcome, by_bookmaker in quotes.items()
+    ]
+
+
+def _returns(bet: Bet, outcomes: int, commission: float) -> np.ndarray:
+    if bet.side == "back":
+        row = np.full(outcomes, -1.0)
+        row[bet.outcome] = (bet.odds - 1) * (1 - commission)
+    else:
+        row = np.full(outcomes, 1 - commission)
+        row[bet.outcome] = -(bet.odds - 1)
+    return row
+
+
+def _capital(bet: Bet) -> float:
+    return 1.0 if bet.side == "back" else bet.odds - 1
+
+
+def simplex_max(c: np.ndarray, A: np.ndarray, b: np.ndarray, max_iter: int = 1000) -> np.ndarray:
+    """``max c.x`` subject to ``A x <= b``, ``x >= 0``, with ``b >= 0``."""
+    m, n = A.shape
+    tableau = np.zeros((m + 1, n + m + 1))
+    tableau[:m, :n] = A
+    tableau[:m, n:n + m] = np.eye(m)
+    tableau[:m, -1] = b
+    tableau[m, :n] = -c
+    basis = list(range(n, n + m))
+
+    for _ in range(max_iter):
+        entering = np.flatnonzero(tableau[m, :-1] < -EPS)
+        if entering.size == 0:
+            break
+        column = entering[0]  # Bland: lowest index, so degenerate pivots can't cycle
+        pivot_column = tableau[:m, column]
+        rows = np.flatnonzero(pivot_column > EPS)
+        if rows.size == 0:
+            raise ValueError("Unbounded stake program")
+        ratios = tableau[rows, -1] / pivot_column[rows]
+        best = ratios.min()
+        tied = rows[np.abs(ratios - best) <= EPS]
+        row = min(tied, key=lambda r: basis[r])
+        tableau[row] /= tableau[row, column]
+        for other in range(m + 1):
+            if other != row and abs(tableau[other, column]) > EPS:
+                tableau[other] -= tableau[other, column] * tableau[row]
+        basis[row] = column
+
+    x = np.zeros(n)
+    for row, variable in enumerate(basis):
+        if variable < n:
+            x[variable] = tableau[row, -1]
+    return x
+
+
+def solve_lp(bets: List[Bet], accounts: List[Account], outcomes: int,
+             max_stake: Optional[float] = None) -> np.ndarray:
+    """Stake per bet maximising the guaranteed profit."""
+    k = len(bets)
+    returns = np.array([_returns(bet, outcomes, accounts[bet.account].commission) for bet in bets])
+    capital = np.array([_capital(bet) for bet in bets])
+
+    # Variables: x_0..x_{k-1}, t
+    rows, bounds = [], []
+    for j in range(outcomes):
+        rows.append(np.append(-returns[:, j], 1.0))
+        bounds.append(0.0)
+    for a, account in enumerate(accounts):
+        row = np.zeros(k + 1)
+        for i, bet in enumerate(bets):
+            if bet.account == a:
+                row[i] = capital[i]
+        if row.any():
+            rows.append(row)
+            bounds.append(account.balance)
+    if max_stake is not None:
+        rows.append(np.append(capital, 0.0))
+        bounds.append(max_stake)
+
+    objective = np.zeros(k + 1)
+    objective[-1] = 1.0
+    solution = simplex_max(objective, np.array(rows), np.array(bounds))
+    return solution[:k]
+
+
+def closed_form(bets: List[Bet], accounts: List[Account], outcomes: int,
+                max_stake: Optional[float] = None) -> Tuple[Optional[np.ndarray], bool]:
+    """Back-only proportional stakes; also whether the LP could do better."""
+    best: Dict[int, Tuple[float, int]] = {}
+    priced_accounts: Dict[int, set] = {}
+    for index, bet in enumerate(bets):
+        priced_accounts.setdefault(bet.outcome, set()).add(bet.account)
+        if bet.side != "back":
+            continue
+        effective = 1 + (bet.odds - 1) * (1 - accounts[bet.account].commission)
+        if bet.outcome not in best or effective > best[bet.outcome][0]:
+            best[bet.outcome] = (effective, index)
+    needs_lp = any(bet.side == "lay" for bet in bets) or any(len(a) > 1 for a in priced_accounts.values())
+    if len(best) < outcomes:
+        return None, needs_lp
+
+    inverse_sum = sum(1 / effective for effective, _ in best.values())
+    if inverse_sum >= 1:
+        return None, needs_lp
+
+    shares = np.zeros(len(bets))
+    load: Dict[int, float] = {}
+    for effective, index in best.values():
+        shares[index] = (1 / effective) / inverse_sum
+        load[bets[index].account] = load.get(bets[index].account, 0.0) + shares[index]
+    total = min(accounts[a].balance / share for a, share in load.items())
+    if max_stake is not None:
+        total = min(total, max_stake)
+    return shares * total, needs_lp
+
+
+def _guaranteed(stakes: np.ndarray, bets: List[Bet], accounts: List[Account], outcomes: int) -> np.ndarray:
+    profit = np.zeros(outcomes)
+    for stake, bet in zip(stakes, bets):
+        if stake > 0:
+            profit += stake * _returns(bet, outcomes, accounts[bet.account].commission)
+    return profit
+
+
+def solve_market(market: Dict[str, Any], accounts: List[Account], max_stake: Optional[float] = None) -> Dict[str, Any]:
+    outcomes = market.get("outcomes", [])
+    result: Dict[str, Any] = {"market_id": market.get("market_id"), "name": market.get("name", "")}
+    bets = candidate_bets(outcomes, accounts)
+    if len(outcomes) < 2 or not bets:
+        return dict(result, method=None, guaranteed_profit=0.0, bets=[], reason="no priced outcomes for these accounts")
+
+    stakes, needs_lp = closed_form(bets, accounts, len(outcomes), max_stake)
+    method = "closed_form"
+    if needs_lp:
+        lp_stakes = solve_lp(bets, accounts, len(outcomes), max_stake)
+        lp_profit = _guaranteed(lp_stakes, bets, accounts, len(outcomes)).min()
+        if stakes is None or lp_profit > _guaranteed(stakes, bets, accounts, len(outcomes)).min() + 1e-6:
+            stakes, method = lp_stakes, "lp"
+    if stakes is None:
+        return dict(result, method=None, guaranteed_profit=0.0, bets=[], reason="no guaranteed profit at these prices")
+
+    # Round down to pennies so no account is asked for more than it holds
+    stakes = np.floor(stakes * 100 + 1e-6) / 100
+    profit = _guaranteed(stakes, bets, accounts, len(outcomes))
+    if profit.min() <= 0:
+        return dict(result, method=method, guaranteed_profit=0.0, bets=[], reason="no guaranteed profit at these prices")
+
+    placed = [
+        {
+            "outcome": outcomes[bet.outcome].get("name", str(bet.outcome)),
+            "account_id": accounts[bet.account].id,
+            "account_name": accounts[bet.account].name,
+            "side": bet.side,
+            "odds": bet.odds,
+            "stake": round(float(stake), 2),
+            "liability": round(float(stake * (bet.odds - 1)), 2) if bet.side == "lay" else round(float(stake), 2),
+        }
+        for stake, bet in zip(stakes, bets) if stake > 0
+    ]
+    return dict(
+        result,
+        method=method,
+        guaranteed_profit=round(float(profit.min()), 2),
+        profit_by_outcome={outcomes[j].get("name", str(j)): round(float(p), 2) for j, p in enumerate(profit)},
+        capital=round(sum(bet["liability"] for bet in placed), 2),
+        bets=placed,
+    )
+
+
+def solve_markets(markets: List[Dict[str, Any]], accounts: List[Account],
+                  max_stake: Optional[float] = None) -> List[Dict[str, Any]]:
+    remaining = list(accounts)
+    results = []
+    for market in markets:
+        result = solve_market(market, remaining, max_stake)
+        committed: Dict[str, float] = {}
+        for bet in result["bets"]:
+            committed[bet["account_id"]] = committed.get(bet["account_id"], 0.0) + bet["liability"]
+        # Same order as accounts, so bet indices stay valid; a spent account just stops binding stakes
+        remaining = [replace(account, balance=max(0.0, round(account.balance - committed.get(account.id, 0.0), 2)))
+                     for account in remaining]
+        results.append(result)
+    return results
@@ -0,0 +1,316 @@
+"""Serve the built frontend with precompressed, long-cached assets.
+
+At startup the build directory is walked once into an in-memory index of stat
+results, ETags and precompressed ``.br``/``.gz`` siblings; conditional and range
+requests are answered from that index without touching the filesystem.
+Content-hashed files (``main.e97ef36a.js``) are immutable and cached for a year,
+everything else is revalidated. ``/static-manifest.json`` lists every asset with
+its ETag so the service worker can invalidate exactly what changed.
+
+Run as a script to write the compressed siblings after a build:
+
+    python static_assets.py ../deployment_package
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response
+from starlette.routing import Match, Mount
+
+logger = logging.getLogger(__name__)
+
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+COMPRESSIBLE_SUFFIXES = {".js", ".css", ".html", ".json", ".svg", ".txt", ".map", ".ico"}
+# Preference order when the client accepts several encodings
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+MANIFEST_PATH = "/static-manifest.json"
+# Paths the app's own routes answer, including their 404s and 405s
+APP_PATHS = ("/api", "/ws")
+
+
+@dataclass
+class Variant:
+    path: Path
+    stat: os.stat_result
+    etag: str
+
+
+@dataclass
+class Asset:
+    url_path: str
+    media_type: str
+    immutable: bool
+    identity: Variant
+    encoded: Dict[str, Variant] = field(default_factory=dict)
+    last_modified: str = ""
+
+    @property
+    def cache_control(self) -> str:
+        return IMMUTABLE_CACHE if self.immutable else REVALIDATE_CACHE
+
+
+def _etag(stat: os.stat_result, suffix: str = "") -> str:
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}{suffix}"'
+
+
+def build_index(root: Path) -> Dict[str, Asset]:
+    index: Dict[str, Asset] = {}
+    for path in sorted(root.rglob("*")):
+        if not path.is_file() or path.suffix in (".br", ".gz"):
+            continue
+        relative = path.relative_to(root)
+        # The API lives next to the frontend in the cPanel layout; never serve it, or dotfiles/dot-dirs (.git, .env)
+        if relative.parts[0] in ("api", "node_modules") or any(part.startswith(".") for part in relative.parts):
+            continue
+        stat = path.stat()
+        asset = Asset(
+            url_path="/" + relative.as_posix(),
+            media_type=mimetypes.guess_type(path.name)[0] or "application/octet-stream",
+            immutable=bool(HASHED_NAME.search(path.name)),
+            identity=Variant(path, stat, _etag(stat)),
+            last_modified=formatdate(stat.st_mtime, usegmt=True),
+        )
+        for encoding, suffix in ENCODINGS:
+            sibling = path.with_name(path.name + suffix)
+            if sibling.is_file():
+                sibling_stat = sibling.stat()
+                asset.encoded[encoding] = Variant(sibling, sibling_stat, _etag(stat, "-" + encoding))
+        index[asset.url_path] = asset
+    return index
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    bare = etag[2:] if etag.startswith("W/") else etag
+    return any(
+        (candidate.strip()[2:] if candidate.strip().startswith("W/") else candidate.strip()) == bare
+        for candidate in header.split(",")
+    )
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """First byte range as inclusive (start, end); None if unparseable or unsatisfiable."""
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or not ranges:
+        return None
+    first = ranges.split(",")[0].strip()
+    start_text, _, end_text = first.partition("-")
+    try:
+        if not start_text:
+            length = int(end_text)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _is_app_path(path: str) -> bool:
+    return any(path == prefix or path.startswith(prefix + "/") for prefix in APP_PATHS)
+
+
+def _read_slice(path: Path, start: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+
+class StaticAssets:
+    """ASGI app serving a frontend build; unknown paths fall back to ``index.html``."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.index = build_index(self.root)
+        self.manifest = self._build_manifest()
+
+    def _build_manifest(self) -> dict:
+        files = {
+            url: {"etag": asset.identity.etag, "size": asset.identity.stat.st_size, "immutable": asset.immutable}
+            for url, asset in self.index.items()
+            if not url.endswith(".map")
+        }
+        precache: List[str] = ["/"]
+        asset_manifest = self.root / "asset-manifest.json"
+        if asset_manifest.is_file():
+            entrypoints = json.loads(asset_manifest.read_text()).get("entrypoints", [])
+            precache += ["/" + entry.lstrip("/") for entry in entrypoints]
+        else:
+            precache += [url for url, meta in files.items() if meta["immutable"]]
+        if "/manifest.json" in files:
+            precache.append("/manifest.json")
+        version = hashlib.sha1(
+            "".join(f"{url}{meta['etag']}" for url, meta in sorted(files.items())).encode()
+        ).hexdigest()[:12]
+        return {"version": version, "precache": precache, "files": files}
+
+    def _resolve(self, path: str) -> Optional[Asset]:
+        if _is_app_path(path):
+            return None
+        if path in ("", "/"):
+            path = "/index.html"
+        asset = self.index.get(path)
+        if asset is None and "." not in path.rsplit("/", 1)[-1]:
+            # Client-side route (e.g. /dashboard): hand back the SPA shell
+            asset = self.index.get("/index.html")
+        return asset
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        if scope["method"] not in ("GET", "HEAD"):
+            response = PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+            return await response(scope, receive, send)
+
+        path = scope["path"]
+        if path == MANIFEST_PATH:
+            response = Response(
+                json.dumps(self.manifest),
+                media_type="application/json",
+                headers={"Cache-Control": REVALIDATE_CACHE, "ETag": f'"{self.manifest["version"]}"'},
+            )
+            return await response(scope, receive, send)
+
+        asset = self._resolve(path)
+        if asset is None:
+            # Same body FastAPI gives for unknown routes, so API clients see no difference
+            return await JSONResponse({"detail": "Not Found"}, status_code=404)(scope, receive, send)
+        response = await self._respond(asset, Headers(scope=scope))
+        await response(scope, receive, send)
+
+    async def _respond(self, asset: Asset, request_headers: Headers) -> Response:
+        range_header = request_headers.get("range")
+        variant, encoding = asset.identity, None
+        # Ranges are only served from the identity body so offsets mean the same thing everywhere
+        if not range_header:
+            accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+            for name, _ in ENCODINGS:
+                if name in asset.encoded and name in accepted:
+                    variant, encoding = asset.encoded[name], name
+                    break
+
+        headers = {
+            "Cache-Control": asset.cache_control,
+            "ETag": variant.etag,
+            "Last-Modified": asset.last_modified,
+            "Accept-Ranges": "bytes",
+        }
+        if asset.encoded:
+            headers["Vary"] = "Accept-Encoding"
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            if _etag_matches(if_none_match, variant.etag):
+                return Response(status_code=304, headers=headers)
+        elif request_headers.get("if-modified-since"):
+            try:
+                since = parsedate_to_datetime(request_headers["if-modified-since"]).timestamp()
+                if int(variant.stat.st_mtime) <= since:
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+
+        size = variant.stat.st_size
+        if_range = request_headers.get("if-range")
+        if range_header and (if_range is None or if_range.strip() == variant.etag):
+            byte_range = _parse_range(range_header, size)
+            if byte_range is None:
+                headers["Content-Range"] = f"bytes */{size}"
+                return Response(status_code=416, headers=headers)
+            start, end = byte_range
+            body = await run_in_threadpool(_read_slice, variant.path, start, end - start + 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            return Response(body, status_code=206, headers=headers, media_type=asset.media_type)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return FileResponse(variant.path, headers=headers, media_type=asset.media_type, stat_result=variant.stat)
+
+
+class FrontendMount(Mount):
+    """``Mount`` for ``StaticAssets`` at ``/`` that leaves API paths and non-GET requests to the app's routes.
+
+    A plain mount at ``/`` matches every path fully, so it would win over an
+    API route that only partially matched (wrong method), and would answer
+    unknown ``/api`` paths itself.
+    """
+
+    def matches(self, scope):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            return Match.NONE, {}
+        if _is_app_path(scope["path"]):
+            return Match.NONE, {}
+        return super().matches(scope)
+
+
+def resolve_build_dir(backend_dir: Path) -> Optional[Path]:
+    """The frontend build to serve, or None when there's nothing to serve."""
+    configured = os.environ.get('FRONTEND_BUILD_DIR')
+    # Only an explicit build: a guessed directory could be the source checkout. Relative
+    # paths are taken from the backend dir (deploy.sh sets FRONTEND_BUILD_DIR=.. for cPanel)
+    candidate = backend_dir / configured if configured else backend_dir.parent / "frontend" / "build"
+    if not (candidate / "index.html").is_file():
+        return None
+    resolved, backend = candidate.resolve(), backend_dir.resolve()
+    if resolved == backend or (resolved in backend.parents and backend.relative_to(resolved).parts[0] != "api"):
+        # Would publish the API's source; public_html/api/ is fine since the index skips api/
+        logger.warning("Not serving %s: it contains the API source", candidate)
+        return None
+    return candidate
+
+
+def precompress(root: Path, min_size: int = 1024) -> int:
+    """Write ``.gz`` (and ``.br`` when the brotli package is installed) next to compressible files."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    written = 0
+    for path in Path(root).rglob("*"):
+        if not path.is_file() or path.suffix not in COMPRESSIBLE_SUFFIXES or path.stat().st_size < min_size:
+            continue
+        relative = path.relative_to(root)
+        if "api" in relative.parts[:1] or any(part.startswith(".") for part in relative.parts):
+            continue
+        data = path.read_bytes()
+        path.with_name(path.name + ".gz").write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+        written += 1
+        if brotli is not None:
+            path.with_name(path.name + ".br").write_bytes(brotli.compress(data, quality=11))
+            written += 1
+    return written
+
+
+if __name__ == "__main__":
+    target = Path(sys.argv[1] if len(sys.argv) > 1 else "../frontend/build")
+    print(f"Wrote {precompress(target)} precompressed files under {target}")
@@ -0,0 +1,530 @@
+"""Versioned compact storage for calculator and broker documents.
+
+Schema version 1 stores documents the way the Pydantic models dump them: a
+UUID string ``id`` next to Mongo's own ObjectId ``_id``, full field names in
+every document, and money as doubles. Version 2 stores the same records more
+compactly:
+
+* ``id`` becomes ``_id``, as a 16-byte binary UUID (subtype 4). That drops
+  one field from every document, and lets the ``_id`` index serve lookups
+  by id;
+* field names are stored short (``match_name`` -> ``m``; see ``SCHEMAS``);
+* money fields are Decimal128, holding the shortest decimal that reads back
+  as the same double (``12.1``, not ``12.0999999999999996447...``).
+
+``user_id`` stays a string, because rollups, reports, jobs and the users
+collection join on it as a string.
+
+The app never sees version 2 shapes. ``SchemaDatabase`` wraps the Motor
+database. Collections with a schema come back as ``SchemaCollection``
+proxies, which translate filters, projections, sorts, updates, index keys
+and aggregation pipelines into the stored names. Results are decoded back
+into version 1 documents. Read-only aggregations get a decoding
+``$project`` right after their leading ``$match`` stages, so the rest of the
+pipeline still sees version 1 names.
+
+Migration is online, expand/contract, into a second collection
+(``<name>_v2``). It is driven by ``migrate_storage.py``, with the state
+kept in ``schema_versions``. Workers re-read that state every
+``STORAGE_SCHEMA_REFRESH_SECONDS``:
+
+``legacy``     reads and writes the version 1 collection;
+``migrating``  reads version 1 and writes both (the tool backfills);
+``cutover``    reads version 2 and still writes both, so workers that
+               haven't switched yet still see every write;
+``compact``    reads and writes version 2 only.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from bson import Binary, Decimal128
+from bson.binary import UUID_SUBTYPE
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_COLLECTION = "schema_versions"
+STATES = ("legacy", "migrating", "cutover", "compact")
+READS_COMPACT = ("cutover", "compact")
+WRITES_BOTH = ("migrating", "cutover")
+
+_COMMON = {"id": "_id", "user_id": "u", "match_name": "m", "commission": "c",
+           "created_at": "ca", "updated_at": "ua"}
+
+
+@dataclass(frozen=True)
+class CompactSchema:
+    fields: Dict[str, str]  # stored (v1) name -> compact name
+    money: FrozenSet[str] = frozenset()
+    version: int = 2
+    long: Dict[str, str] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "long", {short: name for name, short in self.fields.items()})
+
+    # Values
+
+    @staticmethod
+    def encode_id(value: Any) -> Any:
+        """Binary UUID for canonical UUID strings; any other id is stored as is."""
+        if isinstance(value, str):
+            try:
+                parsed = uuid.UUID(value)
+            except ValueError:
+                return value
+            if str(parsed) == value:
+                return Binary.from_uuid(parsed)
+        return value
+
+    def encode_value(self, name: str, value: Any) -> Any:
+        if name == "id":
+            return self.encode_id(value)
+        if name in self.money and isinstance(value, (int, float)) and not isinstance(value, bool):
+            # repr() is the shortest string that round-trips the double, so decoding gives it back exactly
+            return Decimal128(Decimal(repr(float(value))))
+        return value
+
+    def path(self, name: str) -> str:
+        head, dot, rest = name.partition(".")
+        return self.fields.get(head, head) + dot + rest
+
+    # Documents
+
+    def encode(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            self.fields.get(name, name): self.encode_value(name, value)
+            for name, value in document.items() if name != "_id"  # a v1 ObjectId, if pymongo added one
+        }
+
+    def decode(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        return {self.long.get(name, name): decode_value(value) for name, value in document.items()}
+
+    # Queries
+
+    def _condition(self, name: str, condition: Any) -> Any:
+        if name != "id":
+            return condition
+        if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+            return {
+                op: [self.encode_id(v) for v in value] if op in ("$in", "$nin") else
+                self.encode_id(value) if op in ("$eq", "$ne") else value
+                for op, value in condition.items()
+            }
+        return self.encode_id(condition)
+
+    def filter(self, query: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        translated = {}
+        for key, value in (query or {}).items():
+            if key in ("$and", "$or", "$nor"):
+                translated[key] = [self.filter(clause) for clause in value]
+            elif key == "$expr":
+                translated[key] = self.expression(value)
+            elif key.startswith("$"):
+                translated[key] = value  # $text, $comment
+            else:
+                translated[self.path(key)] = self._condition(key.partition(".")[0], value)
+        return translated
+
+    def expression(self, value: Any) -> Any:
+        """Rename ``$field`` paths in an aggregation expression (``$$variables`` are left alone)."""
+        if isinstance(value, str) and value.startswith("$") and not value.startswith("$$"):
+            return "$" + self.path(value[1:])
+        if isinstance(value, list):
+            return [self.expression(item) for item in value]
+        if isinstance(value, dict):
+            return {key: item if key == "$literal" else self.expression(item) for key, item in value.items()}
+        return value
+
+    def projection(self, projection: Any) -> Optional[Dict[str, Any]]:
+        if projection is None:
+            return None
+        if not isinstance(projection, dict):
+            projection = {name: 1 for name in projection}
+        fields = {name: value for name, value in projection.items() if name != "_id"}
+        if not fields:
+            return None  # v1 {"_id": 0}: every stored field, and _id is the id
+        translated = {self.path(name): value for name, value in fields.items()}
+        excluding = all(value in (0, False) for value in fields.values())
+        if not excluding and "id" not in fields:
+            translated["_id"] = 0
+        return translated
+
+    def sort(self, key_or_list: Any, direction: Any = None) -> List[Tuple[str, Any]]:
+        if isinstance(key_or_list, str):
+            return [(self.path(key_or_list), 1 if direction is None else direction)]
+        return [(self.path(name), value) for name, value in key_or_list]
+
+    def update(self, update: Dict[str, Any]) -> Dict[str, Any]:
+        if not any(key.startswith("$") for key in update):
+            return self.encode(update)  # a replacement document
+        translated = {}
+        for op, fields in update.items():
+            if op in ("$set", "$setOnInsert"):
+                # id is _id now: immutable, and already fixed by the filter
+                translated[op] = {self.path(name): self.encode_value(name, value)
+                                  for name, value in fields.items() if name not in ("id", "_id")}
+            else:
+                translated[op] = {self.path(name): value for name, value in fields.items()}
+        return translated
+
+    def operation(self, operation):
+        """Translate one ``bulk_write`` request."""
+        if isinstance(operation, InsertOne):
+            return InsertOne(self.encode(operation._doc))
+        if isinstance(operation, (UpdateOne, UpdateMany)):
+            return type(operation)(self.filter(operation._filter), self.update(operation._doc),
+                                   upsert=operation._upsert)
+        if isinstance(operation, ReplaceOne):
+            return ReplaceOne(self.filter(operation._filter), self.encode(operation._doc), upsert=operation._upsert)
+        if isinstance(operation, (DeleteOne, DeleteMany)):
+            return type(operation)(self.filter(operation._filter))
+        raise TypeError(f"Unsupported bulk operation {type(operation).__name__}")
+
+    def index_keys(self, keys: Any) -> Any:
+        if isinstance(keys, str):
+            return self.path(keys)
+        return [(self.path(name), kind) for name, kind in keys]
+
+    # Aggregation
+
+    def decode_stage(self) -> Dict[str, Any]:
+        """Rebuild v1 field names (and doubles for money) inside a pipeline."""
+        stage: Dict[str, Any] = {"_id": 0}
+        for name, short in self.fields.items():
+            stage[name] = {"$toDouble": "$" + short} if name in self.money else "$" + short
+        return {"$project": stage}
+
+    def pipeline(self, stages: List[Dict[str, Any]], resolve: Callable[[str], Optional[Tuple["CompactSchema", str]]]):
+        """Leading ``$match`` stages on stored names (so they use indexes), then decode, then the rest."""
+        index = 0
+        translated = []
+        while index < len(stages) and set(stages[index]) == {"$match"}:
+            translated.append({"$match": self.filter(stages[index]["$match"])})
+            index += 1
+        translated.append(self.decode_stage())
+        translated.extend(references(stage, resolve) for stage in stages[index:])
+        return translated
+
+
+def decode_value(value: Any) -> Any:
+    if isinstance(value, Binary) and value.subtype == UUID_SUBTYPE:
+        return str(value.as_uuid())
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, dict):
+        return {key: decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value
+
+
+def references(stage: Dict[str, Any], resolve) -> Dict[str, Any]:
+    """Point ``$lookup``/``$unionWith``/``$facet`` sub-pipelines at compact collections."""
+    name, spec = next(iter(stage.items()))
+    if name == "$facet":
+        return {name: {key: [references(s, resolve) for s in sub] for key, sub in spec.items()}}
+    if name == "$lookup" and resolve(spec.get("from", "")):
+        schema, physical = resolve(spec["from"])
+        spec = dict(spec, **{"from": physical, "pipeline": schema.pipeline(spec.get("pipeline", []), resolve)})
+        if "foreignField" in spec:
+            spec["foreignField"] = schema.path(spec["foreignField"])
+        return {name: spec}
+    if name == "$unionWith":
+        spec = {"coll": spec} if isinstance(spec, str) else spec
+        if resolve(spec["coll"]):
+            schema, physical = resolve(spec["coll"])
+            return {name: {"coll": physical, "pipeline": schema.pipeline(spec.get("pipeline", []), resolve)}}
+        return {name: spec}
+    if name == "$lookup" and spec.get("pipeline"):
+        return {name: dict(spec, pipeline=[references(s, resolve) for s in spec["pipeline"]])}
+    return stage
+
+
+SCHEMAS: Dict[str, CompactSchema] = {
+    "single_calculator": CompactSchema(
+        {**_COMMON, "stake": "s", "odds": "o", "potential_profit": "pp", "lay_odds": "lo", "lay_stake": "ls"},
+        money=frozenset({"stake", "potential_profit", "lay_stake"}),
+    ),
+    "pro_calculator": CompactSchema(
+        {**_COMMON, "back_stake": "bs", "back_odds": "bo", "lay_stake": "ls", "lay_odds": "lo", "profit_loss": "pl"},
+        money=frozenset({"back_stake", "lay_stake", "profit_loss"}),
+    ),
+    "broker_accounts": CompactSchema(
+        {"id": "_id", "user_id": "u", "account_name": "n", "balance": "b", "commission_rate": "cr",
+         "account_type": "t", "is_active": "a", "created_at": "ca", "updated_at": "ua"},
+        money=frozenset({"balance"}),
+    ),
+}
+
+
+def compact_name(name: str) -> str:
+    return f"{name}_v2"
+
+
+class SchemaRegistry:
+    """Migration state per collection, as last read from ``schema_versions``."""
+
+    def __init__(self, db, refresh_seconds: float = 10):
+        self.db = db
+        self.refresh_seconds = refresh_seconds
+        self.states: Dict[str, str] = {}
+        self._loaded = False
+        self._loading: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"refreshes": 0, "refresh_errors": 0, "dual_write_errors": 0}
+
+    @classmethod
+    def from_env(cls, db) -> "SchemaRegistry":
+        return cls(db, refresh_seconds=float(os.environ.get('STORAGE_SCHEMA_REFRESH_SECONDS', 10)))
+
+    def state(self, name: str) -> str:
+        return self.states.get(name, "legacy")
+
+    async def refresh(self):
+        documents = await self.db[VERSIONS_COLLECTION].find({"_id": {"$in": list(SCHEMAS)}}).to_list(None)
+        self.states = {document["_id"]: document.get("state", "legacy") for document in documents}
+        self._loaded = True
+        self.stats["refreshes"] += 1
+
+    async def ready(self):
+        """Load the states once before the first schema-aware operation."""
+        if self._loaded:
+            return
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self.refresh())
+            self._loading.add_done_callback(lambda _: setattr(self, "_loading", None))
+        await asyncio.shield(self._loading)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.refresh()
+            except Exception:
+                self.stats["refresh_errors"] += 1
+                logger.exception("Could not refresh storage schema states; keeping the last known ones")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.stats, states={name: self.state(name) for name in SCHEMAS}, loaded=self._loaded)
+
+
+class SchemaDatabase:
+    """Motor database whose schema collections are ``SchemaCollection`` proxies."""
+
+    def __init__(self, db, registry: SchemaRegistry):
+        self.raw = db
+        self.registry = registry
+
+    def __getitem__(self, name: str):
+        if name in SCHEMAS:
+            return SchemaCollection(self.raw, name, self.registry)
+        return self.raw[name]
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in SCHEMAS:
+            return self[name]
+        return getattr(self.raw, name)
+
+    def with_options(self, **kwargs) -> "SchemaDatabase":
+        return SchemaDatabase(self.raw.with_options(**kwargs), self.registry)
+
+    def resolve(self, name: str) -> Optional[Tuple[CompactSchema, str]]:
+        """(schema, physical collection) for collections currently read in compact form."""
+        if name in SCHEMAS and self.registry.state(name) in READS_COMPACT:
+            return SCHEMAS[name], compact_name(name)
+        return None
+
+
+class SchemaCursor:
+    """Deferred ``find``/``aggregate`` cursor: picks the collection once the schema state is known."""
+
+    def __init__(self, collection: "SchemaCollection", method: str, args: tuple, kwargs: Dict[str, Any]):
+        self.collection = collection
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.modifiers: List[Tuple[str, tuple]] = []
+        self._cursor = None
+        self._decode: Optional[Callable] = None
+
+    def sort(self, *args):
+        self.modifiers.append(("sort", args))
+        return self
+
+    def limit(self, count: int):
+        self.modifiers.append(("limit", (count,)))
+        return self
+
+    def skip(self, count: int):
+        self.modifiers.append(("skip", (count,)))
+        return self
+
+    def batch_size(self, size: int):
+        self.modifiers.append(("batch_size", (size,)))
+        return self
+
+    async def _open(self):
+        if self._cursor is None:
+            self._cursor, self._decode = await self.collection._open_cursor(self)
+        return self._cursor
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        documents = await (await self._open()).to_list(length)
+        return [self._decode(document) for document in documents] if self._decode else documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        cursor = await self._open()
+        async for document in cursor:
+            yield self._decode(document) if self._decode else document
+
+
+class SchemaCollection:
+    def __init__(self, db, name: str, registry: SchemaRegistry):
+        self.db = db
+        self.name = name
+        self.schema = SCHEMAS[name]
+        self.registry = registry
+
+    @property
+    def legacy(self):
+        return self.db[self.name]
+
+    @property
+    def compact(self):
+        return self.db[compact_name(self.name)]
+
+    async def _state(self) -> str:
+        await self.registry.ready()
+        return self.registry.state(self.name)
+
+    def _resolve(self, name: str):
+        return SchemaDatabase(self.db, self.registry).resolve(name)
+
+    async def _mirror(self, operation: str, *args, **kwargs):
+        """The compact half of a dual write. The migration tool reconciles any that fail."""
+        try:
+            return await getattr(self.compact, operation)(*args, **kwargs)
+        except PyMongoError as exc:
+            self.registry.stats["dual_write_errors"] += 1
+            logger.warning("Dual write of %s to %s failed: %s", operation, compact_name(self.name), exc)
+
+    # Reads
+
+    def find(self, *args, **kwargs) -> SchemaCursor:
+        return SchemaCursor(self, "find", args, kwargs)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> SchemaCursor:
+        return SchemaCursor(self, "aggregate", (pipeline,), kwargs)
+
+    async def _open_cursor(self, cursor: SchemaCursor):
+        state = await self._state()
+        if cursor.method == "aggregate":
+            pipeline = cursor.args[0]
+            if state in READS_COMPACT:
+                return self.compact.aggregate(self.schema.pipeline(pipeline, self._resolve), **cursor.kwargs), decode_value
+            # The pipeline may still $lookup/$unionWith a collection that already reads compact
+            return self.legacy.aggregate([references(s, self._resolve) for s in pipeline], **cursor.kwargs), None
+        if state not in READS_COMPACT:
+            motor_cursor = self.legacy.find(*cursor.args, **cursor.kwargs)
+            for name, args in cursor.modifiers:
+                motor_cursor = getattr(motor_cursor, name)(*args)
+            return motor_cursor, None
+        filter_, projection = (list(cursor.args) + [None, None])[:2]
+        kwargs = dict(cursor.kwargs)
+        filter_ = kwargs.pop("filter", filter_)
+        projection = kwargs.pop("projection", projection)
+        if "sort" in kwargs:
+            kwargs["sort"] = self.schema.sort(kwargs["sort"])
+        motor_cursor = self.compact.find(self.schema.filter(filter_), self.schema.projection(projection), **kwargs)
+        for name, args in cursor.modifiers:
+            motor_cursor = getattr(motor_cursor, name)(*((self.schema.sort(*args),) if name == "sort" else args))
+        return motor_cursor, self.schema.decode
+
+    async def find_one(self, filter: Optional[Dict[str, Any]] = None, *args, **kwargs):
+        documents = await self.find(filter, *args, **kwargs).limit(1).to_list(1)
+        return documents[0] if documents else None
+
+    async def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        if await self._state() in READS_COMPACT:
+            return await self.compact.count_documents(self.schema.filter(filter), **kwargs)
+        return await self.legacy.count_documents(filter, **kwargs)
+
+    async def distinct(self, key: str, filter: Optional[Dict[str, Any]] = None, **kwargs) -> List[Any]:
+        if await self._state() in READS_COMPACT:
+            values = await self.compact.distinct(self.schema.path(key), self.schema.filter(filter), **kwargs)
+            return [decode_value(value) for value in values]
+        return await self.legacy.distinct(key, filter, **kwargs)
+
+    # Writes
+
+    async def _write(self, operation: str, legacy_args: tuple, compact_args: Callable[[], tuple], **kwargs):
+        state = await self._state()
+        if state == "compact":
+            return await getattr(self.compact, operation)(*compact_args(), **kwargs)
+        result = await getattr(self.legacy, operation)(*legacy_args, **kwargs)
+        if state in WRITES_BOTH:
+            await self._mirror(operation, *compact_args(), **kwargs)
+        return result
+
+    async def insert_one(self, document: Dict[str, Any], **kwargs):
+        return await self._write("insert_one", (document,), lambda: (self.schema.encode(document),), **kwargs)
+
+    async def insert_many(self, documents: Iterable[Dict[str, Any]], **kwargs):
+        documents = list(documents)
+        return await self._write("insert_many", (documents,),
+                                 lambda: ([self.schema.encode(d) for d in documents],), **kwargs)
+
+    async def update_one(self, filter: Dict[str, Any], update: Dict[str, Any], **kwargs):
+        return await self._write("update_one", (filter, update),
+                                 lambda: (self.schema.filter(filter), self.schema.update(update)), **kwargs)
+
+    async def update_many(self, filter: Dict[str, Any], update: Dict[str, Any], **kwargs):
+        return await self._write("update_many", (filter, update),
+                                 lambda: (self.schema.filter(filter), self.schema.update(update)), **kwargs)
+
+    async def replace_one(self, filter: Dict[str, Any], replacement: Dict[str, Any], **kwargs):
+        return await self._write("replace_one", (filter, replacement),
+                                 lambda: (self.schema.filter(filter), self.schema.encode(replacement)), **kwargs)
+
+    async def delete_one(self, filter: Dict[str, Any], **kwargs):
+        return await self._write("delete_one", (filter,), lambda: (self.schema.filter(filter),), **kwargs)
+
+    async def delete_many(self, filter: Dict[str, Any], **kwargs):
+        return await self._write("delete_many", (filter,), lambda: (self.schema.filter(filter),), **kwargs)
+
+    async def bulk_write(self, operations: List[Any], **kwargs):
+        return await self._write("bulk_write", (operations,),
+                                 lambda: ([self.schema.operation(op) for op in operations],), **kwargs)
+
+    async def create_index(self, keys: Any, **kwargs):
+        state = await self._state()
+        result = None
+        if state != "compact":
+            result = await self.legacy.create_index(keys, **kwargs)
+        if state != "legacy":
+            result = await self.compact.create_index(self.schema.index_keys(keys), **kwargs)
+        return result
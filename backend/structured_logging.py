@@ -0,0 +1,234 @@
+"""JSON logging that stays off the event loop.
+
+Loggers write to a ``QueueHandler``. On the loop thread it only stamps the
+record with the current request id, merges the message arguments and puts
+the record on a queue. A ``QueueListener`` thread does the rest: JSON
+encoding, traceback formatting and the blocking write to stderr.
+
+Records below ERROR pass a per-second cap (``LOG_MAX_PER_SECOND``). Anything
+over the cap is counted and dropped. The first record of the next second
+carries ``dropped_previous_second``. Errors are never capped.
+
+``AccessLogMiddleware`` gives every HTTP request and WebSocket connection a
+request id: the caller's ``X-Request-ID`` if it sent one, or a fresh one. The
+id is held in a context variable, so log lines from handlers, Motor
+callbacks and broadcasts awaited by the request all carry it. It is also
+echoed in the response header and in WebSocket messages that the request
+triggers. Access lines are sampled per path prefix
+(``ACCESS_LOG_SAMPLE_RATES``), but 5xx responses and slow requests are
+always logged. Broadcast lines use the same table, keyed
+``broadcast:<message type>``.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+REQUEST_ID_HEADER = "X-Request-ID"
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# LogRecord attributes that aren't user-supplied ``extra`` fields
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_request_id() -> Optional[str]:
+    return request_id_var.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = "".join(traceback.format_exception(*record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class RateCap(logging.Filter):
+    """Let at most ``per_second`` records below ERROR through each second."""
+
+    def __init__(self, per_second: int):
+        super().__init__()
+        self.per_second = per_second
+        self._second = 0
+        self._count = 0
+        self.dropped = 0
+        self._dropped_this_second = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.per_second <= 0 or record.levelno >= logging.ERROR:
+            return True
+        now = int(time.monotonic())
+        with self._lock:
+            if now != self._second:
+                if self._dropped_this_second:
+                    record.dropped_previous_second = self._dropped_this_second
+                self._second, self._count, self._dropped_this_second = now, 0, 0
+            self._count += 1
+            if self._count > self.per_second:
+                self.dropped += 1
+                self._dropped_this_second += 1
+                return False
+        return True
+
+
+class LoopSafeQueueHandler(logging.handlers.QueueHandler):
+    """Stamp the request id and merge args; leave formatting to the listener thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def parse_sample_rates(spec: str) -> List[Tuple[str, float]]:
+    """``"/api/health=0,/ws=0.1"`` -> prefix/rate pairs, longest prefix first."""
+    rates = []
+    for part in spec.split(","):
+        prefix, _, rate = part.strip().partition("=")
+        if prefix and rate:
+            rates.append((prefix, max(0.0, min(1.0, float(rate)))))
+    return sorted(rates, key=lambda item: -len(item[0]))
+
+
+class LogSampler:
+    def __init__(self, sample_rates: List[Tuple[str, float]], default_rate: float = 1.0):
+        self.sample_rates = sample_rates
+        self.default_rate = default_rate
+        self.sampled_out = 0
+
+    @classmethod
+    def from_env(cls) -> "LogSampler":
+        return cls(
+            parse_sample_rates(os.environ.get('ACCESS_LOG_SAMPLE_RATES', '')),
+            default_rate=float(os.environ.get('ACCESS_LOG_DEFAULT_RATE', 1.0)),
+        )
+
+    def rate_for(self, key: str) -> float:
+        for prefix, rate in self.sample_rates:
+            if key.startswith(prefix):
+                return rate
+        return self.default_rate
+
+    def sample(self, key: str) -> bool:
+        if random.random() < self.rate_for(key):
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class AccessLogMiddleware:
+    """Assign request ids and write sampled access lines."""
+
+    def __init__(self, app, sampler: LogSampler, slow_ms: float = 1000, enabled: bool = True):
+        self.app = app
+        self.sampler = sampler
+        self.slow_ms = slow_ms
+        self.enabled = enabled
+        self.logger = logging.getLogger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        supplied = dict(scope.get("headers") or ()).get(REQUEST_ID_HEADER.lower().encode())
+        request_id = supplied.decode("latin-1")[:64] if supplied else new_request_id()
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status = 500 if scope["type"] == "http" else 101
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (REQUEST_ID_HEADER.lower().encode(), request_id.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            slow = scope["type"] == "http" and elapsed_ms >= self.slow_ms
+            if self.enabled and (status >= 500 or slow or self.sampler.sample(scope["path"])):
+                self.logger.info(
+                    "%s %s %s", scope.get("method", "WS"), scope["path"], status,
+                    extra={"status": status, "duration_ms": round(elapsed_ms, 1),
+                           "client": (scope.get("client") or ("", 0))[0]},
+                )
+            request_id_var.reset(token)
+
+
+class LoggingSetup:
+    def __init__(self, level: str = "INFO", fmt: str = "json", max_per_second: int = 1000,
+                 stream=None):
+        self.queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        self.cap = RateCap(max_per_second)
+        self.handler = LoopSafeQueueHandler(self.queue)
+        self.handler.addFilter(self.cap)
+        output = logging.StreamHandler(stream or sys.stderr)
+        if fmt == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        self.listener = logging.handlers.QueueListener(self.queue, output, respect_handler_level=True)
+        self.level = level
+
+    @classmethod
+    def from_env(cls) -> "LoggingSetup":
+        return cls(
+            level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+            fmt=os.environ.get('LOG_FORMAT', 'json').lower(),
+            max_per_second=int(os.environ.get('LOG_MAX_PER_SECOND', 1000)),
+        )
+
+    def install(self):
+        """Route the root logger through the queue and start the writer thread."""
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        return self
+
+    def stop(self):
+        """Flush queued records and stop the writer thread."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"queued": self.queue.qsize(), "dropped": self.cap.dropped, "max_per_second": self.cap.per_second}
+
+
+def access_log_options() -> Dict[str, Any]:
+    return {
+        "slow_ms": float(os.environ.get('ACCESS_LOG_SLOW_MS', 1000)),
+        "enabled": os.environ.get('ACCESS_LOG_ENABLED', 'true').lower() == 'true',
+    }
@@ -0,0 +1,348 @@
+"""Request tracing with OpenTelemetry-shaped spans and W3C trace context.
+
+A trace starts at the HTTP or WebSocket-command boundary, where it either
+follows an incoming ``traceparent`` header's sampling decision or samples
+``TRACE_SAMPLE_RATE`` of requests itself (head sampling). Unsampled requests
+create no span objects: ``Tracer.span`` sees no current span and hands back
+a shared no-op context manager, so instrumented code pays one context
+variable lookup.
+
+Inside a sampled trace the current span lives in a context variable. Motor
+copies the context into its executor threads, so the command listener
+parents each Mongo command to the route span, or to an auth or broadcast
+span, that issued it. Broadcasts open one span per delivered socket.
+
+Finished spans queue up and are exported in batches from a thread every
+``TRACE_EXPORT_INTERVAL_SECONDS``. Exporters take a list of spans and
+are picked with ``TRACE_EXPORTER``:
+
+* ``memory``: keeps the most recent spans for ``GET /api/admin/traces``;
+* ``file:<path>``: appends OTLP/JSON ``resourceSpans`` lines, which the
+  OpenTelemetry Collector's ``otlpjsonfile`` receiver reads;
+* ``otlp:<url>``: POSTs the same OTLP/JSON to ``<url>/v1/traces``.
+
+An empty ``TRACE_EXPORTER`` disables tracing entirely.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from structured_logging import current_request_id
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+SERVER, INTERNAL, CLIENT, PRODUCER = 2, 1, 3, 4  # OTLP SpanKind values
+current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_NOOP = nullcontext()
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: int = INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace id, parent span id, sampled) from a W3C ``traceparent`` header."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+        return None
+    try:
+        return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+
+
+def otlp_payload(spans: List[Span], service_name: str) -> Dict[str, Any]:
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{"scope": {"name": "bettingcalc.tracing"}, "spans": [span.to_otlp() for span in spans]}],
+    }]}
+
+
+class InMemoryExporter:
+    def __init__(self, max_spans: int = 10000):
+        self.spans: deque = deque(maxlen=max_spans)
+
+    def export(self, spans: List[Span], service_name: str):
+        self.spans.extend(spans)
+
+    def traces(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Most recent traces, each as its spans ordered by start time."""
+        by_trace: Dict[str, List[Span]] = {}
+        for span in reversed(self.spans):
+            if span.trace_id not in by_trace and len(by_trace) >= limit:
+                continue
+            by_trace.setdefault(span.trace_id, []).append(span)
+        return [
+            {
+                "trace_id": trace_id,
+                "duration_ms": round((max(s.end_ns for s in spans) - min(s.start_ns for s in spans)) / 1e6, 3),
+                "spans": [
+                    {
+                        "span_id": s.span_id, "parent_id": s.parent_id, "name": s.name,
+                        "start_offset_ms": round((s.start_ns - min(x.start_ns for x in spans)) / 1e6, 3),
+                        "duration_ms": round((s.end_ns - s.start_ns) / 1e6, 3),
+                        "attributes": s.attributes, "error": s.error,
+                    }
+                    for s in sorted(spans, key=lambda s: s.start_ns)
+                ],
+            }
+            for trace_id, spans in by_trace.items()
+        ]
+
+
+class FileExporter:
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span], service_name: str):
+        with open(self.path, "a") as handle:
+            handle.write(json.dumps(otlp_payload(spans, service_name), separators=(",", ":")) + "\n")
+
+
+class OTLPHTTPExporter:
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+
+    def export(self, spans: List[Span], service_name: str):
+        body = json.dumps(otlp_payload(spans, service_name)).encode()
+        request = urllib.request.Request(self.url, body, {"Content-Type": "application/json"})
+        urllib.request.urlopen(request, timeout=self.timeout).close()
+
+
+EXPORTERS: Dict[str, Callable[[str], Any]] = {
+    "memory": lambda arg: InMemoryExporter(int(arg or 10000)),
+    "file": FileExporter,
+    "otlp": OTLPHTTPExporter,
+}
+
+
+def build_exporter(spec: str):
+    kind, _, arg = spec.partition(":")
+    if not kind:
+        return None
+    if kind not in EXPORTERS:
+        raise ValueError(f"Unknown TRACE_EXPORTER {spec!r}; expected one of {sorted(EXPORTERS)}")
+    return EXPORTERS[kind](arg)
+
+
+class Tracer:
+    def __init__(self, exporter=None, sample_rate: float = 0.05, service_name: str = "bettingcalc-api",
+                 export_interval: float = 2.0, max_queue: int = 50000):
+        self.exporter = exporter
+        self.enabled = exporter is not None
+        self.sample_rate = sample_rate
+        self.service_name = service_name
+        self.export_interval = export_interval
+        self._finished: deque = deque(maxlen=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self.stats = {"traces": 0, "spans": 0, "exported": 0, "export_errors": 0}
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        return cls(
+            build_exporter(os.environ.get('TRACE_EXPORTER', '')),
+            sample_rate=float(os.environ.get('TRACE_SAMPLE_RATE', 0.05)),
+            service_name=os.environ.get('TRACE_SERVICE_NAME', 'bettingcalc-api'),
+            export_interval=float(os.environ.get('TRACE_EXPORT_INTERVAL_SECONDS', 2)),
+        )
+
+    def _finish(self, span: Span):
+        span.end_ns = time.time_ns()
+        self._finished.append(span)
+        self.stats["spans"] += 1
+
+    @contextmanager
+    def _active(self, span: Span) -> Iterator[Span]:
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            current_span.reset(token)
+            self._finish(span)
+
+    def trace(self, name: str, traceparent: Optional[str] = None, kind: int = SERVER, **attributes):
+        """Root span for a request, or a no-op if this request isn't sampled."""
+        if not self.enabled:
+            return _NOOP
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id, sampled = None, None, random.random() < self.sample_rate
+        if not sampled:
+            return _NOOP
+        self.stats["traces"] += 1
+        return self._active(Span(trace_id or os.urandom(16).hex(), parent_id, name, kind, attributes))
+
+    def span(self, name: str, kind: int = INTERNAL, **attributes):
+        """Child of the current span; a no-op outside a sampled trace."""
+        parent = current_span.get()
+        if parent is None:
+            return _NOOP
+        return self._active(Span(parent.trace_id, parent.span_id, name, kind, attributes))
+
+    def start_child(self, name: str, kind: int = INTERNAL, **attributes) -> Optional[Span]:
+        """Unscoped child span, for callbacks that end it elsewhere (see ``end``)."""
+        parent = current_span.get()
+        if parent is None:
+            return None
+        return Span(parent.trace_id, parent.span_id, name, kind, attributes)
+
+    def end(self, span: Span, error: Optional[str] = None):
+        span.error = error
+        self._finish(span)
+
+    def flush(self):
+        batch = []
+        while self._finished:
+            batch.append(self._finished.popleft())
+        if batch:
+            try:
+                self.exporter.export(batch, self.service_name)
+                self.stats["exported"] += len(batch)
+            except Exception:
+                self.stats["export_errors"] += 1
+                logger.exception("Trace export failed; dropped %d spans", len(batch))
+
+    def _run(self):
+        while not self._stopped.wait(self.export_interval):
+            self.flush()
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+
+    async def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+        if self.enabled:
+            await asyncio.to_thread(self.flush)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.stats, enabled=self.enabled, sample_rate=self.sample_rate, queued=len(self._finished))
+
+
+class TracingCommandListener(monitoring.CommandListener):
+    """One CLIENT span per Mongo command, parented to the span that issued it."""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._open: Dict[Tuple[int, Any], Span] = {}
+
+    def started(self, event):
+        span = self.tracer.start_child(
+            f"mongodb.{event.command_name}", CLIENT,
+            **{"db.system": "mongodb", "db.name": event.database_name, "db.operation": event.command_name},
+        )
+        if span is None:
+            return
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            span.attributes["db.mongodb.collection"] = collection
+        span.attributes["server.address"] = "%s:%s" % event.connection_id
+        self._open[(event.request_id, event.connection_id)] = span
+
+    def succeeded(self, event):
+        span = self._open.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            self.tracer.end(span)
+
+    def failed(self, event):
+        span = self._open.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            self.tracer.end(span, error=str(event.failure.get("errmsg", "failed")))
+
+
+class TracingMiddleware:
+    """Root SERVER span per HTTP request, named by route template once routing has run."""
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or ())
+        traceparent = headers.get(TRACEPARENT_HEADER.encode())
+        with self.tracer.trace(
+            f"{scope['method']} {scope['path']}", traceparent.decode("latin-1") if traceparent else None,
+            **{"http.method": scope["method"], "http.target": scope["path"], "request_id": current_request_id()},
+        ) as span:
+            if span is None:
+                return await self.app(scope, receive, send)
+
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    span.attributes["http.status_code"] = message["status"]
+                    if message["status"] >= 500:
+                        span.error = f"HTTP {message['status']}"
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = scope.get("route")
+                if route is not None and getattr(route, "path", None):
+                    span.attributes["http.route"] = route.path
+                    span.name = f"{scope['method']} {route.path}"
@@ -0,0 +1,109 @@
+"""Broadcast fan-out between the worker processes of one launcher.
+
+Each worker's ``ConnectionManager`` only knows its own sockets, but a user's
+tabs may be spread over several workers, and the request that triggers a
+broadcast can land on any of them. When ``launcher.py`` runs more than one
+worker, it gives each worker a Unix datagram socket in a shared directory
+(``WORKER_RELAY_DIR/relay-<index>.sock``). A broadcast is sent to local
+sockets as before and, as one datagram, to every peer worker. A peer that
+has sockets for that user delivers it; the rest drop it after a dict lookup.
+
+Sends never block the event loop. A peer that is restarting, or whose
+receive buffer is full, misses the message and it is counted in ``dropped``,
+the same way a socket that closes mid-send misses it. Workers only relay what
+they originate, so a message crosses the relay at most once.
+
+Without ``WORKER_RELAY_DIR`` (a single uvicorn process) the relay is off.
+"""
+import logging
+import os
+import socket
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024
+MAX_DATAGRAM_BYTES = 200 * 1024
+
+
+def relay_path(directory: str, index: int) -> str:
+    return os.path.join(directory, f"relay-{index}.sock")
+
+
+class BroadcastRelay:
+    def __init__(self, directory: Optional[str], index: int = 0, workers: int = 1):
+        self.directory = directory
+        self.index = index
+        self.enabled = bool(directory) and workers > 1
+        self.peers: List[str] = [relay_path(directory, i) for i in range(workers) if i != index] if self.enabled else []
+        self._receiver: Optional[socket.socket] = None
+        self._sender: Optional[socket.socket] = None
+        self._loop = None
+        self.stats = {"sent": 0, "received": 0, "delivered": 0, "dropped": 0}
+
+    @classmethod
+    def from_env(cls) -> "BroadcastRelay":
+        return cls(
+            os.environ.get('WORKER_RELAY_DIR') or None,
+            index=int(os.environ.get('WORKER_INDEX', 0)),
+            workers=int(os.environ.get('WORKER_COUNT', 1)),
+        )
+
+    def start(self, loop, deliver: Callable[[str, str], None]):
+        """Listen for peers' broadcasts; ``deliver(user_id, message)`` runs on the loop."""
+        if not self.enabled or self._receiver is not None:
+            return
+        path = relay_path(self.directory, self.index)
+        try:
+            os.unlink(path)  # left by this slot's previous (recycled) worker
+        except FileNotFoundError:
+            pass
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_BYTES)
+        self._receiver.bind(path)
+        self._receiver.setblocking(False)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+        self._loop = loop
+
+        def on_readable():
+            while True:
+                try:
+                    datagram = self._receiver.recv(MAX_DATAGRAM_BYTES)
+                except (BlockingIOError, InterruptedError):
+                    return
+                self.stats["received"] += 1
+                user_id, _, message = datagram.partition(b"\0")
+                deliver(user_id.decode(), message.decode())
+
+        loop.add_reader(self._receiver.fileno(), on_readable)
+
+    def publish(self, user_id: str, message: str):
+        if self._sender is None:
+            return
+        datagram = user_id.encode() + b"\0" + message.encode()
+        if len(datagram) > MAX_DATAGRAM_BYTES:
+            self.stats["dropped"] += len(self.peers)
+            logger.warning("Broadcast of %d bytes is too large to relay to other workers", len(datagram))
+            return
+        for peer in self.peers:
+            try:
+                self._sender.sendto(datagram, peer)
+                self.stats["sent"] += 1
+            except OSError:
+                # Peer restarting (no socket yet) or its buffer is full
+                self.stats["dropped"] += 1
+
+    def stop(self):
+        if self._receiver is not None:
+            self._loop.remove_reader(self._receiver.fileno())
+            self._receiver.close()
+            self._sender.close()
+            self._receiver = self._sender = None
+            try:
+                os.unlink(relay_path(self.directory, self.index))
+            except FileNotFoundError:
+                pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.stats, enabled=self.enabled, worker=self.index, peers=len(self.peers))
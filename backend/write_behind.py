@@ -0,0 +1,152 @@
+"""Write-behind buffer for calculator autosave.
+
+Autosave sends a save per keystroke, but only the last state of a record
+matters. With ``WRITE_BEHIND_ENABLED=true`` saves are coalesced in memory by
+``(collection, user_id, id)``, acknowledged straight away, and persisted with
+one unordered ``bulk_write`` per collection when either
+
+* the oldest buffered save reaches ``WRITE_BEHIND_MAX_DELAY_MS`` (the bound on
+  how long an acknowledged save can stay unpersisted), or
+* ``WRITE_BEHIND_MAX_BATCH`` distinct records are waiting.
+
+``close()`` flushes everything on shutdown. Saves still buffered when the
+process dies without a clean shutdown are lost; that is the trade-off of the
+mode and why it is off by default.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+BufferKey = Tuple[str, str, str]
+
+
+class WriteBehindBuffer:
+    def __init__(self, db, enabled: bool, max_delay_ms: float = 1000, max_batch: int = 500):
+        self.db = db
+        self.enabled = enabled
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending: Dict[BufferKey, Dict[str, Any]] = {}
+        # The batch being written: out of _pending but not yet readable from Mongo
+        self._inflight: Dict[BufferKey, Dict[str, Any]] = {}
+        self._oldest = None
+        self._wake = asyncio.Event()
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+        self.stats = {"enqueued": 0, "coalesced": 0, "flushes": 0, "written": 0, "failures": 0,
+                      "last_flush_ms": None}
+
+    @classmethod
+    def from_env(cls, db) -> "WriteBehindBuffer":
+        return cls(
+            db,
+            enabled=os.environ.get('WRITE_BEHIND_ENABLED', 'false').lower() == 'true',
+            max_delay_ms=float(os.environ.get('WRITE_BEHIND_MAX_DELAY_MS', 1000)),
+            max_batch=int(os.environ.get('WRITE_BEHIND_MAX_BATCH', 500)),
+        )
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._wake = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.ensure_future(self._run())
+
+    def enqueue(self, collection_name: str, document: Dict[str, Any]):
+        key = (collection_name, document["user_id"], document["id"])
+        if key in self._pending:
+            self.stats["coalesced"] += 1
+        self._pending[key] = document
+        self.stats["enqueued"] += 1
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+            self._wake.set()
+        if len(self._pending) >= self.max_batch:
+            self._wake.set()
+
+    def pending_for(self, collection_name: str, user_id: str) -> List[Dict[str, Any]]:
+        """Buffered and in-flight documents for one user, so reads can see their own unflushed saves."""
+        documents = {}
+        for buffer in (self._inflight, self._pending):  # a newer buffered save wins
+            for key, doc in buffer.items():
+                if key[0] == collection_name and key[1] == user_id:
+                    documents[key] = doc
+        return list(documents.values())
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            if len(self._pending) < self.max_batch and self._oldest is not None:
+                remaining = self.max_delay - (time.monotonic() - self._oldest)
+                if remaining > 0:
+                    try:
+                        # Woken early only by the size trigger
+                        await asyncio.wait_for(self._wake.wait(), remaining)
+                        self._wake.clear()
+                    except asyncio.TimeoutError:
+                        pass
+            await self.flush()
+            if self._pending:
+                self._wake.set()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending, self._oldest = self._pending, {}, None
+            self._inflight = batch
+            started = time.perf_counter()
+
+            by_collection: Dict[str, List[BufferKey]] = defaultdict(list)
+            for key in batch:
+                by_collection[key[0]].append(key)
+
+            for collection_name, keys in by_collection.items():
+                operations = [
+                    UpdateOne({"id": key[2], "user_id": key[1]}, {"$set": batch[key]}, upsert=True)
+                    for key in keys
+                ]
+                try:
+                    await self.db[collection_name].bulk_write(operations, ordered=False)
+                    self.stats["written"] += len(operations)
+                except Exception:
+                    self.stats["failures"] += 1
+                    logger.exception("Write-behind flush to %s failed; re-queueing %d saves",
+                                     collection_name, len(keys))
+                    for key in keys:
+                        # A newer save for the same record supersedes the failed one
+                        self._pending.setdefault(key, batch[key])
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+                finally:
+                    # Written, or back in _pending: either way readable without the in-flight copy
+                    for key in keys:
+                        self._inflight.pop(key, None)
+
+            self.stats["flushes"] += 1
+            self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    async def close(self):
+        if self._task is not None:
+            # Never cancel mid-flush: that batch is already out of _pending
+            async with self._flush_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending:
+            logger.info("Flushing %d buffered saves before shutdown", len(self._pending))
+            await self.flush()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.stats, enabled=self.enabled, pending=len(self._pending), inflight=len(self._inflight),
+                    oldest_age_ms=round((time.monotonic() - self._oldest) * 1000, 1) if self._oldest else None)
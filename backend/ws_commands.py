@@ -0,0 +1,125 @@
+"""Request/response commands over the real-time WebSocket.
+
+A socket authenticates once with ``{"type": "auth", "token": "<jwt>"}``.
+After that it can send commands instead of HTTP requests:
+
+    {"type": "save", "id": "c1", "kind": "single", "data": {...}}
+    {"type": "list", "id": "c2", "kind": "pro", "view": "list"}
+    {"type": "delete", "id": "c3", "kind": "broker", "record_id": "..."}
+
+Every command gets exactly one ``reply`` frame carrying the same ``id``:
+
+    {"type": "reply", "id": "c1", "ok": true, "request_id": "...", "data": {...}, "causal_token": "..."}
+    {"type": "reply", "id": "c1", "ok": false, "status": 404, "error": "Account not found"}
+
+Handlers are the HTTP route functions, called with the socket's user. So
+validation, write-behind, broadcasts and causal tokens behave as they do
+over HTTP, minus header parsing and the per-request JWT decode and user
+lookup. Commands on one socket run in the order they arrive, so autosaves
+of the same record can't overtake each other. Each command gets its own
+request id, which its log lines and the broadcasts it triggers carry, and
+is a root span when tracing samples it.
+"""
+import json
+import logging
+import time
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+
+from structured_logging import new_request_id, request_id_var
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Any, Dict[str, Any], Response], Awaitable[Any]]
+
+
+class CommandError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CommandProtocol:
+    def __init__(self, token_header: Optional[str] = None, tracer=None):
+        self.token_header = token_header
+        self.tracer = tracer
+        self.handlers: Dict[str, Handler] = {}
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def command(self, name: str):
+        def register(handler: Handler) -> Handler:
+            self.handlers[name] = handler
+            self.stats[name] = {"count": 0, "errors": 0, "total_ms": 0.0}
+            return handler
+        return register
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.handlers
+
+    @staticmethod
+    def error(command_id: Any, status_code: int, message: Any) -> str:
+        return json.dumps({"type": "reply", "id": command_id, "ok": False, "status": status_code, "error": message})
+
+    async def handle(self, user, message: Dict[str, Any]) -> str:
+        """Run one command for ``user`` and return its reply frame."""
+        name, command_id = message.get("type"), message.get("id")
+        # Each command is its own request for log correlation, as if it had come over HTTP
+        request_id = new_request_id()
+        token = request_id_var.set(request_id)
+        trace = nullcontext()
+        if self.tracer is not None:
+            trace = self.tracer.trace(f"ws {name}", **{"ws.command": name, "request_id": request_id})
+        try:
+            with trace:
+                return await self._handle(user, name, command_id, message, request_id)
+        finally:
+            request_id_var.reset(token)
+
+    async def _handle(self, user, name: str, command_id: Any, message: Dict[str, Any], request_id: str) -> str:
+        stats = self.stats[name]
+        stats["count"] += 1
+        started = time.perf_counter()
+        response = Response()
+        try:
+            result = await self.handlers[name](user, message, response)
+        except HTTPException as exc:
+            stats["errors"] += 1
+            return self.error(command_id, exc.status_code, exc.detail)
+        except ValidationError as exc:
+            stats["errors"] += 1
+            return self.error(command_id, 422, jsonable_encoder(exc.errors(include_url=False)))
+        except CommandError as exc:
+            stats["errors"] += 1
+            return self.error(command_id, exc.status_code, str(exc))
+        except Exception:
+            stats["errors"] += 1
+            logger.exception("WebSocket command %s failed", name)
+            return self.error(command_id, 500, "Internal error")
+        finally:
+            stats["total_ms"] += (time.perf_counter() - started) * 1000
+
+        head = {"type": "reply", "id": command_id, "ok": True, "request_id": request_id}
+        token = response.headers.get(self.token_header) if self.token_header else None
+        if token:
+            head["causal_token"] = token
+        if isinstance(result, Response):
+            # List routes hand back pre-serialised JSON; splice it in rather than re-encode it
+            data = result.body.decode()
+        else:
+            data = json.dumps(jsonable_encoder(result))
+        return json.dumps(head)[:-1] + ', "data": ' + data + "}"
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "count": int(stats["count"]),
+                "errors": int(stats["errors"]),
+                "avg_ms": round(stats["total_ms"] / stats["count"], 2) if stats["count"] else None,
+            }
+            for name, stats in self.stats.items()
+        }
@@ -67,6 +67,26 @@ def test_health_check():
         print_test_result("Health Check", False, f"Exception: {str(e)}")
         return False
 
+def test_liveness_and_readiness():
+    """Test the liveness and readiness probe endpoints"""
+    try:
+        live = requests.get(f"{API_URL}/health/live", timeout=10)
+        ready = requests.get(f"{API_URL}/health/ready", timeout=10)
+        ready_data = ready.json()
+        success = (
+            live.status_code == 200
+            and ready.status_code == 200
+            and ready_data.get("ready") is True
+            and "loop_lag_ms" in ready_data
+            and "websockets" in ready_data
+        )
+        details = f"Live: {live.status_code}, Ready: {ready.status_code}, Reasons: {ready_data.get('reasons')}"
+        print_test_result("Liveness and Readiness", success, details)
+        return success
+    except Exception as e:
+        print_test_result("Liveness and Readiness", False, f"Exception: {str(e)}")
+        return False
+
 def test_admin_login():
     """Test admin login with correct credentials"""
     global admin_token
@@ -399,6 +419,258 @@ def test_user_data_isolation():
         print_test_result("User Data Isolation", False, f"Exception: {str(e)}")
         return False
 
+def test_read_your_writes():
+    """Test that a save is visible to the immediately following list read"""
+    if not admin_token:
+        print_test_result("Read Your Writes", False, "No admin token available")
+        return False
+    
+    try:
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        for attempt in range(5):
+            record = {"id": str(uuid.uuid4()), "user_id": "", "match_name": f"Causal Match {attempt}", "stake": 10.0}
+            save = requests.post(f"{API_URL}/single/data", json=record, headers=headers, timeout=10)
+            if save.status_code != 200:
+                print_test_result("Read Your Writes", False, f"Save status: {save.status_code}")
+                return False
+            read_headers = dict(headers)
+            if "X-Causal-Token" in save.headers:
+                read_headers["X-Causal-Token"] = save.headers["X-Causal-Token"]
+            listing = requests.get(f"{API_URL}/single/data?view=list", headers=read_headers, timeout=10)
+            if not any(item.get("id") == record["id"] for item in listing.json()):
+                print_test_result("Read Your Writes", False, f"Record missing on attempt {attempt + 1}")
+                return False
+        
+        print_test_result("Read Your Writes", True, "5/5 saves visible to the next read")
+        return True
+    except Exception as e:
+        print_test_result("Read Your Writes", False, f"Exception: {str(e)}")
+        return False
+
+def test_idempotent_save():
+    """Test that a retried save with the same Idempotency-Key is replayed, not re-applied"""
+    if not admin_token:
+        print_test_result("Idempotent Save", False, "No admin token available")
+        return False
+    
+    try:
+        headers = {"Authorization": f"Bearer {admin_token}", "Idempotency-Key": str(uuid.uuid4())}
+        record = {"id": str(uuid.uuid4()), "user_id": "", "match_name": "Retried Match", "stake": 25.0}
+        first = requests.post(f"{API_URL}/single/data", json=record, headers=headers, timeout=10)
+        retry = requests.post(f"{API_URL}/single/data", json=record, headers=headers, timeout=10)
+        if first.status_code != 200 or retry.status_code != 200:
+            print_test_result("Idempotent Save", False, f"Status: {first.status_code}/{retry.status_code}")
+            return False
+        
+        replayed = retry.headers.get("Idempotent-Replayed") == "true"
+        same_body = retry.json() == first.json()
+        reused = requests.post(f"{API_URL}/single/data", json=dict(record, stake=30.0), headers=headers, timeout=10)
+        success = replayed and same_body and reused.status_code == 422
+        print_test_result("Idempotent Save", success,
+                          f"Replayed: {replayed}, same body: {same_body}, reuse status: {reused.status_code}")
+        return success
+    except Exception as e:
+        print_test_result("Idempotent Save", False, f"Exception: {str(e)}")
+        return False
+
+def test_admin_reports():
+    """Test admin-only reports and that repeat loads are served from the cache"""
+    if not admin_token or not user_token:
+        print_test_result("Admin Reports", False, "Missing admin or user token")
+        return False
+    
+    try:
+        denied = requests.get(f"{API_URL}/admin/reports",
+                              headers={"Authorization": f"Bearer {user_token}"}, timeout=10)
+        if denied.status_code != 403:
+            print_test_result("Admin Reports", False, f"Non-admin status: {denied.status_code}")
+            return False
+        
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        first = requests.get(f"{API_URL}/admin/reports", headers=headers, timeout=30)
+        second = requests.get(f"{API_URL}/admin/reports/brokers", headers=headers, timeout=30)
+        if first.status_code != 200 or second.status_code != 200:
+            print_test_result("Admin Reports", False, f"Status: {first.status_code}/{second.status_code}")
+            return False
+        
+        reports = first.json()["reports"]
+        success = set(reports) == {"users", "activity", "brokers"} and second.json()["cached"]
+        print_test_result("Admin Reports", success, f"Users: {reports['users']['data']['totals']}")
+        return success
+    except Exception as e:
+        print_test_result("Admin Reports", False, f"Exception: {str(e)}")
+        return False
+
+def test_stake_solver():
+    """Test a 1X2 stake split across two broker accounts stays within their balances"""
+    if not admin_token:
+        print_test_result("Stake Solver", False, "No admin token available")
+        return False
+    
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    accounts = [
+        {"id": str(uuid.uuid4()), "user_id": "", "account_name": "Solver Exchange", "balance": 100.0,
+         "commission_rate": 2.0, "account_type": "solver-exchange", "is_active": True},
+        {"id": str(uuid.uuid4()), "user_id": "", "account_name": "Solver Book", "balance": 500.0,
+         "commission_rate": 0.0, "account_type": "solver-book", "is_active": True},
+    ]
+    market = {"market_id": "test-1x2", "outcomes": [
+        {"name": "Home", "prices": [{"bookmaker": "solver-exchange", "back": 3.2, "lay": 3.3},
+                                    {"bookmaker": "solver-book", "back": 3.0}]},
+        {"name": "Draw", "prices": [{"bookmaker": "solver-book", "back": 3.8}]},
+        {"name": "Away", "prices": [{"bookmaker": "solver-exchange", "back": 3.3},
+                                    {"bookmaker": "solver-book", "back": 3.1}]},
+    ]}
+    
+    try:
+        for account in accounts:
+            requests.post(f"{API_URL}/broker/accounts", json=account, headers=headers, timeout=10)
+        response = requests.post(f"{API_URL}/solver/stakes", headers=headers, timeout=30, json={
+            "markets": [market], "account_ids": [account["id"] for account in accounts],
+        })
+        for account in accounts:
+            requests.delete(f"{API_URL}/broker/accounts/{account['id']}", headers=headers, timeout=10)
+        if response.status_code != 200:
+            print_test_result("Stake Solver", False, f"Status: {response.status_code}")
+            return False
+        
+        result = response.json()["markets"][0]
+        used = {}
+        for bet in result["bets"]:
+            used[bet["account_id"]] = used.get(bet["account_id"], 0) + bet["liability"]
+        within = all(used.get(account["id"], 0) <= account["balance"] for account in accounts)
+        success = result["guaranteed_profit"] > 0 and within
+        print_test_result("Stake Solver", success,
+                          f"Method: {result['method']}, profit: {result['guaranteed_profit']}, used: {used}")
+        return success
+    except Exception as e:
+        print_test_result("Stake Solver", False, f"Exception: {str(e)}")
+        return False
+
+def test_simulation():
+    """Test that a seeded bankroll simulation is reproducible"""
+    if not admin_token:
+        print_test_result("Bankroll Simulation", False, "No admin token available")
+        return False
+    
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    request = {"simulations": 1000, "horizon": 100, "seed": 1234, "bankroll": 500.0}
+    try:
+        record = {"id": str(uuid.uuid4()), "user_id": "", "match_name": "Simulated Match", "stake": 10.0, "odds": 2.5}
+        requests.post(f"{API_URL}/single/data", json=record, headers=headers, timeout=10)
+        first = requests.post(f"{API_URL}/analytics/simulate", json=request, headers=headers, timeout=60)
+        second = requests.post(f"{API_URL}/analytics/simulate", json=request, headers=headers, timeout=60)
+        if first.status_code != 200 or second.status_code != 200:
+            print_test_result("Bankroll Simulation", False, f"Status: {first.status_code}/{second.status_code}")
+            return False
+        
+        result = first.json()
+        success = result["final"] == second.json()["final"] and len(result["curves"]["p50"]) == len(result["curves"]["steps"])
+        print_test_result("Bankroll Simulation", success,
+                          f"Risk of ruin: {result['risk_of_ruin']}, median final: {result['final']['p50']}")
+        return success
+    except Exception as e:
+        print_test_result("Bankroll Simulation", False, f"Exception: {str(e)}")
+        return False
+
+def test_match_search():
+    """Test that a saved match name is found by search and autocomplete"""
+    if not admin_token:
+        print_test_result("Match Search", False, "No admin token available")
+        return False
+    
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    team = "Searchable" + str(uuid.uuid4())[:6]
+    record = {"id": str(uuid.uuid4()), "user_id": "", "match_name": f"{team} vs Rovers", "stake": 10.0, "odds": 2.0}
+    try:
+        requests.post(f"{API_URL}/single/data", json=record, headers=headers, timeout=10)
+        suggest = requests.get(f"{API_URL}/search/suggest", params={"q": team[:-2].lower()}, headers=headers, timeout=10)
+        search = requests.get(f"{API_URL}/search", params={"q": team}, headers=headers, timeout=10)
+        if suggest.status_code != 200 or search.status_code != 200:
+            print_test_result("Match Search", False, f"Status: {suggest.status_code}/{search.status_code}")
+            return False
+        
+        suggested = record["match_name"] in suggest.json()["suggestions"]
+        found = any(result["id"] == record["id"] for result in search.json()["results"])
+        print_test_result("Match Search", suggested and found, f"Suggested: {suggested}, found: {found}")
+        return suggested and found
+    except Exception as e:
+        print_test_result("Match Search", False, f"Exception: {str(e)}")
+        return False
+
+def test_tracing():
+    """Test that a request sent with a sampled traceparent shows up in the recent traces"""
+    if not admin_token:
+        print_test_result("Request Tracing", False, "No admin token available")
+        return False
+    
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    trace_id = uuid.uuid4().hex
+    try:
+        requests.get(f"{API_URL}/single/data", headers=dict(headers, traceparent=f"00-{trace_id}-{'1' * 16}-01"), timeout=10)
+        response = requests.get(f"{API_URL}/admin/traces", params={"limit": 50}, headers=headers, timeout=10)
+        if response.status_code == 404:
+            print_test_result("Request Tracing", True, "Skipped: TRACE_EXPORTER is not memory")
+            return True
+        if response.status_code != 200:
+            print_test_result("Request Tracing", False, f"Status: {response.status_code}")
+            return False
+        
+        trace = next((t for t in response.json()["traces"] if t["trace_id"] == trace_id), None)
+        names = [span["name"] for span in trace["spans"]] if trace else []
+        success = "GET /api/single/data" in names and any(name.startswith("mongodb.") for name in names)
+        print_test_result("Request Tracing", success, f"Spans: {names}")
+        return success
+    except Exception as e:
+        print_test_result("Request Tracing", False, f"Exception: {str(e)}")
+        return False
+
+def test_storage_schema():
+    """Test that a saved record reads back unchanged and the schema state is reported"""
+    if not admin_token:
+        print_test_result("Storage Schema", False, "No admin token available")
+        return False
+    
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    record = {"id": str(uuid.uuid4()), "user_id": "will_be_set_by_backend", "match_name": "Storage Check FC",
+              "stake": 12.1, "odds": 2.37, "commission": 2.0, "potential_profit": 16.577}
+    try:
+        saved = requests.post(f"{API_URL}/single/data", json=record, headers=headers, timeout=10)
+        stored = requests.get(f"{API_URL}/single/data", params={"view": "detail"}, headers=headers, timeout=10)
+        status = requests.get(f"{API_URL}/admin/storage", headers=headers, timeout=10)
+        if saved.status_code != 200 or stored.status_code != 200 or status.status_code != 200:
+            print_test_result("Storage Schema", False,
+                              f"Status: {saved.status_code}/{stored.status_code}/{status.status_code}")
+            return False
+        
+        match = next((r for r in stored.json() if r["id"] == record["id"]), None)
+        states = status.json()["schema"]["states"]
+        success = (match is not None and match["stake"] == 12.1 and match["potential_profit"] == 16.577
+                   and set(states) == {"single_calculator", "pro_calculator", "broker_accounts"})
+        print_test_result("Storage Schema", success, f"States: {states}, stored: {match}")
+        return success
+    except Exception as e:
+        print_test_result("Storage Schema", False, f"Exception: {str(e)}")
+        return False
+
+def test_login_rate_limit():
+    """Test that repeated logins for one username are throttled with a Retry-After hint"""
+    try:
+        creds = {"username": "ratelimit_" + str(uuid.uuid4())[:8], "password": "wrong"}
+        response = None
+        for _ in range(10):
+            response = requests.post(f"{API_URL}/auth/login", json=creds, timeout=10)
+            if response.status_code == 429:
+                break
+        
+        success = response.status_code == 429 and "Retry-After" in response.headers
+        details = f"Status: {response.status_code}, Retry-After: {response.headers.get('Retry-After')}"
+        print_test_result("Login Rate Limiting", success, details)
+        return success
+    except Exception as e:
+        print_test_result("Login Rate Limiting", False, f"Exception: {str(e)}")
+        return False
+
 def run_all_tests():
     """Run all backend tests"""
     print("=" * 60)
@@ -410,6 +682,7 @@ def run_all_tests():
     
     # Basic connectivity and health
     test_results.append(("Health Check", test_health_check()))
+    test_results.append(("Liveness and Readiness", test_liveness_and_readiness()))
     
     # Authentication tests
     test_results.append(("Admin Login", test_admin_login()))
@@ -427,6 +700,17 @@ def run_all_tests():
     
     # Security tests
     test_results.append(("User Data Isolation", test_user_data_isolation()))
+    test_results.append(("Read Your Writes", test_read_your_writes()))
+    test_results.append(("Idempotent Save", test_idempotent_save()))
+    test_results.append(("Admin Reports", test_admin_reports()))
+    test_results.append(("Stake Solver", test_stake_solver()))
+    test_results.append(("Bankroll Simulation", test_simulation()))
+    test_results.append(("Match Search", test_match_search()))
+    test_results.append(("Request Tracing", test_tracing()))
+    test_results.append(("Storage Schema", test_storage_schema()))
+    
+    # Admission control (last, since it spends this client's auth budget)
+    test_results.append(("Login Rate Limiting", test_login_rate_limit()))
     
     # Summary
     print("=" * 60)
@@ -14,15 +14,21 @@ mkdir -p "$DEPLOY_DIR"
 echo "📁 Copying frontend build files..."
 cp -r frontend/build/* "$DEPLOY_DIR/"
 
+# Precompress text assets so the API can serve .br/.gz siblings directly
+echo "🗜️  Precompressing static assets..."
+python3 backend/static_assets.py "$DEPLOY_DIR"
+
 # Create backend directory
 echo "📁 Creating backend directory..."
 mkdir -p "$DEPLOY_DIR/api"
 
 # Copy backend files
 echo "📁 Copying backend files..."
-cp backend/server.py "$DEPLOY_DIR/api/"
+cp backend/*.py "$DEPLOY_DIR/api/"
 cp backend/requirements.txt "$DEPLOY_DIR/api/"
 cp backend/.env "$DEPLOY_DIR/api/"
+# The frontend sits one level up from the API in public_html
+echo "FRONTEND_BUILD_DIR=.." >> "$DEPLOY_DIR/api/.env"
 
 # Create deployment instructions
 echo "📄 Creating deployment instructions..."
@@ -44,6 +50,9 @@ cat > "$DEPLOY_DIR/DEPLOYMENT_INSTRUCTIONS.md" << 'EOF'
 4. Update .env with production MongoDB URL
 5. Test the application
 
+On a VPS or container, run `cd api && python launcher.py --port 8001` instead
+(multi-process; see README "Production Server").
+
 ## Demo Credentials:
 - Username: admin
 - Password: password123
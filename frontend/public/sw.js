@@ -1,31 +1,83 @@
-const CACHE_NAME = 'sports-betting-calculator-v1';
-const urlsToCache = [
-  '/',
-  '/static/css/main.css',
-  '/static/js/main.js',
-  '/manifest.json'
-];
+// Precise cache invalidation driven by /static-manifest.json (served by the API).
+// Content-hashed assets never change, so they're cache-first; everything else
+// is network-first with the cache as an offline fallback.
+const CACHE_PREFIX = 'sports-betting-calculator-'
+const MANIFEST_URL = '/static-manifest.json'
+const HASHED_ASSET = /\.[0-9a-f]{8,}\./
+
+const fetchManifest = () =>
+  fetch(MANIFEST_URL, { cache: 'no-cache' }).then((response) => {
+    if (!response.ok) {
+      throw new Error(`Manifest request failed: ${response.status}`)
+    }
+    return response.json()
+  })
 
 self.addEventListener('install', (event) => {
   event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then((cache) => cache.addAll(urlsToCache))
-  );
-});
+    fetchManifest()
+      .then((manifest) =>
+        caches.open(CACHE_PREFIX + manifest.version)
+          .then((cache) => cache.addAll(manifest.precache))
+      )
+      .catch((error) => console.warn('Precache skipped:', error))
+  )
+})
+
+self.addEventListener('activate', (event) => {
+  event.waitUntil(
+    fetchManifest()
+      .then((manifest) => caches.keys().then((keys) => {
+        const current = CACHE_PREFIX + manifest.version
+        // Drop caches from previous deploys; their hashed files are unreachable now
+        return Promise.all(
+          keys
+            .filter((key) => key.startsWith(CACHE_PREFIX) && key !== current)
+            .map((key) => caches.delete(key))
+        )
+      }))
+      .catch(() => undefined)
+      .then(() => self.clients.claim())
+  )
+})
 
 self.addEventListener('fetch', (event) => {
+  const url = new URL(event.request.url)
+  if (event.request.method !== 'GET' || url.origin !== self.location.origin) {
+    return
+  }
+  if (url.pathname.startsWith('/api/') || url.pathname === MANIFEST_URL) {
+    return
+  }
+
+  if (HASHED_ASSET.test(url.pathname)) {
+    event.respondWith(
+      caches.match(event.request).then((cached) => cached || fetch(event.request).then((response) => {
+        if (response.ok) {
+          const copy = response.clone()
+          caches.keys().then((keys) => {
+            const current = keys.filter((key) => key.startsWith(CACHE_PREFIX)).pop()
+            if (current) {
+              caches.open(current).then((cache) => cache.put(event.request, copy))
+            }
+          })
+        }
+        return response
+      }))
+    )
+    return
+  }
+
   event.respondWith(
-    caches.match(event.request)
-      .then((response) => {
-        // Return cached resource if found, otherwise fetch from network
-        return response || fetch(event.request);
-      })
-  );
-});
+    fetch(event.request).catch(() =>
+      caches.match(event.request).then((cached) => cached || caches.match('/'))
+    )
+  )
+})
 
 // Listen for message from the web app to skip waiting
 self.addEventListener('message', (event) => {
   if (event.data && event.data.type === 'SKIP_WAITING') {
-    self.skipWaiting();
+    self.skipWaiting()
   }
-});
\ No newline at end of file
+})
@@ -9,9 +9,28 @@ export const api = axios.create({
   },
 })
 
+// Causal token from the last write, echoed so reads served by a replica include it
+let causalToken = null
+
+// Saves carry an Idempotency-Key and are retried with the same key after a
+// timeout or dropped connection, so the server replays instead of re-applying
+const MAX_SAVE_RETRIES = 2
+
+const newIdempotencyKey = () =>
+  window.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`
+
+const idempotentPost = (url, data) =>
+  api.post(url, data, {
+    headers: { 'Idempotency-Key': newIdempotencyKey() },
+    retryWithSameKey: true,
+  })
+
 // Request interceptor for auth token
 api.interceptors.request.use(
   (config) => {
+    if (causalToken) {
+      config.headers['X-Causal-Token'] = causalToken
+    }
     const token = localStorage.getItem('auth-storage')
     if (token) {
       try {
@@ -32,8 +51,18 @@ api.interceptors.request.use(
 
 // Response interceptor for error handling
 api.interceptors.response.use(
-  (response) => response,
+  (response) => {
+    if (response.headers['x-causal-token']) {
+      causalToken = response.headers['x-causal-token']
+    }
+    return response
+  },
   (error) => {
+    const config = error.config
+    if (config?.retryWithSameKey && !error.response && (config.saveRetries || 0) < MAX_SAVE_RETRIES) {
+      config.saveRetries = (config.saveRetries || 0) + 1
+      return api(config)
+    }
     if (error.response?.status === 401) {
       // Clear auth state and redirect to login
       localStorage.removeItem('auth-storage')
@@ -54,19 +83,24 @@ export const authAPI = {
 
 export const singleCalculatorAPI = {
   getData: () => api.get('/single/data'),
-  saveData: (data) => api.post('/single/data', data),
+  saveData: (data) => idempotentPost('/single/data', data),
   exportCSV: () => api.get('/single/export'),
 }
 
 export const proCalculatorAPI = {
   getData: () => api.get('/pro/data'),
-  saveData: (data) => api.post('/pro/data', data),
+  saveData: (data) => idempotentPost('/pro/data', data),
   exportCSV: () => api.get('/pro/export'),
 }
 
+export const searchAPI = {
+  search: (q, kind = 'all') => api.get('/search', { params: { q, kind } }),
+  suggest: (q, limit = 10) => api.get('/search/suggest', { params: { q, limit } }),
+}
+
 export const brokerAPI = {
   getAccounts: () => api.get('/broker/accounts'),
-  saveAccount: (account) => api.post('/broker/accounts', account),
+  saveAccount: (account) => idempotentPost('/broker/accounts', account),
   updateAccount: (id, account) => api.put(`/broker/accounts/${id}`, account),
   deleteAccount: (id) => api.delete(`/broker/accounts/${id}`),
   getCosts: () => api.get('/broker/costs'),
@@ -1,3 +1,14 @@
+import { brokerAPI, proCalculatorAPI, singleCalculatorAPI } from './api'
+
+const COMMAND_TIMEOUT_MS = 10000
+
+// HTTP equivalents, used while the socket is down or not yet authenticated
+const HTTP_SAVE = {
+  single: (data) => singleCalculatorAPI.saveData(data),
+  pro: (data) => proCalculatorAPI.saveData(data),
+  broker: (data) => brokerAPI.saveAccount(data),
+}
+
 class RealtimeService {
   constructor() {
     this.ws = null
@@ -7,14 +18,21 @@ class RealtimeService {
     this.reconnectDelay = 1000
     this.listeners = new Map()
     this.userId = null
+    this.retryAfterMs = null
+    this.watchedMatches = []
+    this.token = null
+    this.isAuthenticated = false
+    this.pending = new Map()
+    this.nextCommandId = 1
   }
 
-  connect(userId) {
+  connect(userId, token = null) {
     if (this.ws) {
       this.disconnect()
     }
 
     this.userId = userId
+    this.token = token
     const wsUrl = `${process.env.REACT_APP_BACKEND_URL.replace('https:', 'wss:').replace('http:', 'ws:')}/ws/${userId}`
     
     try {
@@ -31,6 +49,13 @@ class RealtimeService {
       console.log('WebSocket connected')
       this.isConnected = true
       this.reconnectAttempts = 0
+      if (this.token) {
+        this.send({ type: 'auth', token: this.token })
+      }
+      if (this.watchedMatches.length) {
+        // Watch lists live on the worker; re-register after every reconnect
+        this.send({ type: 'watch_odds', matches: this.watchedMatches })
+      }
       this.emit('connected')
     }
 
@@ -46,6 +71,8 @@ class RealtimeService {
     this.ws.onclose = () => {
       console.log('WebSocket disconnected')
       this.isConnected = false
+      this.isAuthenticated = false
+      this.failPending('WebSocket disconnected')
       this.emit('disconnected')
       this.scheduleReconnect()
     }
@@ -64,9 +91,29 @@ class RealtimeService {
       case 'data_update':
         this.emit('dataUpdate', data)
         break
+      case 'auth':
+        this.isAuthenticated = data.ok
+        this.emit('authenticated', data.ok)
+        break
+      case 'reply':
+        this.resolveCommand(data)
+        break
+      case 'job_progress':
+        this.emit('jobProgress', data.job)
+        break
+      case 'odds_snapshot':
+        this.emit('oddsSnapshot', data.markets)
+        break
+      case 'odds_alert':
+        this.emit('oddsAlert', data)
+        break
       case 'pong':
         // Handle ping/pong for keep-alive
         break
+      case 'reconnect':
+        // Server is shedding load; honour its (already jittered) retry hint
+        this.retryAfterMs = (data.retry_after || 1) * 1000
+        break
       default:
         console.log('Unknown message type:', data.type)
     }
@@ -82,15 +129,80 @@ class RealtimeService {
     this.send({ type: 'ping' })
   }
 
+  watchOdds(matches) {
+    this.watchedMatches = matches
+    this.send({ type: 'watch_odds', matches })
+  }
+
+  // Request/response commands over the socket (save, list, delete)
+  command(type, payload) {
+    if (!this.isAuthenticated) {
+      return Promise.reject(new Error('WebSocket not authenticated'))
+    }
+    const id = String(this.nextCommandId++)
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pending.delete(id)
+        reject(new Error(`${type} timed out`))
+      }, COMMAND_TIMEOUT_MS)
+      this.pending.set(id, { resolve, reject, timer })
+      this.send({ ...payload, type, id })
+    })
+  }
+
+  resolveCommand(reply) {
+    const entry = this.pending.get(reply.id)
+    if (!entry) return
+    this.pending.delete(reply.id)
+    clearTimeout(entry.timer)
+    if (reply.ok) {
+      entry.resolve(reply)
+    } else {
+      const error = new Error(typeof reply.error === 'string' ? reply.error : 'Command failed')
+      error.status = reply.status
+      error.detail = reply.error
+      entry.reject(error)
+    }
+  }
+
+  failPending(message) {
+    this.pending.forEach(({ reject, timer }) => {
+      clearTimeout(timer)
+      reject(new Error(message))
+    })
+    this.pending.clear()
+  }
+
+  // Autosave over the socket when it is up, otherwise over HTTP; resolves to the saved record
+  async save(kind, data) {
+    if (this.isAuthenticated) {
+      try {
+        return (await this.command('save', { kind, data })).data
+      } catch (error) {
+        if (error.status) throw error // rejected by the server; HTTP would say the same
+      }
+    }
+    return (await HTTP_SAVE[kind](data)).data
+  }
+
+  list(kind, view = 'detail') {
+    return this.command('list', { kind, view }).then((reply) => reply.data)
+  }
+
   scheduleReconnect() {
     if (this.reconnectAttempts < this.maxReconnectAttempts) {
       this.reconnectAttempts++
+      // Spread reconnects out so a restart doesn't bring every client back at once
+      const delay = this.retryAfterMs !== null
+        ? this.retryAfterMs + Math.random() * 1000
+        : this.reconnectDelay * this.reconnectAttempts * (1 + Math.random())
+      this.retryAfterMs = null
       setTimeout(() => {
         if (this.userId) {
           console.log(`Reconnecting... Attempt ${this.reconnectAttempts}`)
           this.connect(this.userId)
         }
-      }, this.reconnectDelay * this.reconnectAttempts)
+      }, delay)
     }
   }
 
@@ -99,6 +211,8 @@ class RealtimeService {
       this.ws.close()
       this.ws = null
       this.isConnected = false
+      this.isAuthenticated = false
+      this.failPending('WebSocket closed')
       this.userId = null
     }
   }
@@ -28,7 +28,7 @@ export const useAuthStore = create(
           api.defaults.headers.common['Authorization'] = `Bearer ${token}`
           
           // Connect to real-time service
-          realtimeService.connect(user.id)
+          realtimeService.connect(user.id, token)
           
           return { success: true, user }
         } catch (error) {
@@ -68,7 +68,7 @@ export const useAuthStore = create(
           })
           
           // Connect to real-time service
-          realtimeService.connect(response.data.user.id)
+          realtimeService.connect(response.data.user.id, token)
           
           return true
         } catch (error) {
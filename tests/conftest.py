@@ -0,0 +1,54 @@
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# The backend is a flat set of modules run from its own directory
+sys.path.insert(0, str(BACKEND_DIR))
+
+# The app under test keeps everything in-process; set before server reads backend/.env
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("MONGO_SERVER_SELECTION_TIMEOUT_MS", "500")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+@pytest.fixture(scope="session")
+def server():
+    import server
+
+    return server
+
+
+@pytest.fixture(scope="session")
+def client(server):
+    from starlette.testclient import TestClient
+
+    with TestClient(server.app) as test_client:
+        yield test_client
+        # Let the deferred admin bootstrap finish its bcrypt hash before the portal's threads go away
+        test_client.portal.call(asyncio.wait, [server.app.state.admin_bootstrap])
+
+
+@pytest.fixture
+def user(client):
+    """A freshly registered user: ``{"id", "username", "headers", "token"}``."""
+    credentials = {"username": f"test_{uuid.uuid4().hex[:10]}", "password": "test-password"}
+    response = client.post("/api/auth/register", json=dict(credentials, email=f"{credentials['username']}@example.com"))
+    assert response.status_code == 200, response.text
+    user_id = response.json()["id"]
+    token = client.post("/api/auth/login", json=credentials).json()["token"]
+    return {"id": user_id, "username": credentials["username"], "token": token,
+            "headers": {"Authorization": f"Bearer {token}"}}
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine on a private loop (asyncio.run would clear the thread's loop, which Motor looks up)."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from analytics import ROLLUP_COLLECTION, SUMMARY_COLLECTION, AnalyticsRollups, refresh_pipeline
+
+
+def test_refresh_pipeline_recomputes_touched_days_and_merges():
+    low, high = datetime(2026, 1, 1), datetime(2026, 1, 2)
+    pipeline = refresh_pipeline("pro", low, high)
+    assert pipeline[0] == {"$match": {"updated_at": {"$gt": low, "$lte": high}}}
+    lookups = [stage["$lookup"] for stage in pipeline if "$lookup" in stage]
+    assert lookups[0]["from"] == "pro_calculator" and lookups[1]["from"] == SUMMARY_COLLECTION
+    assert pipeline[-1]["$merge"]["into"] == ROLLUP_COLLECTION
+    assert pipeline[-1]["$merge"]["whenMatched"] == "replace"
+    project = next(stage["$project"] for stage in pipeline if "$project" in stage)
+    assert project["_id"]["account_type"] == "pro"
+
+
+class _Cursor:
+    def __init__(self, fail):
+        self.fail = fail
+
+    async def to_list(self, length):
+        if self.fail:
+            raise RuntimeError("aggregation failed")
+        return []
+
+
+class _Collection:
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+
+    def aggregate(self, pipeline):
+        self.db.aggregated.append((self.name, pipeline))
+        return _Cursor(self.db.fail)
+
+    async def find_one_and_update(self, query, update, **kwargs):
+        if self.db.leased_elsewhere:
+            # The upsert collides with the watermark document another worker holds
+            raise DuplicateKeyError("lease held")
+        return self.db.watermarks.get(query["_id"])
+
+    async def update_one(self, query, update, **kwargs):
+        self.db.watermarks.setdefault(query["_id"], {}).update(update["$set"])
+
+
+class _Database:
+    def __init__(self):
+        self.aggregated = []
+        self.watermarks = {}
+        self.fail = False
+        self.leased_elsewhere = False
+
+    def __getitem__(self, name):
+        return _Collection(self, name)
+
+
+def test_refresh_moves_the_watermark_and_releases_the_lease(run):
+    db = _Database()
+    rollups = AnalyticsRollups(db, settle_seconds=5)
+    refreshed = run(rollups.refresh(["single"]))
+    assert [name for name, _ in db.aggregated] == ["single_calculator"]
+    # The pipeline starts where the previous one stopped
+    assert db.aggregated[0][1][0]["$match"]["updated_at"]["$gt"] == datetime.min
+    high = refreshed["single"]
+    assert datetime.utcnow() - high >= timedelta(seconds=5)
+    assert db.watermarks["single"] == {"updated_at": high, "lease_until": datetime.min}
+
+    run(rollups.refresh(["single"]))
+    assert db.aggregated[1][1][0]["$match"]["updated_at"]["$gt"] == high
+
+
+def test_failed_refresh_keeps_the_watermark(run):
+    db = _Database()
+    db.fail = True
+    with pytest.raises(RuntimeError):
+        run(AnalyticsRollups(db).refresh(["pro"]))
+    assert db.watermarks["pro"] == {"lease_until": datetime.min}
+
+
+def test_refresh_skips_types_leased_by_another_worker(run):
+    db = _Database()
+    db.leased_elsewhere = True
+    assert run(AnalyticsRollups(db).refresh()) == {}
+    assert db.aggregated == []
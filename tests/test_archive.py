@@ -0,0 +1,193 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from analytics import SUMMARY_COLLECTION, WATERMARK_COLLECTION
+from archive import CalculatorArchiver, FileArchiveStore, decode_records, encode_records, summary_pipeline
+
+
+def _record(record_id, user_id, created_at):
+    return {"id": record_id, "user_id": user_id, "match_name": "A vs B", "stake": 10.0,
+            "created_at": created_at, "updated_at": created_at}
+
+
+def test_records_round_trip_with_datetimes():
+    records = [_record("a", "u1", datetime(2025, 1, 2, 3, 4, 5, 678000))]
+    assert decode_records(encode_records(records)) == records
+
+
+def test_file_store_reads_back_what_it_wrote(run, tmp_path):
+    store = FileArchiveStore(tmp_path)
+    run(store.write("single", "u1", "2025-01", "b1", [_record("a", "u1", datetime(2025, 1, 1))]))
+    run(store.write("single", "u1", "2025-02", "b2", [_record("b", "u1", datetime(2025, 2, 1))]))
+    # The same batch written again replaces its file
+    run(store.write("single", "u1", "2025-02", "b2", [_record("b", "u1", datetime(2025, 2, 1))]))
+
+    async def read():
+        return [batch async for batch in store.read("single", "u1")]
+
+    assert [[record["id"] for record in batch] for batch in run(read())] == [["a"], ["b"]]
+    with pytest.raises(ValueError):
+        run(store.write("single", "../etc", "2025-01", "b3", []))
+
+
+def test_summary_pipeline_adds_each_batch_once():
+    pipeline = summary_pipeline("single", "u1", ["a", "b"], "batch-1")
+    assert pipeline[0] == {"$match": {"user_id": "u1", "id": {"$in": ["a", "b"]}}}
+    assert pipeline[-2] == {"$set": {"batches": {"$literal": ["batch-1"]}}}
+    merge = pipeline[-1]["$merge"]
+    assert merge["into"] == SUMMARY_COLLECTION
+    added = {"$in": ["batch-1", {"$ifNull": ["$batches", []]}]}
+    assert merge["whenMatched"][0]["$set"]["count"] == {
+        "$cond": [added, "$count", {"$add": ["$count", "$$new.count"]}]}
+
+
+class _Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, keys, direction=None):
+        if isinstance(keys, str):
+            keys = [(keys, direction)]
+        for name, direction in reversed(keys):
+            self.documents.sort(key=lambda document: document[name], reverse=direction < 0)
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in list(self.documents):
+            yield document
+
+    async def to_list(self, length):
+        return list(self.documents)
+
+
+class _Hot:
+    def __init__(self, documents):
+        self.documents = documents
+        self.summaries = []
+        self.fail_summaries = 0
+
+    def find(self, query):
+        if "id" in query:
+            return _Cursor([document for document in self.documents
+                            if document["user_id"] == query["user_id"] and document["id"] in query["id"]["$in"]])
+        cutoff, watermark = query["created_at"]["$lt"], query["updated_at"]["$lte"]
+        return _Cursor([document for document in self.documents
+                        if document["created_at"] < cutoff and document["updated_at"] <= watermark])
+
+    def aggregate(self, pipeline):
+        if self.fail_summaries:
+            self.fail_summaries -= 1
+            raise RuntimeError("worker died")
+        self.summaries.append((pipeline[-2]["$set"]["batches"]["$literal"][0], pipeline[0]["$match"]["id"]["$in"]))
+        return _Cursor([])
+
+    async def delete_many(self, query):
+        ids = set(query["id"]["$in"])
+        before = len(self.documents)
+        self.documents = [d for d in self.documents if not (d["user_id"] == query["user_id"] and d["id"] in ids)]
+        return SimpleNamespace(deleted_count=before - len(self.documents))
+
+    async def distinct(self, field, query):
+        return [document[field] for document in self.documents if document["user_id"] == query["user_id"]]
+
+
+class _Watermarks:
+    def __init__(self, updated_at):
+        self.document = {"_id": "single", "updated_at": updated_at}
+
+    async def find_one_and_update(self, query, update, **kwargs):
+        self.document.update(update["$set"])
+        return dict(self.document)
+
+    async def update_one(self, query, update):
+        self.document.update(update["$set"])
+
+
+class _MemoryStore:
+    def __init__(self):
+        self.batches = {}
+
+    async def write(self, account_type, user_id, month, batch_id, records):
+        self.batches[batch_id] = (user_id, month, [record["id"] for record in records])
+        return 1
+
+    async def read(self, account_type, user_id):
+        for batch_user, _, ids in self.batches.values():
+            if batch_user == user_id:
+                yield [{"id": record_id} for record_id in ids]
+
+
+def test_archive_moves_cold_records_in_user_month_batches(run):
+    now = datetime.utcnow()
+    old = now - timedelta(days=400)
+    hot = _Hot([
+        _record("a1", "u1", old), _record("a2", "u1", old + timedelta(days=1)),
+        _record("b1", "u1", old + timedelta(days=40)),
+        _record("c1", "u2", old),
+        _record("recent", "u1", now - timedelta(days=1)),
+    ])
+    watermarks = _Watermarks(updated_at=now)
+    store = _MemoryStore()
+    db = {"single_calculator": hot, WATERMARK_COLLECTION: watermarks}
+    archiver = CalculatorArchiver(db, store, after_days=180)
+
+    report = run(archiver.archive(["single"]))
+    assert report["single"]["records"] == 4 and report["single"]["batches"] == 3
+    assert [(user, ids) for user, _, ids in store.batches.values()] == [
+        ("u1", ["a1", "a2"]), ("u1", ["b1"]), ("u2", ["c1"])]
+    assert hot.summaries == [(batch_id, ids) for batch_id, (_, _, ids) in store.batches.items()]
+    assert [document["id"] for document in hot.documents] == ["recent"]
+    assert watermarks.document["lease_until"] == datetime.min and watermarks.document["archiving"] is None
+
+    # Saved again after archiving: exported once, from the hot copy
+    hot.documents.append(_record("a1", "u1", now))
+
+    async def exported():
+        return [record["id"] async for record in archiver.records("single", "u1", hot)]
+
+    assert run(exported()) == ["a2", "b1"]
+
+
+def test_archive_waits_for_a_first_analytics_refresh(run):
+    watermarks = _Watermarks(updated_at=None)
+    archiver = CalculatorArchiver({"single_calculator": _Hot([]), WATERMARK_COLLECTION: watermarks}, _MemoryStore())
+    assert "skipped" in run(archiver.archive(["single"]))["single"]
+
+
+def test_a_pass_that_died_mid_batch_is_finished_once(run):
+    now = datetime.utcnow()
+    old = now - timedelta(days=400)
+    hot = _Hot([_record("a1", "u1", old), _record("a2", "u1", old)])
+    watermarks = _Watermarks(updated_at=now)
+    store = _MemoryStore()
+    archiver = CalculatorArchiver({"single_calculator": hot, WATERMARK_COLLECTION: watermarks}, store)
+
+    hot.fail_summaries = 1  # dies after writing the batch, before its summary
+    with pytest.raises(RuntimeError):
+        run(archiver.archive(["single"]))
+    journal = watermarks.document["archiving"]
+    assert journal["step"] == "summary" and journal["ids"] == ["a1", "a2"]
+
+    # Saved again in between, so the next pass's own query no longer picks a2 up
+    hot.documents[1]["updated_at"] = now + timedelta(days=1)
+    report = run(archiver.archive(["single"]))
+    assert report["single"]["records"] == 2 and hot.documents == []
+    assert list(store.batches) == [journal["batch_id"]]
+    assert hot.summaries == [(journal["batch_id"], ["a1", "a2"])]
+    assert watermarks.document["archiving"] is None
+
+
+def test_export_reads_a_record_archived_twice_once(run):
+    store = _MemoryStore()
+    store.batches = {"b1": ("u1", "2025-01", ["a1", "a2"]), "b2": ("u1", "2025-01", ["a2", "a3"])}
+    archiver = CalculatorArchiver({}, store)
+
+    async def exported():
+        return [record["id"] async for record in archiver.records("single", "u1", _Hot([]))]
+
+    assert run(exported()) == ["a1", "a2", "a3"]
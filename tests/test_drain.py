@@ -0,0 +1,111 @@
+import asyncio
+import os
+import signal
+
+from drain import SERVICE_RESTART, DrainController
+
+
+class _Socket:
+    def __init__(self, log):
+        self.log = log
+        self.sent = []
+        self.closed_with = None
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+        self.log.append("close")
+
+
+class _Manager:
+    """The parts of server.ConnectionManager the drain uses."""
+
+    def __init__(self, log, users=2):
+        self.log = log
+        self.idle = asyncio.Event()
+        self.active_connections = {f"u{i}": [_Socket(log)] for i in range(users)}
+
+    async def wait_until_idle(self):
+        await self.idle.wait()
+        self.log.append("idle")
+
+    def sockets(self):
+        return [(user_id, socket) for user_id, sockets in self.active_connections.items() for socket in list(sockets)]
+
+    def disconnect(self, websocket, user_id):
+        sockets = self.active_connections.get(user_id, [])
+        if websocket in sockets:
+            sockets.remove(websocket)
+        if not sockets:
+            self.active_connections.pop(user_id, None)
+
+
+def test_drain_flushes_then_releases_sockets_with_spread_hints(run):
+    async def scenario():
+        log = []
+        manager = _Manager(log)
+        sockets = [socket for _, socket in manager.sockets()]
+
+        async def flush():
+            log.append("flush")
+
+        controller = DrainController(manager, [flush], deadline_seconds=5, spread_seconds=10)
+        task = controller.start("test")
+        assert controller.start("again") is task and controller.draining
+        await asyncio.sleep(0.01)
+        assert log == []  # a broadcast is still being sent
+        manager.idle.set()
+        await task
+
+        assert log[:2] == ["idle", "flush"] and log.count("close") == 2
+        for socket in sockets:
+            assert socket.closed_with == SERVICE_RESTART
+            assert socket.sent[0]["type"] == "reconnect" and 1.0 <= socket.sent[0]["retry_after"] <= 10
+        assert manager.active_connections == {}
+        snapshot = controller.snapshot()
+        assert snapshot["finished"] and snapshot["sockets_closed"] == 2 and snapshot["reason"] == "test"
+
+    run(scenario())
+
+
+def test_deadline_closes_sockets_when_a_flush_hangs(run):
+    async def scenario():
+        log = []
+        manager = _Manager(log)
+        manager.idle.set()
+
+        async def hang():
+            await asyncio.sleep(60)
+
+        controller = DrainController(manager, [hang], deadline_seconds=0.1)
+        await asyncio.wait_for(controller.drain("test"), 5)
+        assert manager.active_connections == {} and controller.sockets_closed == 2
+
+    run(scenario())
+
+
+def test_sigterm_drains_then_hands_over_to_shutdown(run):
+    async def scenario():
+        manager = _Manager([], users=1)
+        manager.idle.set()
+        controller = DrainController(manager, [], deadline_seconds=5)
+        handed_over = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        previous = signal.signal(signal.SIGUSR1, lambda *_: loop.call_soon_threadsafe(handed_over.set))
+        try:
+            controller.install_signal_handler(then_signal=signal.SIGUSR1)
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.wait_for(handed_over.wait(), 5)
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+            signal.signal(signal.SIGUSR1, previous)
+        assert controller.reason == "SIGTERM" and manager.active_connections == {}
+
+    run(scenario())
+
+
+def test_health_reports_drain_state(client):
+    assert client.get("/api/health").json()["drain"]["draining"] is False
+    assert client.get("/api/health/ready").json()["reasons"] == []
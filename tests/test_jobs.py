@@ -0,0 +1,221 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+from jobs import JobError, JobRunner
+
+
+def _matches(document, query):
+    for name, condition in query.items():
+        if name == "$or":
+            if not any(_matches(document, clause) for clause in condition):
+                return False
+            continue
+        value = document.get(name)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for op, operand in condition.items():
+            if (op == "$in" and value not in operand or op == "$ne" and value == operand
+                    or op == "$lt" and not (value is not None and value < operand)
+                    or op == "$exists" and (name in document) != operand):
+                return False
+    return True
+
+
+class _Jobs:
+    def __init__(self):
+        self.documents = []
+        self.progress_writes = 0
+
+    async def insert_one(self, document):
+        self.documents.append(dict(document))
+
+    async def update_one(self, query, update):
+        for document in self.documents:
+            if _matches(document, query):
+                document.update(update["$set"])
+                return
+
+    async def update_many(self, query, update):
+        matched = [document for document in self.documents if _matches(document, query)]
+        for document in matched:
+            document.update(update["$set"])
+        return type("Result", (), {"modified_count": len(matched)})
+
+    async def find_one_and_update(self, query, update, **kwargs):
+        self.progress_writes += 1
+        await self.update_one(query, update)
+        return await self.find_one(query)
+
+    async def find_one(self, query, projection=None):
+        return next((dict(document) for document in self.documents if _matches(document, query)), None)
+
+    def by_id(self, job_id):
+        return next(document for document in self.documents if document["id"] == job_id)
+
+
+class _Database:
+    def __init__(self):
+        self.jobs = _Jobs()
+
+
+class _Manager:
+    def __init__(self):
+        self.messages = []
+
+    async def broadcast_to_user(self, message, user_id, relay=True):
+        self.messages.append((user_id, message["job"]["status"], message["job"]["progress"]))
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    # Results go to GridFS, which needs a Motor database; these jobs store none
+    monkeypatch.setattr(jobs, "AsyncIOMotorGridFSBucket", lambda db, bucket_name: None)
+    return JobRunner(_Database(), _Manager(), stale_seconds=60)
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_submit_checks_the_type_and_runs_the_job(run, runner):
+    @runner.job_type("echo", transient_params=("records",))
+    async def echo(ctx, params):
+        await ctx.progress(0.5, "halfway", force=True)
+        return {"rows": len(params["records"])}
+
+    @runner.job_type("secret", admin_only=True)
+    async def secret(ctx, params):
+        return {}
+
+    async def scenario():
+        with pytest.raises(JobError) as error:
+            await runner.submit("u1", "missing", {})
+        assert error.value.status_code == 400
+        with pytest.raises(JobError) as error:
+            await runner.submit("u1", "secret", {})
+        assert error.value.status_code == 403
+
+        job = await runner.submit("u1", "echo", {"records": [1, 2, 3], "calculator": "single"})
+        await runner.tasks[job.id]
+        return job
+
+    job = run(scenario())
+    stored = runner.db.jobs.by_id(job.id)
+    assert stored["params"] == {"calculator": "single", "records_count": 3}  # rows aren't persisted
+    assert stored["owner"] == runner.worker_id and stored["status"] == "succeeded"
+    assert stored["result"] == {"rows": 3}
+    assert runner.manager.messages == [("u1", "running", 0.0), ("u1", "running", 0.5), ("u1", "succeeded", 1.0)]
+    assert runner.tasks == {}
+
+
+def test_each_type_runs_at_most_its_concurrency(run, runner):
+    release = asyncio.Event()
+
+    @runner.job_type("slow", concurrency=1)
+    async def slow(ctx, params):
+        await release.wait()
+
+    async def scenario():
+        first = await runner.submit("u1", "slow", {})
+        second = await runner.submit("u1", "slow", {})
+        await _settle()
+        statuses = [runner.db.jobs.by_id(job.id)["status"] for job in (first, second)]
+        assert runner.snapshot()["free_slots"] == {"slow": 0}
+        release.set()
+        await asyncio.gather(*runner.tasks.values())
+        return statuses
+
+    assert run(scenario()) == ["running", "queued"]
+    assert {document["status"] for document in runner.db.jobs.documents} == {"succeeded"}
+
+
+def test_cancel_stops_local_jobs_and_flags_jobs_on_other_workers(run, runner):
+    @runner.job_type("wait")
+    async def wait(ctx, params):
+        while True:
+            await ctx.progress(0.1, force=True)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        local = await runner.submit("u1", "wait", {})
+        await _settle()
+        assert (await runner.cancel(local.id, "u1")).cancel_requested
+        await asyncio.gather(*runner.tasks.values(), return_exceptions=True)
+
+        # One this worker didn't start: only the flag can reach it
+        remote = await runner.submit("u1", "wait", {})
+        await _settle()
+        task = runner.tasks.pop(remote.id)
+        await runner.cancel(remote.id, "u1")
+        assert runner.db.jobs.by_id(remote.id)["cancel_requested"]
+        await task  # its next progress update sees the flag
+        assert await runner.cancel(local.id, "other-user") is None
+        return local, remote
+
+    local, remote = run(scenario())
+    assert runner.db.jobs.by_id(local.id)["status"] == "cancelled"
+    assert runner.db.jobs.by_id(remote.id)["status"] == "cancelled"
+
+
+def test_progress_writes_are_throttled(run, runner):
+    @runner.job_type("chatty")
+    async def chatty(ctx, params):
+        for step in range(10):
+            await ctx.progress(step / 10)
+        await ctx.progress(1.0, "done", force=True)
+
+    async def scenario():
+        job = await runner.submit("u1", "chatty", {})
+        await runner.tasks[job.id]
+
+    run(scenario())
+    # The first update, then only the forced one inside PROGRESS_INTERVAL
+    assert runner.db.jobs.progress_writes == 2
+
+
+def test_heartbeat_refreshes_only_this_workers_live_jobs(run, runner):
+    long_ago = datetime.utcnow() - timedelta(hours=1)
+    release = asyncio.Event()
+
+    @runner.job_type("slow")
+    async def slow(ctx, params):
+        await release.wait()
+
+    async def scenario():
+        job = await runner.submit("u1", "slow", {})
+        runner.db.jobs.by_id(job.id)["heartbeat_at"] = long_ago
+        runner.db.jobs.documents.append({"id": "elsewhere", "owner": "other", "status": "running",
+                                         "heartbeat_at": long_ago})
+        await runner.heartbeat()
+        release.set()
+        await runner.tasks[job.id]
+        return job
+
+    job = run(scenario())
+    assert runner.db.jobs.by_id(job.id)["heartbeat_at"] > long_ago
+    assert runner.db.jobs.by_id("elsewhere")["heartbeat_at"] == long_ago
+
+
+def test_recover_stale_fails_only_jobs_whose_owner_stopped_beating(run, runner):
+    now = datetime.utcnow()
+    stale, fresh = now - timedelta(seconds=120), now - timedelta(seconds=5)
+    runner.db.jobs.documents = [
+        {"id": "dead", "owner": "gone", "status": "running", "heartbeat_at": stale, "updated_at": stale},
+        {"id": "queued-dead", "owner": "gone", "status": "queued", "heartbeat_at": stale, "updated_at": stale},
+        # Running for a long time, but its worker is still beating
+        {"id": "long", "owner": "alive", "status": "running", "heartbeat_at": fresh, "updated_at": stale},
+        {"id": "mine", "owner": runner.worker_id, "status": "running", "heartbeat_at": stale, "updated_at": stale},
+        {"id": "legacy", "status": "running", "updated_at": stale},
+        {"id": "legacy-fresh", "status": "running", "updated_at": fresh},
+        {"id": "done", "owner": "gone", "status": "succeeded", "heartbeat_at": stale, "updated_at": stale},
+    ]
+    run(runner.recover_stale())
+    statuses = {document["id"]: document["status"] for document in runner.db.jobs.documents}
+    assert statuses == {"dead": "failed", "queued-dead": "failed", "long": "running", "mine": "running",
+                        "legacy": "failed", "legacy-fresh": "running", "done": "succeeded"}
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+from dotenv import dotenv_values
+from pymongo.errors import DuplicateKeyError
+
+import launcher
+from repositories import MongoUserRepository
+
+
+def test_default_workers_fit_in_memory():
+    assert launcher.default_workers(8, None, 256, 256) == 8
+    assert launcher.default_workers(8, 1024, 256, 256) == 3
+    assert launcher.default_workers(8, 100, 256, 256) == 1
+
+
+def test_preload_list_excludes_server():
+    names = launcher.app_imports()
+    assert "fastapi" in names and "server" not in names
+
+
+@pytest.fixture
+def launch(monkeypatch):
+    """``launcher.main`` without a supervisor, and with every variable it sets undone afterwards."""
+
+    def load_dotenv(path):
+        # Same precedence as python-dotenv (the environment wins), but through monkeypatch
+        for name, value in dotenv_values(path).items():
+            if value is not None and name not in os.environ:
+                monkeypatch.setenv(name, value)
+
+    monkeypatch.setattr(launcher, "load_dotenv", load_dotenv)
+    monkeypatch.setattr(launcher.logging, "basicConfig", lambda **kwargs: None)
+    monkeypatch.setattr(launcher.Supervisor, "run", lambda self: 0)
+    # Recorded first, so the value main() sets is removed again
+    monkeypatch.setenv("JOB_PROCESS_WORKERS", "")
+    monkeypatch.delenv("JOB_PROCESS_WORKERS")
+    return launcher.main
+
+
+def test_job_pool_gets_the_worker_cpu_share(launch, monkeypatch):
+    monkeypatch.setattr(launcher, "available_cpus", lambda: 8)
+    assert launch(["--workers", "2"]) == 0
+    # backend/.env is loaded first and must not pin the pool size
+    assert os.environ["JOB_PROCESS_WORKERS"] == "4"
+
+
+def test_explicit_job_pool_size_wins(launch, monkeypatch):
+    monkeypatch.setenv("JOB_PROCESS_WORKERS", "3")
+    launch(["--workers", "4"])
+    assert os.environ["JOB_PROCESS_WORKERS"] == "3"
+
+
+class _DuplicateUsernames:
+    async def create_index(self, *args, **kwargs):
+        raise DuplicateKeyError("E11000 duplicate key error collection: users index: username_1")
+
+
+def test_username_index_on_duplicates_does_not_raise(run, caplog):
+    repository = MongoUserRepository.__new__(MongoUserRepository)
+    repository.collection = _DuplicateUsernames()
+    run(repository.ensure_indexes())
+    assert "unique username index" in caplog.text
+
+
+def test_admin_bootstrap_survives_index_failure(server, run, monkeypatch):
+    async def fail():
+        raise RuntimeError("index build failed")
+
+    monkeypatch.setenv("ADMIN_USERNAME", "bootstrap_admin_test")
+    monkeypatch.setenv("WORKER_INDEX", "0")
+    monkeypatch.setattr(server.repositories.users, "ensure_indexes", fail)
+    run(server.bootstrap_admin())
+    assert run(server.repositories.users.find_by_username("bootstrap_admin_test")) is not None
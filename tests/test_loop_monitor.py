@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from loop_monitor import LoopMonitor, RouteTracker, SamplingProfiler
+
+
+def test_blocking_call_is_measured_and_reported(run, caplog):
+    async def scenario():
+        monitor = LoopMonitor(interval_ms=10, slow_threshold_ms=50)
+        tracked = RouteTracker(None, monitor.active_routes)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.05)
+
+            async def app(scope, receive, send):
+                time.sleep(0.3)  # blocks the loop, as a sync call in a handler would
+
+            tracked.app = app
+            await tracked({"type": "http", "method": "GET", "path": "/api/slow"}, None, None)
+            await asyncio.sleep(0.05)
+        finally:
+            await monitor.stop()
+        return monitor
+
+    with caplog.at_level(logging.WARNING, logger="loop_monitor"):
+        monitor = run(scenario())
+    assert monitor.stalls == 1
+    assert monitor.recent_max_lag_ms() >= 200
+    assert monitor.snapshot()["lag_ms"]["count"] > 0
+    assert "route: GET /api/slow" in caplog.text
+    assert "time.sleep(0.3)" in caplog.text  # the loop thread's stack at the stall
+    assert monitor.active_routes == {}
+
+
+def test_healthy_loop_has_no_stalls(run):
+    async def scenario():
+        monitor = LoopMonitor(interval_ms=10, slow_threshold_ms=200)
+        monitor.start()
+        await asyncio.sleep(0.1)
+        await monitor.stop()
+        return monitor
+
+    monitor = run(scenario())
+    assert monitor.stalls == 0 and monitor.recent_max_lag_ms() < 200
+
+
+def test_profiler_collapses_loop_thread_stacks(run):
+    async def scenario():
+        profiler = SamplingProfiler()
+
+        async def busy():
+            deadline = time.monotonic() + 0.15
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0)
+
+        profile, _ = await asyncio.gather(profiler.profile(0.1, interval_ms=2), busy())
+        return profiler, profile
+
+    profiler, profile = run(scenario())
+    lines = profile.strip().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("MainThread;" in line for line in lines)
+    assert not profiler.busy
+
+
+def test_profiler_runs_one_at_a_time(run):
+    async def scenario():
+        profiler = SamplingProfiler()
+        first = asyncio.ensure_future(profiler.profile(0.1))
+        await asyncio.sleep(0.01)
+        with pytest.raises(RuntimeError):
+            await profiler.profile(0.1)
+        await first
+
+    run(scenario())
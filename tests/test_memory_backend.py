@@ -0,0 +1,81 @@
+import uuid
+
+
+def _single(**overrides):
+    record = {"id": str(uuid.uuid4()), "user_id": "set-by-server", "match_name": "Arsenal vs Chelsea",
+              "stake": 10.0, "odds": 2.2, "commission": 2.0, "potential_profit": 11.76}
+    record.update(overrides)
+    return record
+
+
+def test_register_rejects_taken_username(client, user):
+    response = client.post("/api/auth/register",
+                           json={"username": user["username"], "password": "x", "email": "other@example.com"})
+    assert response.status_code == 400
+
+
+def test_calculator_records_round_trip(client, user):
+    record = _single()
+    assert client.post("/api/single/data", json=record, headers=user["headers"]).status_code == 200
+    assert client.post("/api/single/data", json=dict(record, stake=20.0), headers=user["headers"]).status_code == 200
+
+    listed = client.get("/api/single/data", headers=user["headers"]).json()
+    assert [(item["id"], item["stake"], item["user_id"]) for item in listed] == [(record["id"], 20.0, user["id"])]
+
+
+def test_records_are_per_user(client, user):
+    client.post("/api/single/data", json=_single(), headers=user["headers"])
+    other = client.post("/api/auth/register", json={"username": f"other_{uuid.uuid4().hex[:8]}",
+                                                    "password": "pw", "email": f"{uuid.uuid4().hex[:8]}@example.com"})
+    token = client.post("/api/auth/login", json={"username": other.json()["username"], "password": "pw"}).json()["token"]
+    assert client.get("/api/single/data", headers={"Authorization": f"Bearer {token}"}).json() == []
+
+
+def test_saving_another_users_record_id_conflicts(client, user):
+    record = _single()
+    assert client.post("/api/single/data", json=record, headers=user["headers"]).status_code == 200
+    other = client.post("/api/auth/register", json={"username": f"other_{uuid.uuid4().hex[:8]}",
+                                                    "password": "pw", "email": f"{uuid.uuid4().hex[:8]}@example.com"})
+    token = client.post("/api/auth/login", json={"username": other.json()["username"], "password": "pw"}).json()["token"]
+    response = client.post("/api/single/data", json=record, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 409
+    assert client.get("/api/single/data", headers=user["headers"]).json()[0]["user_id"] == user["id"]
+
+
+def test_broker_account_update_and_delete(client, user):
+    account = {"id": str(uuid.uuid4()), "user_id": "set-by-server", "account_name": "Main",
+               "account_type": "betfair", "balance": 100.0, "commission_rate": 2.0}
+    headers = user["headers"]
+    assert client.post("/api/broker/accounts", json=account, headers=headers).status_code == 200
+    assert client.put(f"/api/broker/accounts/{account['id']}", json=dict(account, balance=250.0), headers=headers).status_code == 200
+    assert client.put("/api/broker/accounts/missing", json=dict(account, id="missing"), headers=headers).status_code == 404
+    assert [item["balance"] for item in client.get("/api/broker/accounts", headers=headers).json()] == [250.0]
+    assert client.delete(f"/api/broker/accounts/{account['id']}", headers=headers).status_code == 200
+    assert client.delete(f"/api/broker/accounts/{account['id']}", headers=headers).status_code == 404
+
+
+def test_idempotency_key_replays_without_mongo(client, user):
+    record = _single()
+    headers = dict(user["headers"], **{"Idempotency-Key": uuid.uuid4().hex})
+    first = client.post("/api/single/data", json=record, headers=headers)
+    second = client.post("/api/single/data", json=record, headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert second.content == first.content
+    assert client.post("/api/single/data", json=dict(record, stake=99.0), headers=headers).status_code == 422
+
+
+def test_mongo_only_routes_are_not_implemented(client, user):
+    for method, path in [("get", "/api/search?q=Arsenal"), ("get", "/api/search/suggest?q=Ar"),
+                         ("post", "/api/analytics/simulate"), ("get", "/api/analytics/series"),
+                         ("get", "/api/jobs"), ("get", "/api/single/export")]:
+        kwargs = {"json": {}} if method == "post" else {}
+        response = getattr(client, method)(path, headers=user["headers"], **kwargs)
+        assert response.status_code == 501, path
+
+
+def test_ready_without_mongo(client):
+    response = client.get("/api/health/ready")
+    assert response.status_code == 200, response.json()
+    assert response.json()["mongo"] is None
+    assert client.get("/api/health").json()["storage"] == {"backend": "memory"}
@@ -0,0 +1,93 @@
+import uuid
+from datetime import datetime
+
+from bson import Binary
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+
+from migrate_storage import Migration, compact_indexes
+from storage_schema import SCHEMAS
+
+IDS = [f"0b8a5a3e-3f7c-4c43-9d59-8b1f2f0c6a{n:02d}" for n in range(5)]
+
+
+class _Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class _Collection:
+    def __init__(self, documents=()):
+        self.documents = list(documents)
+        self.queries = []
+        self.batches = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return _Cursor(self.documents)
+
+    async def bulk_write(self, operations, **kwargs):
+        self.batches.append(operations)
+
+    async def distinct(self, key, query):
+        wanted = set(query[key]["$in"])
+        return [document[key] for document in self.documents if document.get(key) in wanted]
+
+
+def _migration(legacy, compact, batch_size=2):
+    return Migration({"single_calculator": legacy, "single_calculator_v2": compact},
+                     batch_size=batch_size, max_docs_per_second=0, settle_seconds=0)
+
+
+def test_backfill_inserts_missing_and_replaces_only_older_documents(run):
+    updated = datetime(2026, 1, 1)
+    legacy = _Collection([{"_id": n, "id": record_id, "user_id": "u1", "stake": 1.0, "updated_at": updated}
+                          for n, record_id in enumerate(IDS[:3])] + [{"_id": 9, "user_id": "u1"}])
+    compact = _Collection()
+    assert run(_migration(legacy, compact).backfill("single_calculator", since=updated)) == 3
+    assert legacy.queries == [{"updated_at": {"$gte": updated}}]
+
+    # Batches of two records, each an insert-if-missing and a replace-if-older
+    assert [len(batch) for batch in compact.batches] == [4, 2]
+    insert, replace = compact.batches[0][:2]
+    assert isinstance(insert, UpdateOne) and insert._upsert
+    assert insert._filter == {"_id": Binary.from_uuid(uuid.UUID(IDS[0]))}
+    assert set(insert._doc["$setOnInsert"]) == {"u", "s", "ua"}
+    assert isinstance(replace, ReplaceOne) and not replace._upsert
+    assert replace._filter == {"_id": insert._filter["_id"], "ua": {"$lt": updated}}
+
+
+def test_reconcile_deletes_compact_documents_gone_from_legacy(run):
+    schema = SCHEMAS["single_calculator"]
+    legacy = _Collection([{"id": record_id} for record_id in (IDS[0], IDS[2], IDS[4])])
+    stored = [schema.encode_id(record_id) for record_id in IDS]
+    compact = _Collection([{"_id": value} for value in stored])
+    assert run(_migration(legacy, compact).reconcile("single_calculator")) == 2
+    deletes = [operation for batch in compact.batches for operation in batch]
+    assert all(isinstance(operation, DeleteMany) for operation in deletes)
+    assert [operation._filter["_id"]["$in"] for operation in deletes] == [[stored[1]], [stored[3]]]
+
+
+def test_compact_indexes_translate_keys_and_skip_the_id_index():
+    indexes = compact_indexes(SCHEMAS["single_calculator"], {
+        "_id_": {"key": [("_id", 1)]},
+        "id_1": {"key": [("id", 1)], "unique": True},
+        "user_id_1_created_at_-1": {"key": [("user_id", 1), ("created_at", -1)]},
+        "by_match": {"key": [("user_id", 1), ("match_name", 1)], "sparse": True},
+    })
+    assert indexes == [
+        {"keys": [("u", 1), ("ca", -1)], "name": "u_1_ca_-1"},
+        {"keys": [("u", 1), ("m", 1)], "sparse": True, "name": "by_match"},
+    ]
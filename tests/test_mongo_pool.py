@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import mongo_pool
+from metrics import Histogram
+from mongo_pool import CommandMonitor, PoolMonitor, build_monitors, mongo_client_options
+
+
+def test_histogram_percentiles_are_bucket_upper_bounds():
+    histogram = Histogram(buckets=(1, 10, 100))
+    for value in (0.5, 0.5, 5, 50, 500):
+        histogram.observe(value)
+    assert histogram.percentile(40) == 1
+    assert histogram.percentile(60) == 10
+    assert histogram.percentile(99) == 500  # overflow bucket reports the max
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 5 and snapshot["max"] == 500 and snapshot["mean"] == 111.2
+    histogram.reset()
+    assert histogram.snapshot()["p50"] is None
+
+
+def test_pool_monitor_tracks_checkouts():
+    monitor = PoolMonitor(max_pool_size=4)
+    event = SimpleNamespace(reason="timeout")
+    for _ in range(2):
+        monitor.connection_created(event)
+    monitor.connection_check_out_started(event)
+    assert monitor.snapshot()["waiting"] == 1
+    monitor.connection_checked_out(event)
+    monitor.connection_check_out_started(event)
+    monitor.connection_check_out_failed(event)
+    monitor.pool_cleared(event)
+
+    snapshot = monitor.snapshot()
+    assert (snapshot["open"], snapshot["in_use"], snapshot["waiting"]) == (2, 1, 0)
+    assert snapshot["saturation"] == 0.25
+    assert snapshot["checkout_failures"] == {"timeout": 1} and snapshot["pool_cleared"] == 1
+    assert snapshot["checkout_wait_ms"]["count"] == 1
+
+    monitor.connection_checked_in(event)
+    monitor.connection_closed(event)
+    assert (monitor.snapshot()["in_use"], monitor.snapshot()["open"]) == (0, 1)
+
+
+def test_command_monitor_per_command_latency():
+    monitor = CommandMonitor()
+    monitor.succeeded(SimpleNamespace(command_name="find", duration_micros=2000))
+    monitor.failed(SimpleNamespace(command_name="find", duration_micros=4000))
+    snapshot = monitor.snapshot()["find"]
+    assert snapshot["count"] == 2 and snapshot["failures"] == 1 and snapshot["mean"] == 3.0
+
+
+def test_client_options_from_env(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "20")
+    monkeypatch.setenv("MONGO_MIN_POOL_SIZE", "")
+    monkeypatch.setenv("MONGO_READ_PREFERENCE", "secondaryPreferred")
+    monkeypatch.setenv("MONGO_COMPRESSORS", "zlib, nosuchcodec")
+    monkeypatch.setattr(mongo_pool, "_COMPRESSOR_MODULES", {"zlib": "zlib", "nosuchcodec": "no_such_module_here"})
+    options = mongo_client_options()
+    assert options["maxPoolSize"] == 20 and "minPoolSize" not in options
+    assert options["readPreference"] == "secondaryPreferred"
+    assert options["compressors"] == "zlib"  # a codec that can't be imported is dropped
+    pool_monitor, _ = build_monitors(options)
+    assert pool_monitor.max_pool_size == 20
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+from odds_feed import OddsFeed, OddsIndex, Throughput, Tick, file_source
+
+
+def _tick(outcome, bookmaker, odds, market_id="m1", match="Arsenal v Chelsea"):
+    return Tick.from_dict({"market_id": market_id, "match": match, "outcome": outcome,
+                           "bookmaker": bookmaker, "odds": odds, "ts": 1.0})
+
+
+def test_index_alerts_on_an_arbitrage_and_when_it_closes():
+    index = OddsIndex(alert_margin=0.0, min_change=0.5)
+    assert index.apply(_tick("A", "x", 2.10)) is None  # no B price yet
+    assert index.apply(_tick("B", "y", 1.70)) is None  # margin > 0
+
+    status, market = index.apply(_tick("B", "z", 2.05))
+    assert status == "open" and market.best["B"] == ("z", 2.05) and market.margin < 0
+    # Too small a move to re-alert, then a big enough one
+    assert index.apply(_tick("A", "w", 2.11)) is None
+    assert index.apply(_tick("A", "v", 2.30))[0] == "open"
+
+    # The best B quote is withdrawn: rescan falls back to y at 1.70 and the opportunity closes
+    status, market = index.apply(_tick("B", "z", 1.0))
+    assert status == "closed" and market.best["B"] == ("y", 1.70)
+    assert index.opportunities() == []
+
+
+def test_throughput_counts_whole_seconds_in_the_window():
+    throughput = Throughput(window_seconds=2)
+    throughput.add(4, now=100.2)
+    throughput.add(2, now=101.5)
+    throughput.add(10, now=102.1)  # current second, not counted yet
+    assert throughput.rate(now=102.5) == 3.0
+
+
+class _Manager:
+    def __init__(self):
+        self.sent = []
+
+    async def broadcast_to_user(self, message, user_id, relay=True):
+        self.sent.append((user_id, message["status"], message["market"]["market_id"], relay))
+
+
+def test_feed_replays_a_file_and_alerts_only_watchers(run, tmp_path):
+    ticks = [
+        {"market_id": "m1", "match": "Arsenal v Chelsea", "outcome": "A", "bookmaker": "x", "odds": 2.1},
+        {"market_id": "m1", "match": "Arsenal v Chelsea", "outcome": "B", "bookmaker": "y", "odds": 2.1},
+        {"market_id": "m2", "match": "Leeds v Hull", "outcome": "A", "bookmaker": "x", "odds": 2.1},
+        {"market_id": "m2", "match": "Leeds v Hull", "outcome": "B", "bookmaker": "y", "odds": 2.1},
+        {"market_id": "m3", "outcome": "C", "odds": 2.0},
+    ]
+    path = tmp_path / "ticks.ndjson"
+    path.write_text("\n".join(json.dumps(tick) for tick in ticks) + "\n")
+    manager = _Manager()
+    feed = OddsFeed(manager, OddsIndex(), source_spec=f"file:{path}")
+
+    async def scenario():
+        assert feed.watch("u1", ["  arsenal   V chelsea "]) == []
+        feed.start()
+        for _ in range(100):
+            if manager.sent:
+                break
+            await asyncio.sleep(0.01)
+        await feed.stop()
+
+    run(scenario())
+    assert manager.sent == [("u1", "open", "m1", False)]
+    assert feed.stats["ticks"] == 4 and feed.stats["invalid"] == 1
+    # Watching again hands back the current state at once
+    assert [market["market_id"] for market in feed.watch("u2", ["Leeds v Hull"])] == ["m2"]
+    feed.unwatch("u1")
+    assert feed.snapshot()["watched_matches"] == 1
+
+
+def test_file_source_paces_by_timestamp(run, tmp_path):
+    path = tmp_path / "ticks.ndjson"
+    path.write_text("\n".join(json.dumps({"ts": ts}) for ts in (0.0, 0.1, 0.2)))
+
+    async def replay():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        count = len([data async for data in file_source(str(path), speed=2.0)])
+        return count, loop.time() - started
+
+    count, elapsed = run(replay())
+    assert count == 3 and elapsed >= 0.09
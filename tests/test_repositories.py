@@ -0,0 +1,133 @@
+import json
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from repositories import (DuplicateRecord, DuplicateUser, InMemoryRecordRepository, InMemoryUserRepository,
+                          MongoRecordRepository, RECORDS, build_repositories)
+
+
+def _broker(record_id, user_id="u1", **fields):
+    document = {"id": record_id, "user_id": user_id, "account_name": f"Account {record_id}",
+                "account_type": "betfair", "balance": 100.0, "commission_rate": 2.0, "is_active": True}
+    document.update(fields)
+    return document
+
+
+def test_users_are_unique_by_username(run):
+    users = InMemoryUserRepository()
+    run(users.insert({"username": "alice", "email": "alice@example.com", "id": "1"}))
+    with pytest.raises(DuplicateUser):
+        run(users.insert({"username": "alice", "email": "other@example.com", "id": "2"}))
+    assert run(users.exists("bob", "alice@example.com"))
+    assert not run(users.exists("bob", "bob@example.com"))
+
+    found = run(users.find_by_username("alice"))
+    found["email"] = "changed"
+    assert run(users.find_by_username("alice"))["email"] == "alice@example.com"
+
+
+def test_records_keep_insertion_order_and_scope_by_user(run):
+    records = InMemoryRecordRepository(*RECORDS["broker"])
+    for record_id in ("a", "b", "c"):
+        run(records.save(_broker(record_id)))
+    run(records.save(_broker("x", user_id="u2")))
+    run(records.save(_broker("a", balance=5.0)))  # overwrite in place
+
+    listed = json.loads(run(records.list("u1", view="list")).body)
+    assert [(item["id"], item["balance"]) for item in listed] == [("a", 5.0), ("b", 100.0), ("c", 100.0)]
+    assert "user_id" not in listed[0]  # the list view's fields only
+
+
+def test_list_overlays_pending_saves(run):
+    records = InMemoryRecordRepository(*RECORDS["broker"])
+    run(records.save(_broker("a")))
+    listed = json.loads(run(records.list("u1", pending=[_broker("a", balance=7.0), _broker("b")])).body)
+    assert [(item["id"], item["balance"]) for item in listed] == [("a", 7.0), ("b", 100.0)]
+
+
+def test_find_update_delete(run):
+    records = InMemoryRecordRepository(*RECORDS["broker"])
+    run(records.save_many("u1", [_broker("a"), _broker("b", is_active=False), _broker("c", balance=50.0)]))
+
+    active = run(records.find("u1", {"is_active": True, "id": {"$in": ["a", "b", "c"]}}, ["id", "balance"]))
+    assert active == [{"id": "a", "balance": 100.0}, {"id": "c", "balance": 50.0}]
+
+    assert run(records.update(_broker("c", balance=60.0)))
+    assert not run(records.update(_broker("missing")))
+    assert not run(records.update(_broker("c", user_id="u2")))
+    assert run(records.delete("u1", "a"))
+    assert not run(records.delete("u1", "a"))
+    assert [doc["id"] for doc in run(records.find("u1"))] == ["b", "c"]
+
+
+def test_record_ids_are_unique_across_users(run):
+    records = InMemoryRecordRepository(*RECORDS["broker"])
+    run(records.save(_broker("a")))
+    with pytest.raises(DuplicateRecord):
+        run(records.save(_broker("a", user_id="u2")))
+    run(records.delete("u1", "a"))
+    run(records.save(_broker("a", user_id="u2")))  # free again once deleted
+
+
+class _Collection:
+    """The stored records by id, with the unique index ``_id`` gives them on Mongo."""
+
+    def __init__(self, documents=(), lose_race=False):
+        self.documents = {document["id"]: dict(document) for document in documents}
+        self.lose_race = lose_race
+
+    async def update_one(self, key, update, upsert=False, session=None):
+        stored = self.documents.get(key["id"])
+        if self.lose_race:
+            # Another save of the same record inserted it between our match and our insert
+            self.lose_race = False
+            self.documents[key["id"]] = dict(key)
+            raise DuplicateKeyError("E11000 duplicate key error")
+        if stored is not None and stored["user_id"] != key["user_id"]:
+            if upsert:
+                raise DuplicateKeyError("E11000 duplicate key error")
+            return SimpleNamespace(matched_count=0)
+        if stored is None and not upsert:
+            return SimpleNamespace(matched_count=0)
+        self.documents.setdefault(key["id"], {}).update(update["$set"])
+        return SimpleNamespace(matched_count=int(stored is not None))
+
+
+class _Router:
+    @asynccontextmanager
+    async def write_session(self, user_id):
+        yield None
+
+
+def _mongo_records(collection):
+    return MongoRecordRepository({"broker_accounts": collection}, _Router(), *RECORDS["broker"])
+
+
+def test_mongo_save_upserts_and_survives_a_concurrent_first_save(run):
+    collection = _Collection(lose_race=True)
+    run(_mongo_records(collection).save(_broker("a", balance=5.0)))
+    assert collection.documents["a"]["balance"] == 5.0
+
+
+def test_mongo_save_rejects_another_users_id(run):
+    collection = _Collection([_broker("a", user_id="u2")])
+    with pytest.raises(DuplicateRecord):
+        run(_mongo_records(collection).save(_broker("a")))
+    assert collection.documents["a"]["user_id"] == "u2"
+
+
+def test_backend_is_chosen_by_env(monkeypatch):
+    monkeypatch.setenv("STORAGE_BACKEND", "memory")
+    memory = build_repositories(None, None)
+    assert not memory.persistent and set(memory.records) == {"single", "pro", "broker"}
+
+    monkeypatch.setenv("STORAGE_BACKEND", "mongo")
+
+    class _Database:
+        users = object()
+
+    mongo = build_repositories(_Database(), None)
+    assert mongo.persistent and mongo.snapshot() == {"backend": "mongo"}
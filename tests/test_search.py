@@ -0,0 +1,34 @@
+from search import MatchSearch, PrefixIndex, fold
+
+
+def test_prefix_lookup_matches_any_word_start_folded():
+    index = PrefixIndex({"r1": "Atlético Madrid vs Sevilla", "r2": "Chelsea vs Arsenal"})
+    assert index.lookup("atle", 10) == ["Atlético Madrid vs Sevilla"]
+    assert index.lookup("ARS", 10) == ["Chelsea vs Arsenal"]
+    assert index.lookup("vs", 10) == ["Atlético Madrid vs Sevilla", "Chelsea vs Arsenal"]
+    assert fold("  Atlético  ") == "atletico"
+
+
+def test_autosaved_rename_keeps_only_the_latest_name():
+    search = MatchSearch(db=None)
+    search._indexes["u1"] = PrefixIndex({"old": "Chelsea vs Arsenal"})
+    for partial in ("Ars", "Arse", "Arsenal v", "Arsenal vs Spurs"):
+        search.record_saved("u1", "r1", partial)
+    index = search._indexes["u1"]
+    assert index.lookup("ars", 10) == ["Arsenal vs Spurs", "Chelsea vs Arsenal"]
+    assert not any(name in ("Ars", "Arse", "Arsenal v") for _, name in index.entries)
+
+
+def test_shared_name_survives_one_record_renamed():
+    index = PrefixIndex({"r1": "Chelsea vs Arsenal", "r2": "Chelsea vs Arsenal"})
+    index.set("r1", "Chelsea vs Spurs")
+    assert index.lookup("chelsea", 10) == ["Chelsea vs Arsenal", "Chelsea vs Spurs"]
+    index.set("r2", "")
+    assert index.lookup("chelsea", 10) == ["Chelsea vs Spurs"]
+
+
+def test_suggest_limit_is_clamped(run):
+    search = MatchSearch(db=None, limit=3)
+    search._indexes["u1"] = PrefixIndex({f"r{i}": f"Team {i} vs Rivals" for i in range(10)})
+    assert len(run(search.suggest("u1", "team", 1000))) == 3
+    assert len(run(search.suggest("u1", "team", -5))) == 1
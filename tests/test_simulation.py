@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from simulation import MonteCarloSimulator, SimulationError, bet_table
+
+HISTORY = [{"stake": 10.0, "odds": 2.2, "commission": 2.0}, {"stake": 25.0, "odds": 1.6, "commission": 0.0,
+                                                            "lay_stake": 24.0, "lay_odds": 1.65}]
+
+
+@pytest.fixture
+def pools():
+    executors = []
+
+    def make(workers):
+        executor = ThreadPoolExecutor(workers)
+        executors.append(executor)
+        return lambda: executor
+
+    yield make
+    for executor in executors:
+        executor.shutdown()
+
+
+def _without_timings(result):
+    return {key: value for key, value in result.items() if key not in ("cpu_seconds", "elapsed_ms")}
+
+
+def test_a_seed_gives_the_same_result_whatever_the_pool_size(run, pools):
+    bets = bet_table(HISTORY, [])
+    results = [
+        run(MonteCarloSimulator(pools(workers), chunk_paths=250).run(bets, 500.0, 1000, 200, seed=42))
+        for workers in (1, 4)
+    ]
+    assert _without_timings(results[0]) == _without_timings(results[1])
+    assert results[0]["seed"] == 42 and len(results[0]["curves"]["steps"]) == 51
+
+
+def test_an_all_losing_history_is_always_ruined(run, pools):
+    bets = np.array([[0.5, -10.0, -10.0]])
+    result = run(MonteCarloSimulator(pools(1)).run(bets, 100.0, 200, 50, seed=1))
+    assert result["risk_of_ruin"] == 1.0 and result["median_bets_to_ruin"] == 10
+    assert result["final"]["p95"] == 0.0
+
+
+def test_ruin_level_must_be_below_the_bankroll(run, pools):
+    with pytest.raises(SimulationError) as error:
+        run(MonteCarloSimulator(pools(1)).run(bet_table(HISTORY, []), 200.0, 100, 10, ruin_level=500.0))
+    assert error.value.status_code == 422
+
+
+def test_over_the_cpu_budget_is_a_422(run, pools):
+    simulator = MonteCarloSimulator(pools(1), cpu_seconds=0)
+    with pytest.raises(SimulationError) as error:
+        run(simulator.run(bet_table(HISTORY, []), 500.0, 1000, 100, seed=1))
+    assert error.value.status_code == 422 and simulator.stats["over_budget"] == 1
+
+
+def test_concurrent_simulations_over_the_cap_are_a_429(run, pools):
+    simulator = MonteCarloSimulator(pools(1), concurrency=1)
+
+    async def while_one_runs():
+        async with simulator.semaphore:
+            await simulator.run(bet_table(HISTORY, []), 500.0, 100, 10)
+
+    with pytest.raises(SimulationError) as error:
+        run(while_one_runs())
+    assert error.value.status_code == 429 and simulator.snapshot()["rejected"] == 1
@@ -0,0 +1,56 @@
+from collections import defaultdict
+
+from stake_solver import Account, solve_markets
+
+
+def _market(market_id, home, away):
+    return {
+        "market_id": market_id,
+        "outcomes": [
+            {"name": "home", "prices": [{"bookmaker": "alpha", "back": home}]},
+            {"name": "away", "prices": [{"bookmaker": "beta", "back": away}]},
+        ],
+    }
+
+
+def _accounts():
+    return [Account("a", "Alpha", "alpha", 100.0, 0.0), Account("b", "Beta", "beta", 80.0, 0.02)]
+
+
+def test_markets_share_the_balances():
+    accounts = _accounts()
+    results = solve_markets([_market("m1", 2.2, 2.2), _market("m2", 2.3, 2.1), _market("m3", 2.2, 2.25)], accounts)
+
+    assert results[0]["bets"], "the first market should be funded"
+    committed = defaultdict(float)
+    for result in results:
+        for bet in result["bets"]:
+            committed[bet["account_id"]] += bet["liability"]
+    for account in accounts:
+        assert committed[account.id] <= account.balance + 1e-9
+
+
+def test_first_market_gets_the_full_balances():
+    alone = solve_markets([_market("m1", 2.2, 2.2)], _accounts())[0]
+    first = solve_markets([_market("m1", 2.2, 2.2), _market("m2", 2.2, 2.2)], _accounts())[0]
+    assert first == alone
+    assert alone["capital"] > 150  # the binding account is close to fully used
+
+
+def test_lay_liability_counts_against_the_balance():
+    market = {
+        "market_id": "m1",
+        "outcomes": [
+            {"name": "home", "prices": [{"bookmaker": "alpha", "back": 2.4}, {"bookmaker": "beta", "lay": 2.0}]},
+            {"name": "away", "prices": [{"bookmaker": "beta", "back": 2.0}]},
+        ],
+    }
+    accounts = _accounts()
+    results = solve_markets([market, market], accounts)
+    committed = defaultdict(float)
+    for result in results:
+        for bet in result["bets"]:
+            committed[bet["account_id"]] += bet["liability"]
+    assert committed
+    for account in accounts:
+        assert committed[account.id] <= account.balance + 1e-9
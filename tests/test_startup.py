@@ -0,0 +1,20 @@
+import importlib.util
+from pathlib import Path
+
+BENCH = Path(__file__).resolve().parent.parent / "backend" / "benchmarks" / "bench_startup.py"
+_spec = importlib.util.spec_from_file_location("bench_startup", BENCH)
+bench_startup = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench_startup)
+
+
+def test_cold_start_defers_heavy_imports():
+    # A fresh interpreter: import server, run the startup hooks, serve one request
+    result = bench_startup.cold_start_once(bench_startup.LAZY_MODULES)
+    assert result["loaded_lazy_modules"] == []
+    assert result["first_request_ms"] < 1000
+
+
+def test_password_helpers_load_passlib_on_first_use(server):
+    hashed = server.get_password_hash("secret")
+    assert server.verify_password("secret", hashed)
+    assert not server.verify_password("wrong", hashed)
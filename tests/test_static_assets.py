@@ -0,0 +1,122 @@
+import gzip
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from static_assets import IMMUTABLE_CACHE, FrontendMount, StaticAssets, build_index, resolve_build_dir
+
+SCRIPT = "console.log('hello');\n" * 100
+
+
+def _write(path: Path, text: str = "x"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def test_repo_root_is_never_served(tmp_path, monkeypatch):
+    monkeypatch.delenv("FRONTEND_BUILD_DIR", raising=False)
+    _write(tmp_path / "index.html")
+    _write(tmp_path / "backend" / "server.py")
+    assert resolve_build_dir(tmp_path / "backend") is None
+
+    monkeypatch.setenv("FRONTEND_BUILD_DIR", "..")
+    assert resolve_build_dir(tmp_path / "backend") is None
+
+
+def test_frontend_build_is_served(tmp_path, monkeypatch):
+    monkeypatch.delenv("FRONTEND_BUILD_DIR", raising=False)
+    _write(tmp_path / "frontend" / "build" / "index.html")
+    assert resolve_build_dir(tmp_path / "backend").resolve() == (tmp_path / "frontend" / "build").resolve()
+
+
+def test_cpanel_layout_serves_parent_of_api(tmp_path, monkeypatch):
+    _write(tmp_path / "index.html")
+    _write(tmp_path / "api" / "server.py")
+    monkeypatch.setenv("FRONTEND_BUILD_DIR", "..")
+    assert resolve_build_dir(tmp_path / "api").resolve() == tmp_path.resolve()
+
+
+def test_index_skips_dot_paths_and_api(tmp_path):
+    for name in ("index.html", "static/main.js", ".env", ".git/config", "static/.cache/x.js", "api/server.py"):
+        _write(tmp_path / name)
+    assert set(build_index(tmp_path)) == {"/index.html", "/static/main.js"}
+
+
+@pytest.fixture
+def build(tmp_path):
+    _write(tmp_path / "index.html", "<html>app</html>")
+    _write(tmp_path / "static" / "js" / "main.e97ef36a.js", SCRIPT)
+    (tmp_path / "static" / "js" / "main.e97ef36a.js.gz").write_bytes(gzip.compress(SCRIPT.encode()))
+    _write(tmp_path / "robots.txt", "User-agent: *")
+    return tmp_path
+
+
+def test_hashed_assets_are_immutable_and_the_shell_revalidates(build):
+    client = TestClient(StaticAssets(build))
+    script = client.get("/static/js/main.e97ef36a.js", headers={"Accept-Encoding": "identity"})
+    assert script.status_code == 200 and script.text == SCRIPT
+    assert script.headers["cache-control"] == IMMUTABLE_CACHE and script.headers["vary"] == "Accept-Encoding"
+    shell = client.get("/")
+    assert shell.text == "<html>app</html>" and shell.headers["cache-control"] == "no-cache"
+    assert "vary" not in shell.headers
+
+
+def test_unknown_routes_fall_back_to_the_shell_but_missing_files_do_not(build):
+    client = TestClient(StaticAssets(build))
+    assert client.get("/dashboard/bets").text == "<html>app</html>"
+    missing = client.get("/static/js/missing.js")
+    assert missing.status_code == 404 and missing.json() == {"detail": "Not Found"}
+
+
+def test_etag_revalidation_answers_304(build):
+    client = TestClient(StaticAssets(build))
+    etag = client.get("/robots.txt").headers["etag"]
+    assert client.get("/robots.txt", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/robots.txt", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    assert client.get("/robots.txt", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_the_client_gets_the_encoding_it_accepts(build):
+    client = TestClient(StaticAssets(build))
+    gzipped = client.get("/static/js/main.e97ef36a.js", headers={"Accept-Encoding": "br, gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip" and gzipped.text == SCRIPT
+    identity = client.get("/static/js/main.e97ef36a.js", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in identity.headers
+    # Each encoding has its own ETag, so caches never mix them up
+    assert gzipped.headers["etag"] != identity.headers["etag"]
+
+
+def test_brotli_is_preferred_when_present(build):
+    brotli = pytest.importorskip("brotli")
+    (build / "static" / "js" / "main.e97ef36a.js.br").write_bytes(brotli.compress(SCRIPT.encode()))
+    response = TestClient(StaticAssets(build)).get("/static/js/main.e97ef36a.js",
+                                                   headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br" and response.text == SCRIPT
+
+
+def test_ranges_are_served_from_the_identity_body(build):
+    client = TestClient(StaticAssets(build))
+    partial = client.get("/robots.txt", headers={"Range": "bytes=0-9", "Accept-Encoding": "gzip"})
+    assert partial.status_code == 206 and partial.content == b"User-agent"
+    assert partial.headers["content-range"] == "bytes 0-9/13"
+    assert client.get("/robots.txt", headers={"Range": "bytes=-1"}).content == b"*"
+    unsatisfiable = client.get("/robots.txt", headers={"Range": "bytes=100-"})
+    assert unsatisfiable.status_code == 416 and unsatisfiable.headers["content-range"] == "bytes */13"
+
+
+def test_api_paths_and_methods_are_left_to_the_app(build):
+    app = FastAPI()
+
+    @app.post("/api/items")
+    async def create_item():
+        return {"ok": True}
+
+    app.router.routes.append(FrontendMount("/", app=StaticAssets(build), name="frontend"))
+    client = TestClient(app)
+    assert client.get("/api/items").status_code == 405  # not the shell, and not the mount's 405
+    assert client.post("/api/items").json() == {"ok": True}
+    assert client.delete("/api/missing").status_code == 404
+    assert client.get("/ws/anything").status_code == 404
+    assert client.get("/dashboard").text == "<html>app</html>"
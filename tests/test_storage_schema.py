@@ -0,0 +1,168 @@
+import uuid
+from datetime import datetime
+
+from bson import Binary, Decimal128
+from pymongo import DeleteMany, InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import PyMongoError
+
+from storage_schema import SCHEMAS, SchemaCollection, SchemaRegistry, compact_name, decode_value
+
+SCHEMA = SCHEMAS["single_calculator"]
+RECORD_ID = "0b8a5a3e-3f7c-4c43-9d59-8b1f2f0c6a11"
+STORED_ID = Binary.from_uuid(uuid.UUID(RECORD_ID))
+
+
+def test_filter_encodes_ids_under_operators():
+    assert SCHEMA.filter({"id": RECORD_ID, "user_id": "u1"}) == {"_id": STORED_ID, "u": "u1"}
+    assert SCHEMA.filter({"id": {"$in": [RECORD_ID, "legacy-id"]}}) == {"_id": {"$in": [STORED_ID, "legacy-id"]}}
+    assert SCHEMA.filter({"id": {"$ne": RECORD_ID}}) == {"_id": {"$ne": STORED_ID}}
+    # Only canonical UUID strings become binary
+    assert SCHEMA.filter({"id": RECORD_ID.upper()}) == {"_id": RECORD_ID.upper()}
+
+
+def test_filter_recurses_into_logical_operators_and_expressions():
+    query = {"$or": [{"match_name": "A v B"}, {"$and": [{"id": RECORD_ID}, {"stake": {"$gt": 5}}]}],
+             "$expr": {"$gt": ["$potential_profit", {"$multiply": ["$stake", "$$factor"]}]},
+             "$comment": "kept"}
+    assert SCHEMA.filter(query) == {
+        "$or": [{"m": "A v B"}, {"$and": [{"_id": STORED_ID}, {"s": {"$gt": 5}}]}],
+        "$expr": {"$gt": ["$pp", {"$multiply": ["$s", "$$factor"]}]},
+        "$comment": "kept",
+    }
+    assert SCHEMA.expression({"$literal": "$stake"}) == {"$literal": "$stake"}
+
+
+def test_projection_handles_id_both_ways():
+    # v1 {"_id": 0} is every stored field
+    assert SCHEMA.projection({"_id": 0}) is None
+    # Including fields without id hides _id, since _id is the id now
+    assert SCHEMA.projection({"_id": 0, "match_name": 1, "stake": 1}) == {"m": 1, "s": 1, "_id": 0}
+    assert SCHEMA.projection(["id", "stake"]) == {"_id": 1, "s": 1}
+    # Excluding keeps _id unless id itself is excluded
+    assert SCHEMA.projection({"_id": 0, "odds": 0}) == {"o": 0}
+    assert SCHEMA.projection({"id": 0, "odds": 0}) == {"_id": 0, "o": 0}
+
+
+def test_update_renames_fields_and_never_sets_id():
+    update = {"$set": {"id": RECORD_ID, "stake": 12.1, "match_name": "A v B"},
+              "$setOnInsert": {"created_at": "t"}, "$inc": {"odds": 1}}
+    assert SCHEMA.update(update) == {"$set": {"s": Decimal128("12.1"), "m": "A v B"},
+                                     "$setOnInsert": {"ca": "t"}, "$inc": {"o": 1}}
+    # A replacement document is encoded whole
+    assert SCHEMA.update({"id": RECORD_ID, "stake": 1.0}) == {"_id": STORED_ID, "s": Decimal128("1.0")}
+
+
+def test_bulk_operations_are_translated():
+    update, replace, insert, delete = (SCHEMA.operation(operation) for operation in (
+        UpdateOne({"id": RECORD_ID, "user_id": "u1"}, {"$set": {"stake": 2.5}}, upsert=True),
+        ReplaceOne({"id": RECORD_ID}, {"id": RECORD_ID, "odds": 2.0}),
+        InsertOne({"_id": "an ObjectId", "id": RECORD_ID, "user_id": "u1"}),
+        DeleteMany({"user_id": "u1", "id": {"$in": [RECORD_ID]}}),
+    ))
+    assert isinstance(update, UpdateOne) and update._upsert
+    assert update._filter == {"_id": STORED_ID, "u": "u1"} and update._doc == {"$set": {"s": Decimal128("2.5")}}
+    assert isinstance(replace, ReplaceOne) and replace._doc == {"_id": STORED_ID, "o": 2.0}
+    assert insert._doc == {"_id": STORED_ID, "u": "u1"}
+    assert isinstance(delete, DeleteMany) and delete._filter == {"u": "u1", "_id": {"$in": [STORED_ID]}}
+
+
+def test_pipeline_matches_on_stored_names_then_decodes():
+    pipeline = SCHEMA.pipeline([
+        {"$match": {"user_id": "u1"}},
+        {"$match": {"id": {"$in": [RECORD_ID]}}},
+        {"$group": {"_id": "$match_name", "staked": {"$sum": "$stake"}}},
+    ], lambda name: None)
+    assert pipeline[:2] == [{"$match": {"u": "u1"}}, {"$match": {"_id": {"$in": [STORED_ID]}}}]
+    decode = pipeline[2]["$project"]
+    assert decode["_id"] == 0 and decode["id"] == "$_id" and decode["stake"] == {"$toDouble": "$s"}
+    # Later stages see v1 names, untouched
+    assert pipeline[3] == {"$group": {"_id": "$match_name", "staked": {"$sum": "$stake"}}}
+
+
+def test_pipeline_points_lookups_at_compact_collections():
+    resolve = lambda name: (SCHEMAS[name], compact_name(name)) if name == "broker_accounts" else None
+    stage = SCHEMA.pipeline([{"$lookup": {"from": "broker_accounts", "localField": "user_id",
+                                          "foreignField": "user_id", "as": "accounts"}}], resolve)[1]
+    assert stage["$lookup"]["from"] == "broker_accounts_v2" and stage["$lookup"]["foreignField"] == "u"
+    assert stage["$lookup"]["pipeline"][0] == SCHEMAS["broker_accounts"].decode_stage()
+
+
+def test_documents_round_trip_through_the_compact_form():
+    document = {"_id": "legacy ObjectId", "id": RECORD_ID, "user_id": "u1", "match_name": "A v B",
+                "stake": 0.1 + 0.2, "odds": 2.1, "created_at": datetime(2026, 1, 1), "notes": ["x"]}
+    encoded = SCHEMA.encode(document)
+    assert encoded["_id"] == STORED_ID and isinstance(encoded["s"], Decimal128) and encoded["notes"] == ["x"]
+    decoded = SCHEMA.decode(encoded)
+    assert decoded == {name: value for name, value in document.items() if name != "_id"}
+    assert decode_value({"nested": [STORED_ID, Decimal128("1.5")]}) == {"nested": [RECORD_ID, 1.5]}
+
+
+class _Result:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Collection:
+    def __init__(self, name, calls, documents=(), fail=False):
+        self.name, self.calls, self.documents, self.fail = name, calls, list(documents), fail
+
+    def __getattr__(self, operation):
+        async def call(*args, **kwargs):
+            if self.fail:
+                raise PyMongoError("compact collection unavailable")
+            self.calls.append((self.name, operation, args))
+            return _Result(self.name)
+        return call
+
+    def find(self, filter=None, projection=None, **kwargs):
+        self.calls.append((self.name, "find", (filter, projection)))
+        return _Cursor(self.documents)
+
+
+class _Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def limit(self, count):
+        return self
+
+    async def to_list(self, length):
+        return list(self.documents)
+
+
+def _collection(state, compact_documents=(), compact_fails=False):
+    calls = []
+    db = {"single_calculator": _Collection("single_calculator", calls),
+          "single_calculator_v2": _Collection("single_calculator_v2", calls, compact_documents, compact_fails)}
+    registry = SchemaRegistry(db)
+    registry.states, registry._loaded = {"single_calculator": state}, True
+    return SchemaCollection(db, "single_calculator", registry), calls
+
+
+def test_writes_follow_the_migration_state(run):
+    key, update = {"id": RECORD_ID, "user_id": "u1"}, {"$set": {"stake": 3.0}}
+    collection, calls = _collection("legacy")
+    run(collection.update_one(key, update))
+    assert calls == [("single_calculator", "update_one", (key, update))]
+
+    collection, calls = _collection("migrating")
+    assert run(collection.update_one(key, update)).name == "single_calculator"
+    assert calls[1] == ("single_calculator_v2", "update_one",
+                        ({"_id": STORED_ID, "u": "u1"}, {"$set": {"s": Decimal128("3.0")}}))
+
+    collection, calls = _collection("compact")
+    run(collection.delete_one(key))
+    assert calls == [("single_calculator_v2", "delete_one", ({"_id": STORED_ID, "u": "u1"},))]
+
+
+def test_a_failed_mirror_write_is_counted_not_raised(run):
+    collection, calls = _collection("cutover", compact_fails=True)
+    assert run(collection.insert_one({"id": RECORD_ID, "user_id": "u1"})).name == "single_calculator"
+    assert collection.registry.stats["dual_write_errors"] == 1
+
+
+def test_reads_after_cutover_decode_compact_documents(run):
+    collection, calls = _collection("cutover", [{"_id": STORED_ID, "u": "u1", "s": Decimal128("12.1")}])
+    document = run(collection.find_one({"id": RECORD_ID}, {"_id": 0}))
+    assert document == {"id": RECORD_ID, "user_id": "u1", "stake": 12.1}
+    assert calls == [("single_calculator_v2", "find", ({"_id": STORED_ID}, None))]
@@ -0,0 +1,86 @@
+import io
+import json
+import logging
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from structured_logging import (REQUEST_ID_HEADER, AccessLogMiddleware, LoggingSetup, LogSampler, RateCap,
+                                current_request_id, parse_sample_rates, request_id_var)
+
+
+def _record(level=logging.INFO, msg="hello %s", args=("world",)):
+    return logging.LogRecord("test", level, __file__, 1, msg, args, None)
+
+
+def test_records_are_written_as_json_by_the_listener_thread():
+    stream = io.StringIO()
+    setup = LoggingSetup(stream=stream)
+    logger = logging.getLogger("test_structured_logging.listener")
+    logger.addHandler(setup.handler)
+    logger.propagate = False
+    setup.listener.start()
+    token = request_id_var.set("req-1")
+    try:
+        logger.warning("saved %s records", 3, extra={"user_id": "u1"})
+    finally:
+        request_id_var.reset(token)
+        setup.stop()
+        logger.removeHandler(setup.handler)
+
+    entry = json.loads(stream.getvalue())
+    assert entry["message"] == "saved 3 records" and entry["level"] == "WARNING"
+    assert entry["request_id"] == "req-1" and entry["user_id"] == "u1"
+
+
+def test_rate_cap_drops_over_the_limit_but_never_errors(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("structured_logging.time.monotonic", lambda: now[0])
+    cap = RateCap(per_second=2)
+    assert [cap.filter(_record()) for _ in range(4)] == [True, True, False, False]
+    assert cap.filter(_record(logging.ERROR))
+
+    now[0] = 101.0
+    record = _record()
+    assert cap.filter(record) and record.dropped_previous_second == 2
+    assert cap.dropped == 2
+
+
+def test_sampler_uses_the_longest_matching_prefix():
+    rates = parse_sample_rates("/api=0.5, /api/health=0,/ws=7")
+    assert rates[0] == ("/api/health", 0.0) and ("/ws", 1.0) in rates
+    sampler = LogSampler(rates, default_rate=1.0)
+    assert sampler.rate_for("/api/health/live") == 0.0
+    assert sampler.rate_for("/api/auth/me") == 0.5
+    assert sampler.rate_for("/other") == 1.0
+    assert not sampler.sample("/api/health/live") and sampler.sampled_out == 1
+
+
+def _app():
+    async def ok(request):
+        return PlainTextResponse(current_request_id())
+
+    async def fail(request):
+        return PlainTextResponse("no", status_code=503)
+
+    app = Starlette(routes=[Route("/ok", ok), Route("/fail", fail)])
+    return TestClient(AccessLogMiddleware(app, LogSampler([], default_rate=0.0)))
+
+
+def test_middleware_assigns_and_echoes_request_ids(caplog):
+    client = _app()
+    response = client.get("/ok", headers={REQUEST_ID_HEADER: "from-caller"})
+    assert response.text == "from-caller" and response.headers[REQUEST_ID_HEADER] == "from-caller"
+
+    response = client.get("/ok")
+    assert len(response.text) == 32 and response.headers[REQUEST_ID_HEADER] == response.text
+
+
+def test_middleware_always_logs_server_errors(caplog):
+    client = _app()
+    with caplog.at_level(logging.INFO, logger="access"):
+        client.get("/ok")
+        client.get("/fail")
+    assert [record.status for record in caplog.records if record.name == "access"] == [503]
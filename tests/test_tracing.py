@@ -0,0 +1,141 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from starlette.testclient import TestClient
+
+from tracing import (CLIENT, FileExporter, InMemoryExporter, Span, Tracer, TracingCommandListener,
+                     TracingMiddleware, build_exporter, current_span, parse_traceparent)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+def test_parse_traceparent():
+    assert parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01") == (TRACE_ID, PARENT_ID, True)
+    assert parse_traceparent(f" 00-{TRACE_ID}-{PARENT_ID}-00 ") == (TRACE_ID, PARENT_ID, False)
+    for header in (None, "", f"00-{TRACE_ID}-{PARENT_ID}", f"00-{TRACE_ID[:-1]}-{PARENT_ID}-01",
+                   f"00-{'0' * 32}-{PARENT_ID}-01", f"00-{TRACE_ID}-{PARENT_ID}-zz"):
+        assert parse_traceparent(header) is None
+
+
+def test_an_incoming_sampled_flag_overrides_the_sample_rate():
+    never, always = Tracer(InMemoryExporter(), sample_rate=0.0), Tracer(InMemoryExporter(), sample_rate=1.0)
+    with never.trace("GET /", f"00-{TRACE_ID}-{PARENT_ID}-01") as span:
+        assert span.trace_id == TRACE_ID and span.parent_id == PARENT_ID
+    with always.trace("GET /", f"00-{TRACE_ID}-{PARENT_ID}-00") as span:
+        assert span is None
+    with never.trace("GET /") as span:
+        assert span is None
+    with always.trace("GET /") as span:
+        assert len(span.trace_id) == 32 and span.parent_id is None
+    assert never.stats["traces"] == always.stats["traces"] == 1
+    with Tracer(None, sample_rate=1.0).trace("GET /", f"00-{TRACE_ID}-{PARENT_ID}-01") as span:
+        assert span is None  # no exporter: tracing is off
+
+
+def test_spans_nest_inside_a_trace_and_are_no_ops_outside():
+    tracer = Tracer(InMemoryExporter(), sample_rate=1.0)
+    with tracer.span("outside") as span:
+        assert span is None
+    assert tracer.start_child("outside") is None
+
+    with pytest.raises(ValueError):
+        with tracer.trace("GET /") as root:
+            with tracer.span("child", user="u1") as child:
+                assert current_span.get() is child
+                raise ValueError("boom")
+    assert current_span.get() is None
+    assert child.parent_id == root.span_id and child.error == "ValueError: boom"
+    tracer.flush()
+    assert [span.name for span in tracer.exporter.spans] == ["child", "GET /"]
+
+
+def _event(request_id, **fields):
+    return SimpleNamespace(request_id=request_id, connection_id=("db", 27017), **fields)
+
+
+def test_command_listener_parents_and_ends_mongo_spans():
+    tracer = Tracer(InMemoryExporter(), sample_rate=1.0)
+    listener = TracingCommandListener(tracer)
+    listener.started(_event(0, command_name="find", database_name="app", command={"find": "jobs"}))
+    assert listener._open == {}  # outside a trace
+
+    with tracer.trace("GET /") as root:
+        listener.started(_event(1, command_name="find", database_name="app", command={"find": "jobs"}))
+        listener.started(_event(2, command_name="insert", database_name="app", command={"insert": "jobs"}))
+    listener.succeeded(_event(1))
+    listener.failed(_event(2, failure={"errmsg": "duplicate key"}))
+    listener.succeeded(_event(3))  # never started: ignored
+    tracer.flush()
+
+    spans = {span.name: span for span in tracer.exporter.spans}
+    find, insert = spans["mongodb.find"], spans["mongodb.insert"]
+    assert find.parent_id == insert.parent_id == root.span_id and find.kind == CLIENT
+    assert find.attributes["db.mongodb.collection"] == "jobs" and find.attributes["server.address"] == "db:27017"
+    assert find.error is None and insert.error == "duplicate key" and listener._open == {}
+
+
+def test_middleware_names_the_root_span_by_route_and_flags_server_errors():
+    tracer = Tracer(InMemoryExporter(), sample_rate=1.0)
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        if item_id == "broken":
+            raise HTTPException(status_code=503, detail="down")
+        return {"id": item_id}
+
+    client = TestClient(TracingMiddleware(app, tracer))
+    client.get("/items/a1")
+    client.get("/items/broken")
+    tracer.flush()
+
+    ok, broken = tracer.exporter.spans
+    assert ok.name == "GET /items/{item_id}" and ok.attributes["http.target"] == "/items/a1"
+    assert ok.attributes["http.status_code"] == 200 and ok.error is None
+    assert broken.attributes["http.status_code"] == 503 and broken.error == "HTTP 503"
+
+
+def _span(trace_id, name, start_ns, end_ns, parent_id=None):
+    span = Span(trace_id, parent_id, name)
+    span.start_ns, span.end_ns = start_ns, end_ns
+    return span
+
+
+def test_memory_exporter_groups_the_most_recent_traces():
+    exporter = InMemoryExporter()
+    root = _span("t1", "GET /a", 1_000_000, 5_000_000)
+    exporter.export([_span("t1", "mongodb.find", 2_000_000, 3_000_000, root.span_id), root,
+                     _span("t2", "GET /b", 6_000_000, 7_000_000)], "svc")
+
+    newest, oldest = exporter.traces()
+    assert newest["trace_id"] == "t2" and oldest["trace_id"] == "t1"
+    assert oldest["duration_ms"] == 4.0
+    assert [(span["name"], span["start_offset_ms"]) for span in oldest["spans"]] == [
+        ("GET /a", 0.0), ("mongodb.find", 1.0)]
+    assert [trace["trace_id"] for trace in exporter.traces(limit=1)] == ["t2"]
+
+
+def test_file_exporter_appends_otlp_json_lines(tmp_path):
+    path = tmp_path / "spans.ndjson"
+    exporter = build_exporter(f"file:{path}")
+    assert isinstance(exporter, FileExporter)
+    span = _span(TRACE_ID, "GET /", 1, 2, PARENT_ID)
+    span.attributes = {"http.status_code": 200, "cached": True, "ratio": 0.5, "route": "/"}
+    span.error = "HTTP 500"
+    exporter.export([span], "svc")
+    exporter.export([span], "svc")
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2
+    resource = json.loads(lines[0])["resourceSpans"][0]
+    assert resource["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "svc"}}]
+    exported = resource["scopeSpans"][0]["spans"][0]
+    assert exported["traceId"] == TRACE_ID and exported["parentSpanId"] == PARENT_ID
+    assert exported["startTimeUnixNano"] == "1" and exported["status"] == {"code": 2, "message": "HTTP 500"}
+    assert [attribute["value"] for attribute in exported["attributes"]] == [
+        {"intValue": "200"}, {"boolValue": True}, {"doubleValue": 0.5}, {"stringValue": "/"}]
+    with pytest.raises(ValueError):
+        build_exporter("jaeger:localhost")
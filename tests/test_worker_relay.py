@@ -0,0 +1,40 @@
+import asyncio
+
+from worker_relay import MAX_DATAGRAM_BYTES, BroadcastRelay
+
+
+def test_relay_is_off_for_a_single_worker():
+    relay = BroadcastRelay("/tmp", index=0, workers=1)
+    assert not relay.enabled and relay.peers == []
+    relay.publish("u1", "{}")  # never started: a no-op
+    assert relay.stats["sent"] == 0
+
+
+def test_broadcasts_reach_running_peers_and_count_missing_ones(run, tmp_path):
+    directory = str(tmp_path)
+    sender, receiver = BroadcastRelay(directory, 0, 3), BroadcastRelay(directory, 1, 3)  # worker 2 is down
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        delivered = []
+        got = asyncio.Event()
+
+        def deliver(user_id, message):
+            delivered.append((user_id, message))
+            got.set()
+
+        sender.start(loop, lambda user_id, message: None)
+        receiver.start(loop, deliver)
+        try:
+            sender.publish("u1", '{"type": "data_update"}')
+            sender.publish("u1", "x" * MAX_DATAGRAM_BYTES)
+            await asyncio.wait_for(got.wait(), 2)
+        finally:
+            sender.stop()
+            receiver.stop()
+        return delivered
+
+    assert run(scenario()) == [("u1", '{"type": "data_update"}')]
+    assert sender.stats == {"sent": 1, "received": 0, "delivered": 0, "dropped": 1 + 2}
+    assert receiver.stats["received"] == 1
+    assert list(tmp_path.iterdir()) == []  # sockets removed on stop
@@ -0,0 +1,58 @@
+import asyncio
+
+from write_behind import WriteBehindBuffer
+
+
+class _SlowCollection:
+    """bulk_write that waits for the test to let it finish (or fail)."""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.fail = False
+        self.written = []
+
+    async def bulk_write(self, operations, ordered=True):
+        await self.release.wait()
+        if self.fail:
+            raise ConnectionError("mongo went away")
+        self.written.extend(operations)
+
+
+def _record(record_id, stake):
+    return {"id": record_id, "user_id": "u1", "stake": stake}
+
+
+def test_pending_for_sees_saves_while_their_flush_is_in_flight(run):
+    async def scenario():
+        collection = _SlowCollection()
+        buffer = WriteBehindBuffer({"single_calculator": collection}, enabled=True)
+        buffer.enqueue("single_calculator", _record("a", 1))
+        flush = asyncio.ensure_future(buffer.flush())
+        await asyncio.sleep(0)
+        assert buffer.pending_for("single_calculator", "u1") == [_record("a", 1)]
+
+        # A newer save made during the flush is what reads should see
+        buffer.enqueue("single_calculator", _record("a", 2))
+        assert buffer.pending_for("single_calculator", "u1") == [_record("a", 2)]
+
+        collection.release.set()
+        await flush
+        assert buffer.snapshot()["inflight"] == 0
+        assert buffer.pending_for("single_calculator", "u1") == [_record("a", 2)]
+        assert len(collection.written) == 1
+
+    run(scenario())
+
+
+def test_failed_flush_is_requeued_and_still_visible(run):
+    async def scenario():
+        collection = _SlowCollection()
+        collection.fail = True
+        collection.release.set()
+        buffer = WriteBehindBuffer({"single_calculator": collection}, enabled=True)
+        buffer.enqueue("single_calculator", _record("a", 1))
+        await buffer.flush()
+        assert buffer.pending_for("single_calculator", "u1") == [_record("a", 1)]
+        assert buffer.snapshot()["pending"] == 1 and buffer.snapshot()["failures"] == 1
+
+    run(scenario())
@@ -0,0 +1,112 @@
+import json
+import time
+import uuid
+from datetime import timedelta
+
+
+def _frames_until(websocket, frame_type):
+    """Frames received up to and including the first of ``frame_type``."""
+    frames = []
+    while True:
+        frames.append(json.loads(websocket.receive_text()))
+        if frames[-1]["type"] == frame_type:
+            return frames
+
+
+def _connect(client, user):
+    websocket = client.websocket_connect(f"/ws/{user['id']}")
+    socket = websocket.__enter__()
+    assert json.loads(socket.receive_text())["type"] == "connection"
+    return websocket, socket
+
+
+def test_commands_need_auth_first(client, user):
+    with client.websocket_connect(f"/ws/{user['id']}") as websocket:
+        websocket.receive_text()
+        websocket.send_text(json.dumps({"type": "list", "id": "c1", "kind": "single"}))
+        reply = json.loads(websocket.receive_text())
+        assert reply == {"type": "reply", "id": "c1", "ok": False, "status": 401, "error": "Send an auth message first"}
+
+        websocket.send_text(json.dumps({"type": "auth", "token": "not-a-jwt"}))
+        assert json.loads(websocket.receive_text())["ok"] is False
+
+
+def test_save_replies_to_sender_and_broadcasts_to_other_sockets(client, user):
+    sender_context, sender = _connect(client, user)
+    watcher_context, watcher = _connect(client, user)
+    try:
+        sender.send_text(json.dumps({"type": "auth", "token": user["token"]}))
+        # The watcher's welcome goes to every socket of the user, so skip past it
+        assert _frames_until(sender, "auth")[-1]["ok"] is True
+
+        record = {"id": str(uuid.uuid4()), "match_name": "Arsenal vs Chelsea", "stake": 10.0, "odds": 2.2,
+                  "commission": 2.0, "potential_profit": 11.76}
+        sender.send_text(json.dumps({"type": "save", "id": "c1", "kind": "single", "data": record}))
+        reply = _frames_until(sender, "reply")[-1]
+        assert reply["id"] == "c1" and reply["ok"] is True
+        assert reply["data"]["id"] == record["id"] and reply["data"]["user_id"] == user["id"]
+
+        update = _frames_until(watcher, "data_update")[-1]
+        assert update["action"] == "save" and update["data"]["id"] == record["id"]
+        # The broadcast carries the command's request id, so clients can tie it to their reply
+        assert update["request_id"] == reply["request_id"]
+
+        sender.send_text(json.dumps({"type": "list", "id": "c2", "kind": "single", "view": "list"}))
+        listed = _frames_until(sender, "reply")[-1]
+        assert [item["id"] for item in listed["data"]] == [record["id"]]
+    finally:
+        watcher_context.__exit__(None, None, None)
+        sender_context.__exit__(None, None, None)
+
+
+def test_command_errors_keep_the_id(client, user):
+    with client.websocket_connect(f"/ws/{user['id']}") as websocket:
+        websocket.receive_text()
+        websocket.send_text(json.dumps({"type": "auth", "token": user["token"]}))
+        websocket.receive_text()
+
+        websocket.send_text(json.dumps({"type": "delete", "id": "c1", "kind": "broker", "record_id": "missing"}))
+        assert _frames_until(websocket, "reply")[-1] == {
+            "type": "reply", "id": "c1", "ok": False, "status": 404, "error": "Account not found"}
+
+        websocket.send_text(json.dumps({"type": "save", "id": "c2", "kind": "nope", "data": {}}))
+        assert _frames_until(websocket, "reply")[-1]["status"] == 400
+
+        websocket.send_text(json.dumps({"type": "save", "id": "c3", "kind": "single", "data": {"stake": "lots"}}))
+        reply = _frames_until(websocket, "reply")[-1]
+        assert reply["id"] == "c3" and reply["status"] == 422
+
+        for data in (["not", "an", "object"], "text"):
+            websocket.send_text(json.dumps({"type": "save", "id": "c4", "kind": "single", "data": data}))
+            assert _frames_until(websocket, "reply")[-1] == {
+                "type": "reply", "id": "c4", "ok": False, "status": 422, "error": "data must be an object"}
+
+
+def test_commands_stop_when_the_token_expires(client, user, server):
+    from jose import jwt
+
+    token = server.create_access_token({"sub": user["username"]}, expires_delta=timedelta(seconds=2))
+    with client.websocket_connect(f"/ws/{user['id']}") as websocket:
+        websocket.receive_text()
+        websocket.send_text(json.dumps({"type": "auth", "token": token}))
+        assert json.loads(websocket.receive_text())["ok"] is True
+        websocket.send_text(json.dumps({"type": "list", "id": "c1", "kind": "single"}))
+        assert _frames_until(websocket, "reply")[-1]["ok"] is True
+
+        time.sleep(max(0.0, jwt.get_unverified_claims(token)["exp"] - time.time()) + 0.05)
+        websocket.send_text(json.dumps({"type": "list", "id": "c2", "kind": "single"}))
+        assert _frames_until(websocket, "reply")[-1] == {
+            "type": "reply", "id": "c2", "ok": False, "status": 401, "error": "Token expired; send a new auth message"}
+
+        # A fresh token re-authenticates the same socket
+        websocket.send_text(json.dumps({"type": "auth", "token": user["token"]}))
+        assert _frames_until(websocket, "auth")[-1]["ok"] is True
+        websocket.send_text(json.dumps({"type": "list", "id": "c3", "kind": "single"}))
+        assert _frames_until(websocket, "reply")[-1]["ok"] is True
+
+
+def test_auth_for_another_users_socket_is_refused(client, user):
+    with client.websocket_connect("/ws/someone-else") as websocket:
+        websocket.receive_text()
+        websocket.send_text(json.dumps({"type": "auth", "token": user["token"]}))
+        assert json.loads(websocket.receive_text())["ok"] is False